@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MyApp.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# serves requests side by side instead of one at a time, see myapp.aio
+from myapp.aio import ConcurrentASGIHandler  # noqa: E402
+
+application = ConcurrentASGIHandler()
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import datetime
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -48,22 +49,36 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'myapp.compression.CompressionMiddleware',
+    'myapp.instrumentation.InstrumentationMiddleware',
+    'myapp.nplusone.NPlusOneMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'myapp.replication.ReplicaMiddleware',
+    'myapp.replay.RequestLogMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'MyApp.urls'
 
+# Keep compiled templates in memory instead of reading and parsing them on every render.
+# Off while DEBUG, so template edits show up without a restart.
+CACHED_TEMPLATES = not DEBUG
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)] if CACHED_TEMPLATES
+            else TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -84,7 +99,69 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 60,
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+        'CONN_MAX_AGE': 60,
+    },
+}
+
+# Aliases of DATABASES that myapp.replication.ReplicaRouter sends the reads
+# of requests to; empty reads everything from the primary. Users read from
+# the primary for REPLICATION_LAG seconds after they wrote.
+DATABASE_REPLICAS = []
+REPLICATION_LAG = 5
+DATABASE_ROUTERS = ['myapp.replication.ReplicaRouter']
+
+# Applied to every new SQLite connection (myapp.db). In WAL mode readers
+# never wait for the writer; busy_timeout (ms) makes writers queue for the
+# lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,  # KiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+# Write transactions that still find the database busy are started over
+# this many times, after a random backoff of up to SQLITE_BUSY_BACKOFF * 2^n s.
+SQLITE_BUSY_RETRIES = 5
+SQLITE_BUSY_BACKOFF = 0.01
+
+
+# Invalidation (myapp.caching) bumps version keys in this cache, so every
+# worker process must share it: a per-process cache such as LocMemCache would
+# keep serving what other workers invalidated. Tests run in one process and
+# use LocMemCache.
+if sys.argv[1:2] == ['test']:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'myapp',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(BASE_DIR, 'cache'),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
     }
+
+# Seconds rendered pages (anonymous visitors only), post cards, API payloads,
+# verified access tokens and rendered comment pages are kept; invalidation on writes does not depend
+# on them.
+CACHE_TIMEOUTS = {
+    'page': 300,
+    'card': 24 * 60 * 60,
+    'api': 300,
+    'auth': 300,
+    'comments': 300,
 }
 
 
@@ -125,18 +202,103 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+STATICFILES_STORAGE = 'myapp.storage.HashedStaticFilesStorage'
 
 TEMPLATE_DIRS = (os.path.join(BASE_DIR,  'templates'),)
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'myapp/media')
 
+# Static files and media are served by myapp.files. Media that is not
+# content-addressed may be cached for MEDIA_MAX_AGE seconds. SENDFILE_HEADER
+# ('X-Accel-Redirect' for nginx, 'X-Sendfile' for Apache) leaves sending the
+# file to the front-end server; for nginx, SENDFILE_URL followed by the request
+# path must be an internal location aliasing the same directory.
+MEDIA_MAX_AGE = 24 * 60 * 60
+SENDFILE_HEADER = None
+SENDFILE_URL = '/internal'
+
+# Responses of at least COMPRESSION_MIN_SIZE bytes are compressed by
+# myapp.compression, with brotli when the brotli package is installed.
+COMPRESSION_MIN_SIZE = 512
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+# Keyset pagination of post feeds (?cursor=...&page_size=...)
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+# Comments per page on show_post and /api/posts/comments/get/<id>/
+COMMENT_PAGE_SIZE = 50
+
+# Rows per chunk of the NDJSON exports (/api/export/posts/, /api/export/comments/)
+EXPORT_CHUNK_SIZE = 2000
+
+# Bulk endpoints (/api/posts/bulk/, /api/posts/comments/bulk/): items per
+# request and rows per INSERT
+BULK_MAX_ITEMS = 5000
+BULK_BATCH_SIZE = 500
+
+# Like/dislike counters: posts voted on more than VOTE_HOT_THRESHOLD times per
+# VOTE_FLUSH_INTERVAL seconds have their increments batched in memory.
+VOTE_HOT_THRESHOLD = 20
+VOTE_FLUSH_INTERVAL = 1.0
+VOTE_FLUSH_SIZE = 500
+
+# Full-text search over post titles and texts. Use
+# 'myapp.search.InvertedIndexBackend' on databases without FTS5.
+SEARCH_BACKEND = 'myapp.search.SQLiteFTSBackend'
+
+# Thumbnails of uploaded images are rendered in the background. 'pool' uses a
+# local process pool once the upload is committed, 'worker' leaves the jobs to
+# `manage.py process_image_jobs`, 'eager' renders inside the request.
+IMAGE_JOBS_MODE = 'pool'
+IMAGE_JOBS_WORKERS = 2
+IMAGE_JOBS_MAX_ATTEMPTS = 3
+IMAGE_THUMBNAIL_SIZES = {
+    'card': (600, 600),
+    'detail': (1200, 1200),
+    'avatar': (300, 300),
+}
+# Responsive derivatives of post images, served through {% responsive_image %}.
+# Formats Pillow cannot write are skipped.
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 960, 1280)
+IMAGE_DERIVATIVE_FORMATS = ('avif', 'webp')
+
+# Chunked, resumable uploads (/api/uploads/): the largest file, the largest
+# chunk per request, the buffer chunks are streamed to disk with and the
+# seconds an unfinished upload is kept (`manage.py expire_uploads`).
+UPLOAD_MAX_SIZE = 50 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_BUFFER_SIZE = 64 * 1024
+UPLOAD_EXPIRY = 24 * 60 * 60
+
+# Under ASGI (MyApp/asgi.py) requests are served on ASGI_REQUEST_THREADS
+# threads and the queries of async views run on ASGI_DATABASE_THREADS more.
+ASGI_REQUEST_THREADS = 32
+ASGI_DATABASE_THREADS = 16
+
+# Share of requests profiled by myapp.instrumentation into the histograms
+# served at /api/metrics/ (staff only); 0 turns profiling off.
+METRICS_SAMPLE_RATE = 0.05
+
+# myapp.nplusone reports queries of one shape that a request runs at least
+# NPLUSONE_THRESHOLD times: 'log', 'raise' (fail the request) or None. Off
+# under `manage.py test`; tests opt in with override_settings or
+# api.testing.NPlusOneAssertionsMixin.
+NPLUSONE_MODE = 'log' if DEBUG and sys.argv[1:2] != ['test'] else None
+NPLUSONE_THRESHOLD = 3
+
+# Requests are appended here in the format read by `manage.py replay_requests`
+# (see myapp.replay); None records nothing.
+REQUEST_LOG_PATH = None
+
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated",],
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.CachedJWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ]
 }
\ No newline at end of file
@@ -1,7 +1,15 @@
+import re
+
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from myapp import files
+
+
+def serve_files(prefix, view):
+    return re_path(r'^{}(?P<path>.*)$'.format(re.escape(prefix.lstrip('/'))), view)
+
 
 urlpatterns = [
     path('', include('myapp.urls')),
@@ -10,6 +18,6 @@ urlpatterns = [
 
 ]
 
-urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+urlpatterns += [serve_files(settings.STATIC_URL, files.serve_static)]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+urlpatterns += [serve_files(settings.MEDIA_URL, files.serve_media)]
@@ -0,0 +1,53 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from myapp import caching, replication
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` that verifies each access token once.
+
+    The user and claims of a verified token are cached under the digest of
+    the raw token until the token expires (at most
+    ``CACHE_TIMEOUTS['auth']``), so later requests with the same token skip
+    the signature check and the user query. Saving or deleting the user
+    drops the cached entries through the ``user:<id>`` namespace version.
+    ``request.auth`` is the dict of claims.
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        key = 'auth:' + hashlib.sha256(raw_token).hexdigest()
+        entry = cache.get(key)
+        if entry is not None:
+            user, claims, version = entry
+            namespace = caching.user_namespace(user.pk)
+            if claims['exp'] > time.time() and caching.get_versions([namespace])[namespace] == version:
+                caching.record('auth', 1, 0)
+                replication.read_own_writes(user.pk)
+                return user, claims
+        caching.record('auth', 0, 1)
+
+        validated_token = self.get_validated_token(raw_token)
+        claims = validated_token.payload
+        # read before the user, so a save in between is not cached as current
+        namespace = caching.user_namespace(claims.get(api_settings.USER_ID_CLAIM))
+        version = caching.get_versions([namespace])[namespace]
+        user = self.get_user(validated_token)
+        timeout = min(claims['exp'] - time.time(), settings.CACHE_TIMEOUTS['auth'])
+        if timeout > 0:
+            cache.set(key, (user, claims, version), timeout)
+        replication.read_own_writes(user.pk)
+        return user, claims
@@ -1,24 +1,81 @@
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 from myapp.models import Post, Comment
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class EagerLoadingMixin:
+    """
+    Lets a serializer declare the relations it reads so views can build a
+    queryset that loads them up front instead of once per row.
+
+    Nested ``many=True`` serializers are prefetched automatically, using the
+    nested serializer's own eager queryset.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        prefetches = list(cls.prefetch_related_fields)
+        for field in cls().fields.values():
+            child = getattr(field, 'child', None)
+            if isinstance(child, EagerLoadingMixin):
+                nested = child.setup_eager_loading(child.Meta.model.objects.all())
+                prefetches.append(Prefetch(field.source, queryset=nested))
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        return queryset
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves ids from ``context['preloaded'][field_name]`` (an ``in_bulk``
+    dict) when a bulk view has loaded them up front, instead of running one
+    query per item.
+    """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get('preloaded', {}).get(self.field_name)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return preloaded[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class CommentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    # ``user`` and ``post`` are rendered as primary keys, which DRF reads from
+    # ``user_id``/``post_id`` without touching the related rows.
+    post = PreloadedPrimaryKeyRelatedField(queryset=Post.objects.all())
+
     class Meta:
         model = Comment
         fields = ('user', "text", 'post', 'created_date')
+        read_only_fields = ('user',)
 
 
-class PostSerializer(serializers.ModelSerializer):
-    comments = CommentSerializer(many=True)
+class PostSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    comments = CommentSerializer(many=True, read_only=True)
+    # the card thumbnail of the first image, read from the post row itself
+    cover = serializers.ImageField(source='cover_card', read_only=True)
 
     class Meta:
         model = Post
         fields = ('user', "title", "text",
                   'likes', 'dislikes',
-                  'created_date', 'comments', 'id')
+                  'created_date', 'comments', 'id',
+                  'comment_count', 'image_count', 'cover')
+        read_only_fields = ('user', 'likes', 'dislikes', 'comment_count', 'image_count')
 
     def create(self, validated_data):
         try:
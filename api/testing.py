@@ -0,0 +1,95 @@
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from myapp import nplusone
+from .authentication import CachedJWTAuthentication
+
+
+def authenticate(client, username, password):
+    """
+    Obtain an access token for ``client`` and verify it once, so the user
+    is already cached and later query counts only cover the view.
+    """
+    response = client.post('/api/token/get/', {'username': username, 'password': password})
+    header = 'Bearer ' + response.data['access']
+    client.credentials(HTTP_AUTHORIZATION=header)
+    CachedJWTAuthentication().authenticate(RequestFactory().get('/', HTTP_AUTHORIZATION=header))
+
+
+@contextmanager
+def run_commit_hooks():
+    """
+    Run the ``transaction.on_commit`` callbacks registered inside the block
+    (vote counts, for one), which a ``TestCase``'s transaction never commits.
+    """
+    start = len(connection.run_on_commit)
+    try:
+        yield
+    finally:
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for _, callback in callbacks:
+            callback()
+
+class QueryCountAssertionsMixin:
+    """TestCase mixin for catching per-row (N+1) queries."""
+
+    def assertConstantQueries(self, func, grow, num=None):
+        """
+        Call ``func``, let ``grow`` add more rows, call ``func`` again and
+        assert that both calls ran the same number of queries (and exactly
+        ``num`` of them when given).
+        """
+        with CaptureQueriesContext(connection) as before:
+            func()
+        grow()
+        with CaptureQueriesContext(connection) as after:
+            func()
+        queries = '\n'.join(query['sql'] for query in after.captured_queries)
+        self.assertEqual(
+            len(before), len(after),
+            '{} queries grew to {} as data grew:\n{}'.format(len(before), len(after), queries)
+        )
+        if num is not None:
+            self.assertEqual(num, len(after), '{} queries executed, {} expected:\n{}'.format(
+                len(after), num, queries))
+
+
+class QueryPlanAssertionsMixin:
+    """TestCase mixin that checks the SQLite query plans of the queries a call runs."""
+
+    def query_plans(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plans.append((query['sql'], [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def assertUsesIndexes(self, func):
+        """
+        Fail if any SELECT run by ``func`` reads a whole table, or sorts its
+        rows for ORDER BY, instead of walking an index.
+        """
+        for sql, plan in self.query_plans(func):
+            for step in plan:
+                full_scan = step.startswith('SCAN ') and ' USING ' not in step and 'VIRTUAL TABLE' not in step
+                if full_scan or step.startswith('USE TEMP B-TREE FOR ORDER BY'):
+                    self.fail('{} in:\n{}\n{}'.format(step, sql, '\n'.join(plan)))
+
+
+class NPlusOneAssertionsMixin:
+    """TestCase mixin that fails on queries repeated once per row (see ``myapp.nplusone``)."""
+
+    def assertNoNPlusOne(self, func, threshold=None):
+        with nplusone.detect() as collector:
+            func()
+        problems = collector.problems(threshold)
+        if problems:
+            self.fail('N+1 queries:\n' + nplusone.describe(problems))
@@ -1,3 +1,317 @@
-from django.test import TestCase
+import datetime
+import json
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APITestCase
+
+from myapp import instrumentation
+from myapp.models import Post, Comment
+from myapp.search import search_posts
+from .testing import QueryCountAssertionsMixin, QueryPlanAssertionsMixin, authenticate
+
+
+class PostsPaginationTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='paginated', password='test12345')
+        for number in range(5):
+            Post.objects.create(user=cls.user, title='Post {}'.format(number), text='Text {}'.format(number))
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post('/api/token/get/', {'username': 'paginated', 'password': 'test12345'})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+    def titles(self, response):
+        return [post['title'] for post in response.data['results']]
+
+    def test_walk_pages_forward_and_back(self):
+        response = self.client.get('/api/posts/', {'page_size': 2})
+        self.assertEqual(self.titles(response), ['Post 0', 'Post 1'])
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get('/api/posts/', {'page_size': 2, 'cursor': response.data['next']})
+        self.assertEqual(self.titles(response), ['Post 2', 'Post 3'])
+
+        last = self.client.get('/api/posts/', {'page_size': 2, 'cursor': response.data['next']})
+        self.assertEqual(self.titles(last), ['Post 4'])
+        self.assertIsNone(last.data['next'])
+
+        response = self.client.get('/api/posts/', {'page_size': 2, 'cursor': last.data['previous']})
+        self.assertEqual(self.titles(response), ['Post 2', 'Post 3'])
+        response = self.client.get('/api/posts/', {'page_size': 2, 'cursor': response.data['previous']})
+        self.assertEqual(self.titles(response), ['Post 0', 'Post 1'])
+        self.assertIsNone(response.data['previous'])
+
+    def test_ties_on_created_date_are_broken_by_id(self):
+        Post.objects.update(created_date=Post.objects.first().created_date)
+        seen = []
+        cursor = None
+        while True:
+            params = {'page_size': 2}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get('/api/posts/own/', params)
+            seen += self.titles(response)
+            cursor = response.data['next']
+            if not cursor:
+                break
+        self.assertEqual(seen, ['Post {}'.format(number) for number in range(5)])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/posts/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PostsQueryCountTest(QueryCountAssertionsMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='test12345')
+        cls.post = Post.objects.create(user=cls.user, title='First', text='Text')
+        Comment.objects.create(user=cls.user, post=cls.post, text='Comment')
+
+    def setUp(self):
+        cache.clear()
+        authenticate(self.client, 'reader', 'test12345')
+
+    def add_posts_with_comments(self):
+        for number in range(5):
+            post = Post.objects.create(user=self.user, title='More {}'.format(number), text='Text')
+            for _ in range(3):
+                Comment.objects.create(user=self.user, post=post, text='Comment')
+
+    def add_comments(self):
+        for _ in range(5):
+            Comment.objects.create(user=self.user, post=self.post, text='Comment')
+
+    def test_posts_feed(self):
+        # posts page, comments prefetch
+        self.assertConstantQueries(lambda: self.client.get('/api/posts/'), self.add_posts_with_comments, num=2)
+
+    def test_own_posts(self):
+        self.assertConstantQueries(lambda: self.client.get('/api/posts/own/'), self.add_posts_with_comments)
+
+    def test_get_comments(self):
+        # one page of comments, the post is only checked for an empty page
+        url = '/api/posts/comments/get/{}/'.format(self.post.pk)
+        self.assertConstantQueries(lambda: self.client.get(url), self.add_comments, num=1)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='analyst', password='test12345')
+        cls.started = datetime.datetime(2020, 3, 1, tzinfo=datetime.timezone.utc)
+        for number in range(5):
+            post = Post.objects.create(user=cls.user, title='Post {}'.format(number), text='Text',
+                                       created_date=cls.started + datetime.timedelta(days=number))
+            Comment.objects.create(user=cls.user, post=post, text='Comment {}'.format(number),
+                                   created_date=post.created_date)
+
+    def setUp(self):
+        response = self.client.post('/api/token/get/', {'username': 'analyst', 'password': 'test12345'})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+    def rows(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        chunks = [chunk.decode() for chunk in response.streaming_content]
+        self.assertTrue(all(chunk.endswith('\n') for chunk in chunks))
+        return [json.loads(line) for line in ''.join(chunks).splitlines()]
+
+    def test_export_posts(self):
+        rows = self.rows(self.client.get('/api/export/posts/'))
+        self.assertEqual([row['title'] for row in rows], ['Post {}'.format(number) for number in range(5)])
+        self.assertEqual(rows[0]['comment_count'], 1)
+
+    def test_export_since(self):
+        since = (self.started + datetime.timedelta(days=3)).isoformat()
+        rows = self.rows(self.client.get('/api/export/comments/', {'since': since}))
+        self.assertEqual([row['text'] for row in rows], ['Comment 3', 'Comment 4'])
+        self.assertEqual(set(rows[0]), {'id', 'user', 'post', 'text', 'created_date'})
+
+    def test_export_invalid_since(self):
+        self.assertEqual(self.client.get('/api/export/posts/', {'since': 'yesterday'}).status_code, 400)
+
+    def test_export_requires_authentication(self):
+        self.client.credentials()
+        self.assertEqual(self.client.get('/api/export/posts/').status_code, 401)
+
+
+class BulkCreateTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='importer', password='test12345')
+        cls.post = Post.objects.create(user=cls.user, title='Existing', text='Text')
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post('/api/token/get/', {'username': 'importer', 'password': 'test12345'})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+    def test_bulk_posts(self):
+        items = [{'title': 'Imported {}'.format(number), 'text': 'Text'} for number in range(3)]
+        items.insert(1, {'title': 'No text'})
+        # user, savepoint, insert, ids, search index (2), release
+        with self.assertNumQueries(7):
+            response = self.client.post('/api/posts/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1])
+        self.assertIn('text', response.data['errors'][0]['errors'])
+        created = Post.objects.filter(pk__in=response.data['created']).order_by('pk')
+        self.assertEqual([post.title for post in created], ['Imported 0', 'Imported 1', 'Imported 2'])
+        self.assertTrue(all(post.user_id == self.user.pk for post in created))
+        self.assertEqual(search_posts('imported')[0].pk, response.data['created'][0])
+
+    def test_bulk_comments(self):
+        items = [{'post': self.post.pk, 'text': 'Comment {}'.format(number)} for number in range(50)]
+        items += [{'post': 0, 'text': 'Missing post'}, {'post': 'x', 'text': 'Bad id'}]
+        response = self.client.post('/api/posts/comments/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(len(response.data['created']), 50)
+        self.assertEqual([error['index'] for error in response.data['errors']], [50, 51])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 50)
+        comments = self.client.get('/api/posts/comments/get/{}/'.format(self.post.pk))
+        self.assertEqual(len(comments.data['results']), 50)
+
+    def test_bulk_rejects_non_list(self):
+        response = self.client.post('/api/posts/bulk/', {'title': 'One', 'text': 'Text'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/posts/bulk/', [{'title': 'Bad'}], format='json')
+        self.assertEqual((response.status_code, response.data['created']), (400, []))
+
+
+class CachedAuthenticationTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='token', password='test12345')
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post('/api/token/get/', {'username': 'token', 'password': 'test12345'})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+
+    def test_user_is_looked_up_once_per_token(self):
+        with self.assertNumQueries(2):  # user, posts page
+            self.client.get('/api/posts/own/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/posts/own/').status_code, 200)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/posts/own/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/posts/own/').status_code, 401)
+
+    def test_tampered_token_is_rejected(self):
+        response = self.client.post('/api/token/get/', {'username': 'token', 'password': 'test12345'})
+        token = response.data['access']
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+        self.client.get('/api/posts/own/')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token[:-2] + ('AA' if token[-2:] != 'AA' else 'BB'))
+        self.assertEqual(self.client.get('/api/posts/own/').status_code, 401)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Reads SQLite query plans')
+class HotQueryPlanTest(QueryPlanAssertionsMixin, APITestCase):
+    """Every query behind the feeds, post pages, comments and exports uses an index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='planner', password='test12345')
+        other = User.objects.create_user(username='other', password='test12345')
+        for number in range(30):
+            post = Post.objects.create(user=(cls.user, other)[number % 2], title='Post {}'.format(number), text='Text')
+            Comment.objects.create(user=other, post=post, text='Comment')
+        cls.post = post
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='planner', password='test12345')
+        authenticate(self.client, 'planner', 'test12345')
+
+    def get_pages(self, url):
+        response = self.client.get(url, {'page_size': 5})
+        cursor = response.data['next'] if hasattr(response, 'data') else response.context['page'].next_cursor
+        self.client.get(url, {'page_size': 5, 'cursor': cursor})
+
+    def test_feeds(self):
+        for url in ('/', '/account/', '/api/posts/', '/api/posts/own/'):
+            with self.subTest(url=url):
+                self.assertUsesIndexes(lambda: self.get_pages(url))
+
+    def test_post_and_comments(self):
+        self.assertUsesIndexes(lambda: self.client.get('/show_post/{}'.format(self.post.pk)))
+        self.assertUsesIndexes(lambda: self.client.get('/api/posts/comments/get/{}/'.format(self.post.pk)))
+
+    def test_exports(self):
+        since = self.post.created_date.isoformat()
+        for url in ('/api/export/posts/', '/api/export/comments/'):
+            with self.subTest(url=url):
+                self.assertUsesIndexes(lambda: b''.join(self.client.get(url, {'since': since}).streaming_content))
+
+    def test_plans_name_the_composite_indexes(self):
+        plans = self.query_plans(lambda: self.client.get('/api/posts/own/'))
+        self.assertTrue(any('post_user_created_idx' in step for _, plan in plans for step in plan), plans)
+
+
+@override_settings(METRICS_SAMPLE_RATE=1)
+class InstrumentationTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='measured', password='test12345')
+        cls.admin = User.objects.create_user(username='admin', password='test12345', is_staff=True)
+        cls.post = Post.objects.create(user=cls.user, title='Measured', text='Text')
+        Comment.objects.create(user=cls.user, post=cls.post, text='Comment')
+
+    def setUp(self):
+        cache.clear()
+        instrumentation.reset()
+
+    def test_requests_are_aggregated_per_url_name(self):
+        self.client.get('/show_post/{}'.format(self.post.pk))
+        authenticate(self.client, 'measured', 'test12345')
+        self.client.get('/api/posts/')
+        self.client.get('/api/posts/')
+
+        histograms = instrumentation.histograms()
+        show_post, posts = histograms['myapp:show_post'], histograms['posts']
+        self.assertEqual(show_post['request_duration_seconds']['count'], 1)
+        self.assertGreater(show_post['sql_queries']['sum'], 0)
+        self.assertGreater(show_post['template_duration_seconds']['sum'], 0)
+        self.assertEqual(posts['request_duration_seconds']['count'], 2)
+        self.assertGreater(posts['serializer_duration_seconds']['sum'], 0)
+        self.assertEqual(posts['cache']['api'], {'hit': 1, 'miss': 1})
+        self.assertEqual(posts['request_duration_seconds']['buckets'][-1], ['+Inf', 2])
+
+    def test_metrics_are_served_to_staff_only(self):
+        self.client.get('/api/posts/')
+        authenticate(self.client, 'measured', 'test12345')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        authenticate(self.client, 'admin', 'test12345')
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE myapp_request_duration_seconds histogram', text)
+        self.assertIn('myapp_request_duration_seconds_count{view="posts"} 1', text)
+        self.assertIn('myapp_sql_queries_bucket{view="posts",le="+Inf"} 1', text)
+        histograms = self.client.get('/api/metrics/histograms/').data
+        self.assertEqual(histograms['posts']['request_duration_seconds']['count'], 1)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_recorded(self):
+        self.client.get('/show_post/{}'.format(self.post.pk))
+        self.assertEqual(instrumentation.histograms(), {})
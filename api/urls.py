@@ -11,9 +11,18 @@ urlpatterns = [
     path('login/', views.LogInView.as_view(), name='api_login'),
     path('register/', views.register, name='api_register'),
     path('posts/add/', views.add_post, name='add_post'),
+    path('posts/bulk/', views.bulk_add_posts, name='bulk_add_posts'),
     path('posts/delete/<int:id>/', views.delete_post, name='delete_post'),
     path('posts/like/<int:id>/', views.like_post, name='like_post'),
     path('posts/dislike/<int:id>/', views.dislike_post, name='dislike_post'),
     path('posts/comments/get/<int:id>/', views.get_comments, name='get_comments'),
-    path('posts/comments/add/<int:id>/', views.add_comment, name='add_comment')
+    path('posts/comments/add/<int:id>/', views.add_comment, name='add_comment'),
+    path('posts/comments/bulk/', views.bulk_add_comments, name='bulk_add_comments'),
+    path('export/posts/', views.export_posts, name='export_posts'),
+    path('export/comments/', views.export_comments, name='export_comments'),
+    path('uploads/', views.start_upload, name='start_upload'),
+    path('uploads/<uuid:id>/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<uuid:id>/complete/', views.complete_upload, name='complete_upload'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('metrics/histograms/', views.metrics_histograms, name='metrics_histograms'),
 ]
@@ -1,60 +1,130 @@
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import status
-from rest_framework_jwt.settings import api_settings
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 
-from myapp.models import Post, Comment
+from myapp import aggregates, caching, counters, instrumentation, search, uploads
+from myapp.aio import async_view, database_sync_to_async
+from myapp.db import bulk_insert, retry_on_busy
+from myapp.models import Post, Comment, Upload, Vote
+from myapp.pagination import InvalidCursor, get_page_size, paginate_keyset
+from .authentication import CachedJWTAuthentication
 from .serializers import PostSerializer, UserSerializer, LoginSerializer, CommentSerializer
 
-jwt_payload_handler = api_settings.JWT_PAYLOAD_HANDLER
-jwt_encode_handler = api_settings.JWT_ENCODE_HANDLER
-jwt_decode_handler = api_settings.JWT_DECODE_HANDLER
+
+def paginated_posts(request, queryset, scope):
+    cursor = request.GET.get('cursor')
+    page_size = get_page_size(request)
+
+    def serialize():
+        page = paginate_keyset(PostSerializer.setup_eager_loading(queryset), cursor, page_size)
+        return {
+            'results': PostSerializer(page.object_list, many=True).data,
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        }
+
+    try:
+        data = caching.cached('api', [caching.POSTS], (scope, cursor, page_size), serialize)
+    except InvalidCursor:
+        return Response('Invalid cursor', status.HTTP_400_BAD_REQUEST)
+    return Response(data=data, status=status.HTTP_200_OK)
+
+
+EXPORT_POST_FIELDS = ('id', 'user', 'title', 'text', 'likes', 'dislikes', 'created_date',
+                      'comment_count', 'image_count')
+EXPORT_COMMENT_FIELDS = ('id', 'user', 'post', 'text', 'created_date')
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def ndjson_rows(queryset, fields):
+    """
+    Yield ``queryset`` as newline-delimited JSON, ``EXPORT_CHUNK_SIZE`` rows
+    per chunk. Rows are plain ``values()`` tuples streamed through
+    ``iterator()``, so memory does not grow with the table.
+    """
+    encoder = DjangoJSONEncoder()
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    lines = []
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        lines.append(encoder.encode(dict(zip(fields, row))))
+        if len(lines) == chunk_size:
+            lines.append('')
+            yield '\n'.join(lines)
+            lines = []
+    if lines:
+        lines.append('')
+        yield '\n'.join(lines)
+
+
+def export(request, queryset, fields):
+    since = request.GET.get('since')
+    if since:
+        try:
+            since = parse_datetime(since)
+        except ValueError:
+            since = None
+        if since is None:
+            return Response('Invalid since', status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        # inclusive, so rows sharing the last exported timestamp are not lost; dedupe on id
+        queryset = queryset.filter(created_date__gte=since)
+    response = StreamingHttpResponse(
+        ndjson_rows(queryset.order_by('created_date', 'id'), fields), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="{}.ndjson"'.format(queryset.model._meta.model_name)
+    return response
 
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
-def posts(request):
-    queryset = Post.objects.all()
-    return Response(
-        data=PostSerializer(queryset, many=True).data,
-        status=status.HTTP_200_OK
-    )
+def export_posts(request):
+    return export(request, Post.objects.all(), EXPORT_POST_FIELDS)
 
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
-def user_posts(request):
-    token = request.META.get('HTTP_AUTHORIZATION', " ").split(' ')[1]
-    payload = jwt_decode_handler(token)
-    user_id = payload['user_id']
-    try:
-        user = User.objects.get(pk=user_id)
-        posts = Post.objects.filter(user=user).all()
-        return Response(
-            data=PostSerializer(posts, many=True).data,
-            status=status.HTTP_200_OK
-        )
-    except Exception:
-        return Response(status.HTTP_400_BAD_REQUEST)
+def export_comments(request):
+    return export(request, Comment.objects.all(), EXPORT_COMMENT_FIELDS)
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@caching.condition_on_versions(lambda request: [caching.POSTS])
+@async_view
+async def posts(request):
+    return await database_sync_to_async(paginated_posts)(request, Post.objects.all(), 'all')
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+@caching.condition_on_versions(lambda request: [caching.POSTS])
+@async_view
+async def user_posts(request):
+    return await database_sync_to_async(paginated_posts)(
+        request, Post.objects.filter(user=request.user), 'user:{}'.format(request.user.pk))
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def add_post(request):
-    token = request.META.get('HTTP_AUTHORIZATION', " ").split(' ')[1]
-    payload = jwt_decode_handler(token)
-    user_id = payload['user_id']
     try:
-        user = User.objects.get(pk=user_id)
-        post = Post(user=user, title=request.data['title'], text=request.data['text'])
+        post = Post(user=request.user, title=request.data['title'], text=request.data['text'])
         post.save()
         return Response(
             'Success',
@@ -64,14 +134,88 @@ def add_post(request):
         return Response('Error', status.HTTP_401_UNAUTHORIZED)
 
 
+def bulk_create(request, serializer_class, context=None):
+    """
+    Validate every item of the request's JSON array with ``serializer_class``
+    and insert the valid ones, owned by ``request.user``; call inside a
+    transaction. Returns ``(objects, response)``, invalid items are
+    reported by their index.
+    """
+    items = request.data
+    if not isinstance(items, list):
+        return None, Response('Expected a list', status.HTTP_400_BAD_REQUEST)
+    if len(items) > settings.BULK_MAX_ITEMS:
+        return None, Response('At most {} items'.format(settings.BULK_MAX_ITEMS), status.HTTP_400_BAD_REQUEST)
+
+    model = serializer_class.Meta.model
+    objects, errors = [], []
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item, context=context or {})
+        if serializer.is_valid():
+            objects.append(model(user=request.user, **serializer.validated_data))
+        else:
+            errors.append({'index': index, 'errors': serializer.errors})
+    if not objects:
+        return objects, Response({'created': [], 'errors': errors}, status.HTTP_400_BAD_REQUEST)
+    bulk_insert(model, objects)
+    return objects, Response(
+        {'created': [obj.pk for obj in objects], 'errors': errors},
+        status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED
+    )
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def bulk_add_posts(request):
+    @retry_on_busy
+    def create():
+        posts, response = bulk_create(request, PostSerializer)
+        if posts:
+            # bulk_create sends no post_save, which indexes posts
+            search.get_backend().index_many(posts)
+        return posts, response
+
+    posts, response = create()
+    if posts:
+        caching.bump(caching.POSTS)
+    return response
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def bulk_add_comments(request):
+    post_ids = set()
+    if isinstance(request.data, list):
+        for item in request.data:
+            if isinstance(item, dict) and isinstance(item.get('post'), (int, str)):
+                post_ids.add(item['post'])
+    valid_ids = [pk for pk in post_ids if str(pk).isdigit()]
+    context = {'preloaded': {'post': Post.objects.only('pk').in_bulk(valid_ids)}}
+
+    @retry_on_busy
+    def create():
+        comments, response = bulk_create(request, CommentSerializer, context)
+        touched = {comment.post_id for comment in comments or ()}
+        if touched:
+            # bulk_create sends no post_save, which keeps comment_count
+            aggregates.rebuild(Post.objects.filter(pk__in=touched))
+        return touched, response
+
+    touched, response = create()
+    if touched:
+        caching.bump(caching.POSTS, *(caching.post_namespace(pk) for pk in touched))
+    return response
+
+
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def like_post(request, id):
     try:
-        post = Post.objects.get(pk=id)
-        post.likes += 1
-        post.save()
+        post = Post.objects.only('pk').get(pk=id)
+        counters.vote(request.user, post.pk, Vote.LIKE)
         return Response(
             'Success',
             status=status.HTTP_201_CREATED
@@ -81,13 +225,12 @@ def like_post(request, id):
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def dislike_post(request, id):
     try:
-        post = Post.objects.get(pk=id)
-        post.dislikes += 1
-        post.save()
+        post = Post.objects.only('pk').get(pk=id)
+        counters.vote(request.user, post.pk, Vote.DISLIKE)
         return Response(
             'Success',
             status=status.HTTP_201_CREATED
@@ -97,15 +240,12 @@ def dislike_post(request, id):
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def delete_post(request, id):
     try:
         post = Post.objects.get(pk=id)
-        token = request.META.get('HTTP_AUTHORIZATION', " ").split(' ')[1]
-        payload = jwt_decode_handler(token)
-        user_id = payload['user_id']
-        if post.user.pk == user_id:
+        if post.user_id == request.user.pk:
             post.delete()
             return Response(
                 'Success',
@@ -117,32 +257,45 @@ def delete_post(request, id):
         return Response('Error', status.HTTP_400_BAD_REQUEST)
 
 
+def comments_payload(id, cursor, page_size):
+    def serialize():
+        page = paginate_keyset(CommentSerializer.setup_eager_loading(Comment.objects.filter(post_id=id)),
+                               cursor, page_size)
+        # a page with comments proves the post exists, only an empty one needs the extra query
+        if not page.object_list and not Post.objects.filter(pk=id).exists():
+            raise Post.DoesNotExist
+        return {
+            'results': CommentSerializer(page.object_list, many=True).data,
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        }
+
+    return caching.cached('api', [caching.post_namespace(id)], ('comments', id, cursor, page_size), serialize)
+
+
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
-def get_comments(request, id):
+@caching.condition_on_versions(lambda request, id: [caching.post_namespace(id)])
+@async_view
+async def get_comments(request, id):
+    cursor, page_size = request.GET.get('cursor'), get_page_size(request, settings.COMMENT_PAGE_SIZE)
     try:
-        post = Post.objects.get(pk=id)
-        comments = Comment.objects.filter(post=post).all()
-        return Response(
-            data=CommentSerializer(comments, many=True).data,
-            status=status.HTTP_200_OK
-        )
+        data = await database_sync_to_async(comments_payload)(id, cursor, page_size)
+    except InvalidCursor:
+        return Response('Invalid cursor', status.HTTP_400_BAD_REQUEST)
     except Exception:
         return Response('Error', status.HTTP_400_BAD_REQUEST)
+    return Response(data=data, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def add_comment(request, id):
-    token = request.META.get('HTTP_AUTHORIZATION', " ").split(' ')[1]
-    payload = jwt_decode_handler(token)
-    user_id = payload['user_id']
     try:
-        user = User.objects.get(pk=user_id)
-        post = Post.objects.get(pk=id)
-        comment = Comment(user=user, post=post, text=request.data['text'])
+        post = Post.objects.only('pk').get(pk=id)
+        comment = Comment(user=request.user, post=post, text=request.data['text'])
         comment.save()
         return Response(
             'Success',
@@ -152,6 +305,94 @@ def add_comment(request, id):
         return Response('Error', status.HTTP_401_UNAUTHORIZED)
 
 
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    return HttpResponse(instrumentation.prometheus(caching.stats()), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAdminUser])
+def metrics_histograms(request):
+    return Response(instrumentation.histograms())
+
+
+def upload_state(upload):
+    return {'id': upload.pk, 'offset': upload.received, 'size': upload.size,
+            'chunk_size': settings.UPLOAD_CHUNK_SIZE}
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def start_upload(request):
+    try:
+        upload = uploads.start(request.user, str(request.data['filename']), int(request.data['size']))
+    except (KeyError, TypeError, ValueError):
+        return Response('filename and size are required', status.HTTP_400_BAD_REQUEST)
+    except uploads.UploadError as exc:
+        return Response(str(exc), status.HTTP_400_BAD_REQUEST)
+    return Response(upload_state(upload), status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'PATCH', 'DELETE'])
+@authentication_classes([CachedJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def upload_chunk(request, id):
+    """
+    GET: where to resume. PATCH: append the raw body at the Upload-Offset
+    header, checked against Upload-Checksum (``sha256 <base64 digest>``).
+    DELETE: abort.
+    """
+    upload = Upload.objects.filter(pk=id, user=request.user).first()
+    if upload is None:
+        return Response('Not found', status.HTTP_404_NOT_FOUND)
+    if request.method == 'GET':
+        return Response(upload_state(upload))
+    if request.method == 'DELETE':
+        uploads.abort(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    try:
+        offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        algorithm, digest = uploads.parse_checksum(request.META['HTTP_UPLOAD_CHECKSUM'])
+        # the body is read straight from the request stream, never parsed or buffered whole
+        uploads.write_chunk(upload, offset, request.stream, length, algorithm, digest)
+    except (KeyError, ValueError):
+        return Response('Upload-Offset and Upload-Checksum headers are required', status.HTTP_400_BAD_REQUEST)
+    except uploads.OffsetMismatch as exc:
+        return Response({'offset': exc.offset}, status.HTTP_409_CONFLICT)
+    except uploads.UploadError as exc:
+        return Response(str(exc), status.HTTP_400_BAD_REQUEST)
+    return Response(upload_state(upload))
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def complete_upload(request, id):
+    """Attach the upload to ``{'post': <id>}`` as a new image or, with ``{'photo': true}``, as the profile photo."""
+    upload = Upload.objects.filter(pk=id, user=request.user).first()
+    if upload is None:
+        return Response('Not found', status.HTTP_404_NOT_FOUND)
+    try:
+        if request.data.get('post') is not None:
+            post = Post.objects.get(pk=request.data['post'], user=request.user)
+            image = uploads.finish(upload, post=post)
+            return Response({'image': image.pk, 'url': image.image.url}, status.HTTP_201_CREATED)
+        if request.data.get('photo'):
+            profile = uploads.finish(upload, profile=request.user.profile)
+            return Response({'photo': profile.photo.url}, status.HTTP_201_CREATED)
+    except (Post.DoesNotExist, ValueError):
+        return Response('Unknown post', status.HTTP_400_BAD_REQUEST)
+    except uploads.UploadError as exc:
+        return Response(str(exc), status.HTTP_400_BAD_REQUEST)
+    return Response('post or photo is required', status.HTTP_400_BAD_REQUEST)
+
+
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def register(request):
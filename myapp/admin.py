@@ -1,7 +1,10 @@
 from django.contrib import admin
-from .models import Profile, Post, Image, Comment
+from .models import Profile, Post, Image, Comment, Vote, ImageJob, ImageDerivative
 
 admin.site.register(Profile)
 admin.site.register(Post)
 admin.site.register(Image)
 admin.site.register(Comment)
+admin.site.register(Vote)
+admin.site.register(ImageJob)
+admin.site.register(ImageDerivative)
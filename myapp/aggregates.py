@@ -0,0 +1,68 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Comment, Image, Post
+
+# Post field -> Image field copied from the post's first image
+COVER_FIELDS = {
+    'cover_image': 'image',
+    'cover_card': 'card',
+    'cover_width': 'width',
+    'cover_height': 'height',
+    'cover_formats': 'formats',
+}
+
+
+def cover_expressions():
+    first_image = Image.objects.filter(post=OuterRef('pk')).order_by('pk')
+    expressions = {
+        field: Subquery(first_image.values(source)[:1]) for field, source in COVER_FIELDS.items()
+    }
+    expressions['cover_formats'] = Coalesce(expressions['cover_formats'], Value(''))
+    return expressions
+
+
+def count_expression(model):
+    counts = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(count=Count('pk'))
+    return Coalesce(Subquery(counts.values('count')), Value(0))
+
+
+def refresh_cover(post_id):
+    Post.objects.filter(pk=post_id).update(**cover_expressions())
+
+
+def rebuild(queryset=None):
+    """Recompute the counts and covers of ``queryset`` (all posts by default) in one UPDATE."""
+    if queryset is None:
+        queryset = Post.objects.all()
+    return queryset.update(
+        comment_count=count_expression(Comment),
+        image_count=count_expression(Image),
+        **cover_expressions()
+    )
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(comment_count=F('comment_count') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id, comment_count__gt=0).update(comment_count=F('comment_count') - 1)
+
+
+@receiver(post_save, sender=Image)
+def count_image(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(image_count=F('image_count') + 1)
+    refresh_cover(instance.post_id)
+
+
+@receiver(post_delete, sender=Image)
+def uncount_image(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id, image_count__gt=0).update(image_count=F('image_count') - 1)
+    refresh_cover(instance.post_id)
@@ -0,0 +1,133 @@
+"""
+Async read views on Django 3.0.
+
+Django 3.0 has neither async views nor an async ORM: the URL resolver calls
+views synchronously and the ORM refuses to run on an event loop. Views
+decorated with ``async_view`` are coroutines, and every database step runs
+through ``database_sync_to_async``. Under ``ConcurrentASGIHandler``
+(``MyApp/asgi.py``) the view is driven through ``async_to_sync``, those steps
+go to the thread pool and independent ones run concurrently with ``gather``.
+Under WSGI, the stock ASGI handler and the test client nothing would run
+concurrently anyway, so no event loop or thread is started: the coroutine is
+stepped inline and every step is a plain call on the request's own thread
+and connection, one after the other.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections, connection
+
+# True while serving a request through ConcurrentASGIHandler
+concurrent = contextvars.ContextVar('concurrent', default=False)
+
+# Requests and their queries get separate pools: a request thread blocks
+# until its queries are done, so sharing one pool can deadlock.
+_executors = {}
+
+
+def get_executor(name):
+    if name not in _executors:
+        _executors.setdefault(name, ThreadPoolExecutor(getattr(settings, name), thread_name_prefix=name.lower()))
+    return _executors[name]
+
+
+def database_sync_to_async(func, executor_name='ASGI_DATABASE_THREADS'):
+    """
+    ``sync_to_async`` for functions that use the ORM. Pool threads keep
+    their connection between calls, so stale ones are closed as Django
+    does around each request.
+    """
+    @wraps(func)
+    def inner(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    if concurrent.get():
+        return sync_to_async(inner, thread_sensitive=False, executor=get_executor(executor_name))
+
+    @wraps(func)
+    async def inline(*args, **kwargs):
+        return func(*args, **kwargs)
+    return inline
+
+
+async def gather(*awaitables):
+    """``asyncio.gather``, or one after the other when there is no event loop."""
+    if concurrent.get():
+        return await asyncio.gather(*awaitables)
+    return [await awaitable for awaitable in awaitables]
+
+
+def run_inline(coroutine):
+    """Run a coroutine that never suspends, without an event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration as finished:
+        return finished.value
+    coroutine.close()
+    raise RuntimeError('{} awaited outside database_sync_to_async'.format(coroutine.__qualname__))
+
+
+def async_view(coroutine):
+    """Expose a coroutine view to Django 3.0's synchronous request handling."""
+    @wraps(coroutine)
+    def view(request, *args, **kwargs):
+        if not concurrent.get():
+            return run_inline(coroutine(request, *args, **kwargs))
+        if hasattr(request, 'user'):
+            # a lazy object that loads from the database: resolve it on this thread
+            request.user.is_authenticated
+        return async_to_sync(coroutine)(request, *args, **kwargs)
+    view.is_async = True
+    return view
+
+
+class ConcurrentASGIHandler(ASGIHandler):
+    """
+    ``ASGIHandler`` that serves requests side by side in the thread pool.
+
+    With asgiref >= 3.3 the stock handler of Django 3.0 runs every request
+    on one shared thread, so an ASGI server processes them one at a time.
+    """
+
+    async def get_response(self, request):
+        concurrent.set(True)
+        return await database_sync_to_async(super().get_response, 'ASGI_REQUEST_THREADS')(request)
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        # The stock handler iterates streaming bodies on the event loop, where
+        # the ORM refuses to run (e.g. the NDJSON exports). Pull them on one
+        # dedicated thread, which also keeps the cursor on the thread that
+        # opened it.
+        headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        headers += [(b'Set-Cookie', c.output(header='').encode('ascii').strip()) for c in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        parts = iter(response)
+        loop = asyncio.get_running_loop()
+
+        def close():
+            response.close()
+            connection.close()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            try:
+                while True:
+                    part = await loop.run_in_executor(executor, next, parts, None)
+                    if part is None:
+                        break
+                    for chunk, _ in self.chunk_bytes(part):
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                await loop.run_in_executor(executor, close)
+        await send({'type': 'http.response.body'})
@@ -1,7 +1,21 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def setup_search_index(sender, **kwargs):
+    from .search import get_backend
+    get_backend().setup()
 
 
 class MyappConfig(AppConfig):
     name = 'myapp'
 
-
+    def ready(self):
+        from . import aggregates, caching  # noqa: F401 -- connect their receivers
+        from . import instrumentation, nplusone
+        from .db import configure_connection
+        connection_created.connect(configure_connection)
+        connection_created.connect(nplusone.install_query_recorder)
+        instrumentation.install()
+        post_migrate.connect(setup_search_index, sender=self)
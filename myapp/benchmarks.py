@@ -0,0 +1,163 @@
+import io
+import itertools
+import random
+import string
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image as Img
+
+from . import aggregates, caching, search
+from .db import bulk_insert
+from .models import Comment, Image, Post, Profile, Vote
+from .storage import blob_name, blob_storage, file_digest
+
+
+@contextmanager
+def scratch_database(name=None):
+    """
+    Point the default connection at a freshly created test database for the
+    duration of a benchmark, so the project database is never written to.
+    With SQLite the database lives in memory unless ``name``, a file path,
+    is given; other threads only see it in a file.
+    """
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    if name:
+        test_settings['NAME'] = name
+    try:
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+    finally:
+        test_settings['NAME'] = old_test_name
+
+
+def count_queries(func, *args, **kwargs):
+    """Call ``func`` and return ``(result, number of queries it ran)``."""
+    queries = []
+
+    def counter(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(counter):
+        result = func(*args, **kwargs)
+    return result, len(queries)
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of the sorted list ``ordered``."""
+    return ordered[max(0, int(len(ordered) * fraction + 0.5) - 1)]
+
+
+def make_vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10))))
+    words = sorted(words)
+    # Zipf-like frequencies, as in natural text
+    weights = list(itertools.accumulate(1.0 / rank for rank in range(1, size + 1)))
+    return words, weights
+
+
+def zipf_weights(size, exponent=1.0):
+    """Cumulative weights for ``rng.choices``: rank 1 is picked most, the tail rarely."""
+    return list(itertools.accumulate(1.0 / rank ** exponent for rank in range(1, size + 1)))
+
+
+def sample_images(count):
+    """Store ``count`` small JPEGs (and their cards) that the synthetic images share."""
+    files = []
+    for number in range(count):
+        data = io.BytesIO()
+        Img.new('RGB', (1200, 800), (40 * number % 256, 120, 200)).save(data, 'JPEG')
+        content = ContentFile(data.getvalue())
+        # referenced once per image, see generate_dataset
+        name = blob_storage.store(blob_name(file_digest(content), 'synthetic.jpg'), content)
+        data = io.BytesIO()
+        Img.new('RGB', (640, 427), (40 * number % 256, 120, 200)).save(data, 'JPEG')
+        card = default_storage.save('posts_images/card/synthetic_{}.jpg'.format(number), ContentFile(data.getvalue()))
+        files.append((name, card))
+    return files
+
+
+@transaction.atomic
+def generate_dataset(users=50, posts=500, comments=5000, images=300, votes=2000, seed=1):
+    """
+    Add synthetic users with profiles, posts with images, comments and votes
+    to the database; all users have the password 'password'.
+
+    Popularity is skewed as on a real site: a few users write most of the
+    posts and a few posts get most of the comments and votes (Zipf-like).
+    Images point at a handful of shared files. Returns the new post ids,
+    most popular first.
+    """
+    rng = random.Random(seed)
+    words, word_weights = make_vocabulary(rng, 5000)
+    now = timezone.now()
+
+    def sentence(low, high):
+        return ' '.join(rng.choices(words, cum_weights=word_weights, k=rng.randint(low, high)))
+
+    prefix = 'synthetic{}_'.format(User.objects.count())
+    password = make_password('password')
+    users = bulk_insert(User, [User(username='{}{}'.format(prefix, number), password=password)
+                               for number in range(users)])
+    Profile.objects.bulk_create(
+        [Profile(user=user, city=rng.choice(['Kyiv', 'Lviv', 'Odesa', 'Kharkiv']), emotions=sentence(3, 20))
+         for user in users],
+        batch_size=settings.BULK_BATCH_SIZE)
+
+    author_weights = zipf_weights(len(users), 0.8)
+    dates = sorted(now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600)) for _ in range(posts))
+    posts = bulk_insert(Post, [
+        Post(user=rng.choices(users, cum_weights=author_weights)[0], title=sentence(2, 8),
+             text=sentence(20, 200), created_date=date)
+        for date in dates
+    ])
+    search.get_backend().index_many(posts)
+
+    files = sample_images(min(images, 8))
+    image_rows = Image.objects.bulk_create(
+        [Image(post=rng.choice(posts), image=name, card=card, width=1200, height=800)
+         for name, card in (rng.choice(files) for _ in range(images))],
+        batch_size=settings.BULK_BATCH_SIZE)
+    for name, count in Counter(image.image.name for image in image_rows).items():
+        blob_storage.acquire(name, blob_storage.size(name), count)
+
+    popular = rng.sample(posts, len(posts))
+    popularity = zipf_weights(len(popular))
+    commented = rng.choices(popular, cum_weights=popularity, k=comments)
+    Comment.objects.bulk_create(
+        [Comment(user=rng.choice(users), post=post, text=sentence(3, 40),
+                 created_date=post.created_date + (now - post.created_date) * rng.random())
+         for post in commented],
+        batch_size=settings.BULK_BATCH_SIZE)
+
+    voted = {}
+    for post in rng.choices(popular, cum_weights=popularity, k=votes):
+        voted[rng.choice(users).pk, post.pk] = rng.choice((Vote.LIKE, Vote.LIKE, Vote.LIKE, Vote.DISLIKE))
+    Vote.objects.bulk_create(
+        [Vote(user_id=user_id, post_id=post_id, value=value) for (user_id, post_id), value in voted.items()],
+        batch_size=settings.BULK_BATCH_SIZE)
+    totals = Counter((post_id, value) for (_, post_id), value in voted.items())
+    for post in posts:
+        post.likes, post.dislikes = totals[post.pk, Vote.LIKE], totals[post.pk, Vote.DISLIKE]
+    Post.objects.bulk_update(posts, ['likes', 'dislikes'], batch_size=settings.BULK_BATCH_SIZE)
+
+    if posts:
+        aggregates.rebuild(Post.objects.filter(pk__gte=posts[0].pk))
+    transaction.on_commit(lambda: caching.bump(caching.POSTS))
+    return [post.pk for post in popular]
@@ -0,0 +1,269 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import partial, wraps
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.safestring import mark_safe
+
+from . import feed, replication
+from .instrumentation import record_cache
+from .models import Comment, Image, Post, Profile
+
+# Cached entries are keyed by the version of every namespace they depend on;
+# invalidating bumps the version, so stale entries are never read again and
+# simply expire.
+POSTS = 'posts'
+
+
+def post_namespace(post_id):
+    return 'post:{}'.format(post_id)
+
+
+def user_namespace(user_id):
+    return 'user:{}'.format(user_id)
+
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def record(kind, hits, misses):
+    with _stats_lock:
+        _stats[kind, 'hit'] += hits
+        _stats[kind, 'miss'] += misses
+    record_cache(kind, hits, misses)
+
+
+def stats():
+    """Hit/miss counts of this process as ``{kind: {'hit': n, 'miss': n}}``."""
+    with _stats_lock:
+        result = {}
+        for (kind, outcome), count in _stats.items():
+            result.setdefault(kind, {'hit': 0, 'miss': 0})[outcome] = count
+        return result
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def initial_version():
+    # Not 1: a version key evicted from the cache must not come back at a value
+    # entries written before the eviction were keyed with.
+    return int(time.time() * 1000000)
+
+
+def get_versions(namespaces):
+    keys = {namespace: 'version:' + namespace for namespace in namespaces}
+    found = cache.get_many(keys.values())
+    missing = {key: initial_version() for key in keys.values() if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {namespace: found[key] for namespace, key in keys.items()}
+
+
+def make_key(kind, namespaces, *parts):
+    versions = get_versions(namespaces)
+    stamp = '.'.join('{}'.format(versions[namespace]) for namespace in namespaces)
+    return ':'.join([kind, stamp] + ['{}'.format(part) for part in parts])
+
+
+def bump(*namespaces):
+    for namespace in namespaces:
+        key = 'version:' + namespace
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, initial_version(), None)
+    if settings.DATABASE_REPLICAS:
+        cache.set_many({'written:' + namespace: True for namespace in namespaces}, settings.REPLICATION_LAG)
+
+
+def recently_written(namespaces):
+    """Whether replicas may not have caught up with the last bump of ``namespaces`` yet."""
+    if not settings.DATABASE_REPLICAS:
+        return False
+    return bool(cache.get_many(['written:' + namespace for namespace in namespaces]))
+
+
+def invalidate_post(post_id):
+    bump(POSTS, post_namespace(post_id))
+
+
+def invalidate_user(user_id):
+    """
+    A profile shows up on the user's posts and next to each of their
+    comments. Those are invalidated once the transaction commits, however
+    often the profile was saved in it.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and any(
+            isinstance(callback[1], partial) and callback[1].func is invalidate_user_content
+            and callback[1].args == (user_id,) for callback in connection.run_on_commit):
+        return
+    transaction.on_commit(partial(invalidate_user_content, user_id))
+
+
+def invalidate_user_content(user_id):
+    post_ids = set(Comment.objects.filter(user_id=user_id).values_list('post_id', flat=True))
+    post_ids.update(Post.objects.filter(user_id=user_id).values_list('pk', flat=True))
+    bump(POSTS, *(post_namespace(post_id) for post_id in post_ids))
+
+
+def cached(kind, namespaces, parts, compute):
+    """Return the cached value for ``kind``/``parts``, computing and storing it on a miss."""
+    key = make_key(kind, namespaces, *parts)
+    value = cache.get(key)
+    if value is not None:
+        record(kind, 1, 0)
+        return value
+    record(kind, 0, 1)
+    if recently_written(namespaces):
+        replication.read_from_primary()
+    value = compute()
+    cache.set(key, value, settings.CACHE_TIMEOUTS[kind])
+    return value
+
+
+def render_post_cards(posts):
+    """
+    The feed cards of ``posts`` (``myapp.feed``), reading every card in one
+    cache round-trip. Only the cards of posts that changed are rendered
+    again, all in one pass.
+    """
+    posts = list(posts)
+    versions = get_versions([post_namespace(post.pk) for post in posts])
+    keys = {post.pk: 'card:{}:{}'.format(post.pk, versions[post_namespace(post.pk)]) for post in posts}
+    found = cache.get_many(keys.values())
+    missing = [post for post in posts if keys[post.pk] not in found]
+    rendered = dict(zip((keys[post.pk] for post in missing),
+                        feed.render_cards(feed.card_rows(missing))))
+    storable = rendered
+    if settings.DATABASE_REPLICAS:
+        # a post read from a replica may predate its current version
+        written = cache.get_many(['written:' + post_namespace(post.pk) for post in missing])
+        storable = {keys[post.pk]: rendered[keys[post.pk]] for post in missing
+                    if 'written:' + post_namespace(post.pk) not in written}
+    if storable:
+        cache.set_many(storable, settings.CACHE_TIMEOUTS['card'])
+    record('card', len(posts) - len(rendered), len(rendered))
+    found.update(rendered)
+    return [mark_safe(found[keys[post.pk]]) for post in posts]
+
+
+def has_pending_messages(request):
+    return CookieStorage.cookie_name in request.COOKIES or (
+        settings.SESSION_COOKIE_NAME in request.COOKIES and '_messages' in request.session)
+
+
+def key_etag(key):
+    """A weak ETag for everything ``key`` depends on, namespace versions included."""
+    return 'W/"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+
+
+def not_modified(request, etag):
+    """The 304 (or 412) answer to ``request``'s conditional headers for ``etag``, or None."""
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+    return response
+
+
+def cache_page_for_anonymous(namespaces):
+    """
+    Cache whole GET responses for anonymous visitors, keyed by the full path
+    and the versions of ``namespaces(request, *args, **kwargs)``. The key is
+    also the ETag, so a visitor with a fresh copy gets a 304 before the
+    cache is even read.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated or has_pending_messages(request):
+                return view(request, *args, **kwargs)
+            page_namespaces = namespaces(request, *args, **kwargs)
+            key = make_key('page', page_namespaces, request.get_full_path())
+            etag = key_etag(key)
+            response = not_modified(request, etag)
+            if response is not None:
+                patch_vary_headers(response, ('Cookie',))
+                return response
+            entry = cache.get(key)
+            if entry is not None:
+                record('page', 1, 0)
+                content, content_type = entry
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                record('page', 0, 1)
+                if recently_written(page_namespaces):
+                    replication.read_from_primary()
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.streaming and not response.cookies:
+                    cache.set(key, (response.content, response['Content-Type']), settings.CACHE_TIMEOUTS['page'])
+            if response.status_code == 200:
+                response['ETag'] = etag
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
+
+
+def condition_on_versions(namespaces):
+    """
+    Give GET responses a weak ETag made of the versions of
+    ``namespaces(request, *args, **kwargs)``, the full path, the user and
+    the Accept header, and answer a client that holds it with 304 without
+    running the view. Goes inside DRF's ``@api_view``, so the request is
+    authenticated first.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            etag = key_etag(make_key('etag', namespaces(request, *args, **kwargs), request.get_full_path(),
+                                     request.user.pk, request.META.get('HTTP_ACCEPT', '')))
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def invalidate_post_content(sender, instance, **kwargs):
+    invalidate_post(instance.pk if sender is Post else instance.post_id)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_namespace(sender, instance, **kwargs):
+    # drops the users cached by api.authentication.CachedJWTAuthentication
+    bump(user_namespace(instance.pk))
@@ -0,0 +1,90 @@
+"""
+Response compression.
+
+``CompressionMiddleware`` compresses HTML, JSON and the other compressible
+types (``myapp.files.compressible``). It uses brotli when the ``brotli``
+package is installed and the client accepts it, and gzip otherwise.
+Responses under ``COMPRESSION_MIN_SIZE`` bytes are sent as they are.
+Streaming responses, such as the NDJSON exports, are compressed as they
+stream. Precompressed files, ranges and empty bodies are left alone. Like
+Django's ``GZipMiddleware``, strong ETags are made weak, because the
+bytes differ from the uncompressed response's.
+"""
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .files import accepted_encodings, brotli, compressible
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def negotiate(request):
+    encodings = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if brotli is not None and 'br' in encodings:
+        return 'br'
+    if 'gzip' in encodings:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_sequence(sequence, encoding):
+    """Compress a streamed body chunk by chunk, flushing after each so clients see rows as they come."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        for item in sequence:
+            data = compressor.process(item) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+        for item in sequence:
+            data = compressor.compress(item) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class CompressionMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (response.status_code in (204, 206, 304) or response.has_header('Content-Encoding')
+                or not compressible(response.get('Content-Type', ''))):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if int(response.get('Content-Length') or settings.COMPRESSION_MIN_SIZE) < settings.COMPRESSION_MIN_SIZE:
+                return response
+            response.streaming_content = compress_sequence(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            if len(response.content) < settings.COMPRESSION_MIN_SIZE:
+                return response
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
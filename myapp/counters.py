@@ -0,0 +1,161 @@
+import atexit
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import F
+
+from . import caching
+from .db import retry_on_busy
+from .models import Post, Vote
+
+COLUMNS = {Vote.LIKE: 'likes', Vote.DISLIKE: 'dislikes'}
+
+
+def apply_deltas(post_id, deltas):
+    """Add ``deltas`` ({column: n}) to a post with a single UPDATE ... SET col = col + n."""
+    changes = {column: F(column) + delta for column, delta in deltas.items() if delta}
+    if changes:
+        Post.objects.filter(pk=post_id).update(**changes)
+        caching.invalidate_post(post_id)
+
+
+@retry_on_busy
+def apply_all_deltas(pending):
+    for post_id, deltas in sorted(pending.items()):
+        apply_deltas(post_id, deltas)
+
+
+class CounterBuffer:
+    """
+    Write-behind buffer for vote counters.
+
+    Posts that receive more than ``hot_threshold`` votes within one
+    ``flush_interval`` are treated as hot: their deltas are summed in memory
+    and written as one UPDATE per post when the interval elapses or
+    ``flush_size`` increments are pending. Every other post is written
+    through immediately.
+    """
+
+    def __init__(self, hot_threshold, flush_interval, flush_size):
+        self.hot_threshold = hot_threshold
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._lock = threading.Lock()
+        self._pending = defaultdict(Counter)
+        self._pending_count = 0
+        self._hits = Counter()
+        self._window_start = time.monotonic()
+        self._timer = None
+
+    def add(self, post_id, deltas):
+        """Count ``deltas`` for a post; call once the vote is committed, never inside a transaction."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.flush_interval:
+                self._hits.clear()
+                self._window_start = now
+            self._hits[post_id] += 1
+            buffered = self._hits[post_id] > self.hot_threshold
+            if buffered:
+                self._pending[post_id].update(deltas)
+                self._pending_count += 1
+                due = self._pending_count >= self.flush_size
+                if not due:
+                    self._schedule()
+        if not buffered:
+            try:
+                apply_all_deltas({post_id: deltas})
+            except OperationalError:
+                # the vote is committed, so its count must not be lost: the next flush writes it
+                self._restore({post_id: deltas})
+        elif due:
+            try:
+                self.flush()
+            except OperationalError:
+                # restored and rescheduled by flush()
+                pass
+
+    def pending(self, post_id):
+        with self._lock:
+            return dict(self._pending.get(post_id, {}))
+
+    def flush(self):
+        """
+        Write every pending delta. If that fails (the database stayed busy),
+        they are put back for the next flush and the error is raised.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(Counter)
+            self._pending_count = 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if pending:
+            try:
+                apply_all_deltas(pending)
+            except Exception:
+                self._restore(pending)
+                raise
+
+    def _restore(self, pending):
+        with self._lock:
+            for post_id, deltas in pending.items():
+                self._pending[post_id].update(deltas)
+            self._pending_count += len(pending)
+            self._schedule()
+
+    def _schedule(self):
+        # called with the lock held
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._flush_in_thread)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_in_thread(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except OperationalError:
+            # restored and rescheduled by flush()
+            pass
+        finally:
+            connection.close()
+
+
+buffer = CounterBuffer(
+    hot_threshold=settings.VOTE_HOT_THRESHOLD,
+    flush_interval=settings.VOTE_FLUSH_INTERVAL,
+    flush_size=settings.VOTE_FLUSH_SIZE,
+)
+atexit.register(buffer.flush)
+
+
+@retry_on_busy
+def vote(user, post_id, value):
+    """
+    Record ``user``'s like/dislike of a post, at most one per user and post.
+
+    Repeating a vote is a no-op and switching it moves the count from one
+    column to the other. Counters are incremented in the database, never
+    read and written back, so concurrent voters cannot lose updates.
+    Returns False when nothing changed.
+    """
+    try:
+        # Insert first: a first vote, the common case, is then a single
+        # statement that takes the write lock straight away.
+        with transaction.atomic():
+            Vote.objects.create(user=user, post_id=post_id, value=value)
+        deltas = {COLUMNS[value]: 1}
+    except IntegrityError:
+        current = Vote.objects.get(user=user, post_id=post_id)
+        if current.value == value:
+            return False
+        Vote.objects.filter(pk=current.pk).update(value=value)
+        deltas = {COLUMNS[value]: 1, COLUMNS[current.value]: -1}
+    # only once committed: a retried or rolled back vote must not be counted, nor flush others' deltas
+    transaction.on_commit(lambda: buffer.add(post_id, deltas))
+    return True
@@ -0,0 +1,66 @@
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+# SQLITE_BUSY, and SQLITE_LOCKED from shared-cache (test) databases
+BUSY_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def configure_connection(sender, connection, **kwargs):
+    """``connection_created`` receiver applying ``settings.SQLITE_PRAGMAS`` to new SQLite connections."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA {} = {}'.format(pragma, value))
+
+
+def is_busy(exc):
+    return any(message in str(exc) for message in BUSY_MESSAGES)
+
+
+def retry_on_busy(func):
+    """
+    Run ``func`` in ``transaction.atomic`` and run it again, after a random
+    exponential backoff, when SQLite reports the database busy.
+
+    ``busy_timeout`` already makes single statements wait for the write lock,
+    but a transaction that read before writing fails at once if another
+    writer committed in between (WAL cannot upgrade its stale snapshot); the
+    only remedy is to start over. Only the outermost call retries, nested
+    ones join the surrounding transaction.
+    """
+    @wraps(func)
+    def inner(*args, **kwargs):
+        if connection.in_atomic_block:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        attempt = 0
+        while True:
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except OperationalError as exc:
+                if not is_busy(exc) or attempt >= settings.SQLITE_BUSY_RETRIES:
+                    raise
+            time.sleep(random.uniform(0, settings.SQLITE_BUSY_BACKOFF * 2 ** attempt))
+            attempt += 1
+    return inner
+
+
+def bulk_insert(model, objects):
+    """
+    ``bulk_create`` the objects and set their ids. SQLite cannot return ids
+    from a multi-row INSERT, but inside the transaction no other connection
+    can write, so the new rows are the last ``len(objects)`` ids.
+    """
+    assert transaction.get_connection().in_atomic_block
+    model.objects.bulk_create(objects, batch_size=settings.BULK_BATCH_SIZE)
+    if objects and objects[0].pk is None:
+        ids = model.objects.order_by('-pk').values_list('pk', flat=True)[:len(objects)]
+        for obj, pk in zip(objects, reversed(list(ids))):
+            obj.pk = pk
+    return objects
@@ -0,0 +1,210 @@
+"""
+Serving of static files and media.
+
+``serve`` replaces ``django.views.static.serve``. It answers conditional
+requests from the file's ``stat()``: ``ETag``/``Last-Modified`` and 304 or
+412. It serves single byte ranges, and picks a ``.br`` or ``.gz`` file next
+to the requested one when the client accepts that encoding
+(``collectstatic`` writes them for static files, ``.br`` only with the
+``brotli`` package installed). Bodies are sent as a
+``FileResponse``, which WSGI servers hand to ``sendfile()``. With
+``SENDFILE_HEADER`` set, the front-end server sends the file instead.
+
+Content-addressed blobs (``myapp.storage``) and hashed static files never
+change and are cached as immutable; other files for ``MEDIA_MAX_AGE``.
+"""
+import gzip
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+IMMUTABLE = re.compile(r'(^|/)blobs/|\.[0-9a-f]{12}\.\w+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Content-Encoding -> suffix of the precompressed file, in order of preference
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+# besides text/*
+COMPRESSIBLE_TYPES = {'application/javascript', 'application/json', 'application/x-ndjson', 'application/xml',
+                      'image/svg+xml'}
+
+
+def accepted_encodings(header):
+    """The content codings an ``Accept-Encoding`` header allows (q > 0)."""
+    encodings = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding.strip() and quality > 0:
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+def precompressed(request, path):
+    """``(path, encoding)`` of the best variant of ``path`` the client accepts."""
+    encodings = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    for encoding, suffix in PRECOMPRESSED:
+        if encoding in encodings and os.path.isfile(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def compressible(content_type):
+    content_type = content_type.split(';')[0].strip()
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+def precompress(path):
+    """Write ``path.gz`` and, with the ``brotli`` package, ``path.br``, where they are smaller."""
+    content_type = mimetypes.guess_type(path)[0]
+    if content_type is None or not compressible(content_type):
+        return
+    with open(path, 'rb') as file:
+        data = file.read()
+    variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data)
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as file:
+                file.write(compressed)
+
+
+def parse_range(header, size):
+    """``(start, end)`` (inclusive) of a single byte range, None to serve everything, or ValueError if unsatisfiable."""
+    match = RANGE.match(header.replace(' ', ''))
+    # several ranges at once are answered with the whole file
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+class FileRange:
+    """
+    ``length`` bytes of ``file`` from ``start``. It has no ``fileno()``, so
+    servers read it instead of sending the rest of the file.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def if_range_matches(request, etag, last_modified):
+    value = request.META.get('HTTP_IF_RANGE')
+    if value is None:
+        return True
+    if value.startswith('"'):
+        return value == etag
+    return parse_http_date_safe(value) == last_modified
+
+
+def serve(request, path, document_root):
+    try:
+        full_path = safe_join(document_root, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    if encoding is None:
+        file_path, encoding = precompressed(request, full_path)
+    else:
+        # an archive (.gz, .bz2) is served as such
+        file_path, encoding = full_path, None
+        content_type = 'application/octet-stream'
+    stat = os.stat(file_path)
+    last_modified = int(stat.st_mtime)
+    etag = '"{:x}-{:x}{}"'.format(stat.st_mtime_ns // 1000, stat.st_size, '-' + encoding if encoding else '')
+
+    headers = HttpResponse(content_type=content_type)
+    headers['ETag'] = etag
+    headers['Last-Modified'] = http_date(last_modified)
+    headers['Accept-Ranges'] = 'bytes'
+    headers['Vary'] = 'Accept-Encoding'
+    if IMMUTABLE.search(path):
+        headers['Cache-Control'] = 'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE)
+    else:
+        headers['Cache-Control'] = 'public, max-age={}'.format(settings.MEDIA_MAX_AGE)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    # a 304 carries the headers above
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified, response=headers)
+    if response is not headers:
+        return response
+
+    if settings.SENDFILE_HEADER:
+        # the front-end server reads the file and answers Range itself
+        if settings.SENDFILE_HEADER == 'X-Accel-Redirect':
+            headers[settings.SENDFILE_HEADER] = '{}{}{}'.format(
+                settings.SENDFILE_URL.rstrip('/'), request.path, file_path[len(full_path):])
+        else:
+            headers[settings.SENDFILE_HEADER] = file_path
+        return headers
+
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(stat.st_size)
+            return response
+    file = open(file_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(FileRange(file, start, end - start + 1), content_type=content_type, status=206)
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, stat.st_size)
+        response['Content-Length'] = end - start + 1
+    for header in ('ETag', 'Last-Modified', 'Accept-Ranges', 'Vary', 'Cache-Control', 'Content-Encoding'):
+        if header in headers:
+            response[header] = headers[header]
+    return response
+
+
+def serve_static(request, path):
+    return serve(request, path, settings.STATIC_ROOT)
+
+
+def serve_media(request, path):
+    return serve(request, path, settings.MEDIA_ROOT)
@@ -0,0 +1,231 @@
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image as Img, ImageOps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import aggregates, caching
+from .db import retry_on_busy
+from .models import Image, ImageDerivative, ImageJob, Profile
+
+# thumbnail field -> size name in settings.IMAGE_THUMBNAIL_SIZES
+IMAGE_THUMBNAILS = {'card': 'card', 'detail': 'detail'}
+PROFILE_THUMBNAILS = {'avatar': 'avatar'}
+
+EXIF_ORIENTATION = 0x0112
+
+
+def available_formats():
+    Img.init()
+    return [fmt for fmt in settings.IMAGE_DERIVATIVE_FORMATS if fmt.upper() in Img.SAVE]
+
+
+def derivative_widths(width, widths):
+    """The configured widths narrower than the source, plus the largest one the source can fill."""
+    return sorted({w for w in widths if w < width} | {min(width, max(widths))})
+
+
+def derivative_name(source_name, width, fmt):
+    return 'derivatives/{}/{}w.{}'.format(os.path.splitext(source_name)[0], width, fmt)
+
+
+def open_clean(source_path):
+    """Open an upload with its EXIF orientation applied and all metadata (EXIF, XMP, comments) dropped."""
+    with Img.open(source_path) as original:
+        icc_profile = original.info.get('icc_profile')
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    image.info = {}
+    return image, icc_profile
+
+
+def save_clean(image, path, fmt, icc_profile, **options):
+    if fmt == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image.save(path, fmt, **options)
+    return os.path.getsize(path)
+
+
+def render(source_path, thumbnails, derivatives):
+    """
+    Worker-process entry point, only touches the filesystem.
+
+    ``thumbnails`` is a list of ``(target_path, (width, height))`` JPEGs
+    scaled to fit the box, ``derivatives`` a list of ``(target_path,
+    width, format)``. Returns the bytes written per derivative.
+    """
+    image, icc_profile = open_clean(source_path)
+    for target_path, size in thumbnails:
+        thumbnail = image.copy()
+        thumbnail.thumbnail(size, Img.LANCZOS)
+        save_clean(thumbnail, target_path, 'JPEG', icc_profile, quality=85, optimize=True)
+
+    written = []
+    resized = {}
+    for target_path, width, fmt in derivatives:
+        if width not in resized:
+            height = max(1, round(image.height * width / image.width))
+            resized[width] = image.resize((width, height), Img.LANCZOS)
+        written.append(save_clean(resized[width], target_path, fmt.upper(), icc_profile, quality=75))
+    return written
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_JOBS_WORKERS)
+        return _executor
+
+
+def enqueue(instance):
+    """
+    Queue thumbnail generation for an ``Image`` or ``Profile`` and return
+    the job. Depending on ``IMAGE_JOBS_MODE`` the job is rendered in the
+    local process pool once the current transaction commits ('pool'),
+    right away ('eager'), or left for ``manage.py process_image_jobs``
+    ('worker').
+    """
+    if isinstance(instance, Profile):
+        if instance.avatar:
+            instance.avatar.delete(save=False)
+            Profile.objects.filter(pk=instance.pk).update(avatar=None)
+            caching.invalidate_user(instance.user_id)
+        job = ImageJob.objects.create(profile=instance)
+    else:
+        job = ImageJob.objects.create(image=instance)
+
+    mode = settings.IMAGE_JOBS_MODE
+    if mode == 'eager':
+        run_job(job.pk)
+    elif mode == 'pool':
+        transaction.on_commit(lambda: dispatch(job.pk, get_executor()))
+    return job
+
+
+def claim(job_id):
+    """Mark a pending (or retryable failed) job as running; False if someone else got it."""
+    return ImageJob.objects.filter(
+        pk=job_id, status__in=(ImageJob.PENDING, ImageJob.FAILED),
+        attempts__lt=settings.IMAGE_JOBS_MAX_ATTEMPTS,
+    ).update(status=ImageJob.RUNNING, attempts=F('attempts') + 1, updated_date=timezone.now()) == 1
+
+
+def build_specs(job):
+    """The field values to store once rendered, and the arguments for ``render``."""
+    if job.profile_id:
+        instance, source, thumbnails = job.profile, job.profile.photo, PROFILE_THUMBNAILS
+    else:
+        instance, source, thumbnails = job.image, job.image.image, IMAGE_THUMBNAILS
+    base = os.path.splitext(os.path.basename(source.name))[0] + '.jpg'
+    updates, thumbnail_specs = {}, []
+    for field_name, size_name in thumbnails.items():
+        field = instance._meta.get_field(field_name)
+        name = default_storage.get_available_name(field.generate_filename(instance, base))
+        updates[field_name] = name
+        thumbnail_specs.append((default_storage.path(name), settings.IMAGE_THUMBNAIL_SIZES[size_name]))
+
+    derivatives = []
+    if job.image_id:
+        # only the header is read here, the pixels are decoded in the worker
+        with Img.open(source.path) as image:
+            width, height = image.size
+            if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+                width, height = height, width
+        formats = available_formats()
+        updates.update(width=width, height=height, formats=','.join(formats))
+        derivatives = [
+            (default_storage.path(derivative_name(source.name, w, fmt)), w, fmt)
+            for w in derivative_widths(width, settings.IMAGE_DERIVATIVE_WIDTHS) for fmt in formats
+        ]
+    return updates, (source.path, thumbnail_specs, derivatives)
+
+
+@retry_on_busy
+def complete(job, updates, arguments, written):
+    if job.profile_id:
+        Profile.objects.filter(pk=job.profile_id).update(**updates)
+        caching.invalidate_user(job.profile.user_id)
+    else:
+        source = job.image.image.name
+        ImageDerivative.objects.filter(source=source).delete()
+        ImageDerivative.objects.bulk_create([
+            ImageDerivative(source=source, width=width, format=fmt, size=size,
+                            file=derivative_name(source, width, fmt))
+            for (_, width, fmt), size in zip(arguments[2], written)
+        ])
+        Image.objects.filter(pk=job.image_id).update(**updates)
+        aggregates.refresh_cover(job.image.post_id)
+        caching.invalidate_post(job.image.post_id)
+    ImageJob.objects.filter(pk=job.pk).update(status=ImageJob.DONE, error='', updated_date=timezone.now())
+
+
+def fail(job, error):
+    ImageJob.objects.filter(pk=job.pk).update(status=ImageJob.FAILED, error=error, updated_date=timezone.now())
+
+
+def run_job(job_id, executor=None):
+    """Claim and render one job, in ``executor`` or inline; returns True when it is done."""
+    if not claim(job_id):
+        return False
+    job = ImageJob.objects.select_related('image', 'profile').get(pk=job_id)
+    try:
+        updates, arguments = build_specs(job)
+        if executor is None:
+            written = render(*arguments)
+        else:
+            written = executor.submit(render, *arguments).result()
+    except Exception:
+        fail(job, traceback.format_exc())
+        return False
+    complete(job, updates, arguments, written)
+    return True
+
+
+def dispatch(job_id, executor):
+    """Run a job from a helper thread so the request thread never waits for PIL."""
+    def target():
+        try:
+            run_job(job_id, executor)
+        finally:
+            connection.close()
+    thread = threading.Thread(target=target, name='image-job-{}'.format(job_id), daemon=True)
+    thread.start()
+    return thread
+
+
+def runnable_jobs():
+    return ImageJob.objects.filter(
+        status__in=(ImageJob.PENDING, ImageJob.FAILED),
+        attempts__lt=settings.IMAGE_JOBS_MAX_ATTEMPTS,
+    ).order_by('pk').values_list('pk', flat=True)
+
+
+def backfill():
+    """Queue jobs for images and photos uploaded before they were processed in the background."""
+    active = (ImageJob.PENDING, ImageJob.RUNNING)
+    image_ids = Image.objects.filter(
+        Q(card__isnull=True) | Q(card='') | Q(formats='')
+    ).exclude(jobs__status__in=active).values_list('pk', flat=True)
+    profile_ids = Profile.objects.filter(
+        Q(avatar__isnull=True) | Q(avatar='')
+    ).exclude(photo__in=('', Profile._meta.get_field('photo').default)).exclude(
+        jobs__status__in=active
+    ).values_list('pk', flat=True)
+    jobs = [ImageJob(image_id=pk) for pk in image_ids] + [ImageJob(profile_id=pk) for pk in profile_ids]
+    ImageJob.objects.bulk_create(jobs)
+    return len(jobs)
@@ -0,0 +1,233 @@
+"""
+Per-request performance instrumentation.
+
+``InstrumentationMiddleware`` profiles a random ``METRICS_SAMPLE_RATE`` of
+requests: wall time, number and time of SQL queries, template rendering
+time, serializer time and cache hits and misses. Profiles are aggregated
+into histograms per URL name (``myapp:show_post``, ``posts``), which
+``api.views.metrics`` serves to staff users as Prometheus text. Requests
+that are not sampled only pay for one random number.
+
+Queries, templates and serializers that run on other threads on behalf of
+the request (async views) are included, so their times may add up to more
+than the wall time. Streaming responses are timed until their first byte.
+"""
+import contextvars
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+# name: (help, buckets); every metric is one histogram per URL name
+METRICS = {
+    'request_duration_seconds': ('Wall time of sampled requests.', SECONDS_BUCKETS),
+    'sql_queries': ('SQL queries per sampled request.', COUNT_BUCKETS),
+    'sql_duration_seconds': ('Time spent in SQL queries per sampled request.', SECONDS_BUCKETS),
+    'template_duration_seconds': ('Time spent rendering templates per sampled request.', SECONDS_BUCKETS),
+    'serializer_duration_seconds': ('Time spent in DRF serializers per sampled request.', SECONDS_BUCKETS),
+}
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.times = Counter()
+        self.cache = Counter()
+
+    def add_time(self, kind, seconds):
+        with self.lock:
+            self.times[kind] += seconds
+
+
+_current = contextvars.ContextVar('request_profile', default=None)
+# nested templates ({% include %}) and serializers are timed by the outermost one
+_depth = threading.local()
+
+
+def current_profile():
+    return _current.get()
+
+
+def timer(kind, func):
+    """Wrap ``func`` to add its time to the profile of the current request, if any."""
+    @wraps(func)
+    def inner(*args, **kwargs):
+        profile = _current.get()
+        depth = getattr(_depth, kind, 0)
+        if profile is None or depth:
+            return func(*args, **kwargs)
+        setattr(_depth, kind, 1)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.add_time(kind, time.perf_counter() - started)
+            setattr(_depth, kind, 0)
+    return inner
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        with profile.lock:
+            profile.queries += 1
+            profile.times['sql'] += elapsed
+
+
+def record_cache(kind, hits, misses):
+    profile = _current.get()
+    if profile is not None:
+        with profile.lock:
+            profile.cache[kind, 'hit'] += hits
+            profile.cache[kind, 'miss'] += misses
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install():
+    """Hook into the database connections, template rendering and DRF serializers."""
+    from django.template.base import Template
+    from rest_framework.serializers import BaseSerializer
+
+    connection_created.connect(install_query_recorder)
+    Template.render = timer('template', Template.render)
+    BaseSerializer.data = property(timer('serializer', BaseSerializer.data.fget))
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total, result = 0, []
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+_lock = threading.Lock()
+_histograms = {}
+_cache_counts = Counter()
+
+
+def observe(view, profile, duration):
+    values = {
+        'request_duration_seconds': duration,
+        'sql_queries': profile.queries,
+        'sql_duration_seconds': profile.times['sql'],
+        'template_duration_seconds': profile.times['template'],
+        'serializer_duration_seconds': profile.times['serializer'],
+    }
+    with _lock:
+        for name, value in values.items():
+            if (view, name) not in _histograms:
+                _histograms[view, name] = Histogram(METRICS[name][1])
+            _histograms[view, name].observe(value)
+        for (kind, outcome), count in profile.cache.items():
+            _cache_counts[view, kind, outcome] += count
+
+
+def histograms():
+    """``{view: {metric: {'count', 'sum', 'buckets': [[le, cumulative count], ...]}}}``"""
+    with _lock:
+        result = {}
+        for (view, name), histogram in sorted(_histograms.items()):
+            result.setdefault(view, {})[name] = {
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'buckets': [[bound, count] for bound, count in histogram.cumulative()],
+            }
+        for (view, kind, outcome), count in sorted(_cache_counts.items()):
+            result.setdefault(view, {}).setdefault('cache', {}).setdefault(kind, {})[outcome] = count
+        return result
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _cache_counts.clear()
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus(cache_stats):
+    """
+    The histograms in the Prometheus text format, followed by the
+    process-wide ``cache_stats`` (``myapp.caching.stats()``).
+    """
+    lines = []
+    with _lock:
+        for name, (description, _) in METRICS.items():
+            metric = 'myapp_' + name
+            lines += ['# HELP {} {}'.format(metric, description), '# TYPE {} histogram'.format(metric)]
+            for (view, histogram_name), histogram in sorted(_histograms.items()):
+                if histogram_name != name:
+                    continue
+                label = 'view="{}"'.format(escape(view))
+                for bound, count in histogram.cumulative():
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(metric, label, bound, count))
+                lines.append('{}_sum{{{}}} {}'.format(metric, label, histogram.sum))
+                lines.append('{}_count{{{}}} {}'.format(metric, label, histogram.count))
+        lines += ['# HELP myapp_view_cache_requests_total Cache lookups of sampled requests.',
+                  '# TYPE myapp_view_cache_requests_total counter']
+        for (view, kind, outcome), count in sorted(_cache_counts.items()):
+            lines.append('myapp_view_cache_requests_total{{view="{}",kind="{}",outcome="{}"}} {}'.format(
+                escape(view), kind, outcome, count))
+    lines += ['# HELP myapp_cache_requests_total Cache lookups of all requests.',
+              '# TYPE myapp_cache_requests_total counter']
+    for kind, outcomes in sorted(cache_stats.items()):
+        for outcome, count in sorted(outcomes.items()):
+            lines.append('myapp_cache_requests_total{{kind="{}",outcome="{}"}} {}'.format(kind, outcome, count))
+    return '\n'.join(lines) + '\n'
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - started
+            _current.reset(token)
+        match = getattr(request, 'resolver_match', None)
+        observe(match.view_name if match else '<unresolved>', profile, duration)
+        return response
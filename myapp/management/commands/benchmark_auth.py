@@ -0,0 +1,56 @@
+import time
+
+import jwt
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.authentication import CachedJWTAuthentication
+from myapp.benchmarks import count_queries, scratch_database
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the authentication overhead of one API request: the old views (JWTAuthentication, '
+        'then decoding the header again and fetching the user again) against CachedJWTAuthentication. '
+        'Runs on a scratch test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options['requests'])
+
+    def run(self, count):
+        user = User.objects.create_user(username='benchmark')
+        request = RequestFactory().get('/api/posts/', HTTP_AUTHORIZATION='Bearer {}'.format(AccessToken.for_user(user)))
+        cached = CachedJWTAuthentication()
+
+        self.stdout.write('{:<24} {:>14} {:>16}'.format('method', 'us/request', 'queries/request'))
+        self.report('before (view re-decodes)', count, lambda: self.legacy(request))
+        self.report('JWTAuthentication', count, lambda: JWTAuthentication().authenticate(request))
+        cached.authenticate(request)
+        self.report('cached, warm', count, lambda: cached.authenticate(request))
+
+    @staticmethod
+    def legacy(request):
+        # what user_posts/add_post/delete_post/add_comment used to run on every request
+        JWTAuthentication().authenticate(request)
+        token = request.META.get('HTTP_AUTHORIZATION', ' ').split(' ')[1]
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
+        return User.objects.get(pk=payload['user_id'])
+
+    def report(self, name, count, func):
+        def repeat():
+            started = time.perf_counter()
+            for _ in range(count):
+                func()
+            return time.perf_counter() - started
+
+        elapsed, queries = count_queries(repeat)
+        self.stdout.write('{:<24} {:>14.1f} {:>16.2f}'.format(name, elapsed / count * 1000000, queries / count))
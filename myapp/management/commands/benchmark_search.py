@@ -0,0 +1,86 @@
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.benchmarks import make_vocabulary
+from myapp.search import TITLE_WEIGHT, InvertedIndex, SQLiteFTSBackend
+
+
+def timed(func, queries):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        func(query)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[max(0, int(len(timings) * 0.95) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the old in-Python scan of every post with the FTS5 and inverted index '
+        'search backends on synthetic corpora. Runs on a scratch SQLite file, not on the '
+        'project database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000])
+        parser.add_argument('--queries', type=int, default=20)
+        parser.add_argument('--words', type=int, default=60, help='Average words per post.')
+        parser.add_argument('--inverted-max-size', type=int, default=100000,
+                            help='Skip the in-memory inverted index above this corpus size.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words, weights = make_vocabulary(rng, 20000)
+        self.stdout.write('{:>9}  {:<10} {:>10} {:>10}'.format('posts', 'method', 'p50 ms', 'p95 ms'))
+        for size in options['sizes']:
+            # Mid-frequency words: common enough to match, rare enough to be a real search.
+            queries = [words[rng.randint(100, 2000)] for _ in range(options['queries'])]
+            with tempfile.TemporaryDirectory() as directory:
+                db = sqlite3.connect(os.path.join(directory, 'search.sqlite3'))
+                inverted_index = InvertedIndex() if size <= options['inverted_max_size'] else None
+                self.populate(db, inverted_index, rng, words, weights, size, options['words'])
+                results = [('scan', timed(lambda query: self.scan(db, query), queries)),
+                           ('fts5', timed(lambda query: self.fts(db, query), queries))]
+                if inverted_index is not None:
+                    results.append(('inverted', timed(inverted_index.search, queries)))
+                db.close()
+            for method, (p50, p95) in results:
+                self.stdout.write('{:>9}  {:<10} {:>10.2f} {:>10.2f}'.format(size, method, p50, p95))
+
+    def populate(self, db, inverted_index, rng, words, weights, size, words_per_post):
+        db.execute('CREATE TABLE post (id INTEGER PRIMARY KEY, title TEXT, text TEXT)')
+        db.execute(SQLiteFTSBackend.create_sql.format(table='post_fts'))
+        batch = []
+        for pk in range(1, size + 1):
+            title = ' '.join(rng.choices(words, cum_weights=weights, k=rng.randint(2, 6)))
+            text = ' '.join(rng.choices(words, cum_weights=weights, k=rng.randint(words_per_post // 2,
+                                                                                 words_per_post * 3 // 2)))
+            batch.append((pk, title, text))
+            if inverted_index is not None:
+                inverted_index.add(pk, title, text)
+            if len(batch) == 10000 or pk == size:
+                db.executemany('INSERT INTO post VALUES (?, ?, ?)', batch)
+                db.executemany('INSERT INTO post_fts(rowid, title, text) VALUES (?, ?, ?)', batch)
+                batch = []
+        db.commit()
+
+    @staticmethod
+    def scan(db, query):
+        # what myapp.views.search used to do: load every post and test each one
+        return [pk for pk, title, text in db.execute('SELECT id, title, text FROM post')
+                if query in text.lower() or query in title.lower()]
+
+    @staticmethod
+    def fts(db, query):
+        return db.execute(
+            'SELECT rowid FROM post_fts WHERE post_fts MATCH ? ORDER BY bm25(post_fts, ?, 1.0) LIMIT 20',
+            [SQLiteFTSBackend.match_expression(query), TITLE_WEIGHT]
+        ).fetchall()
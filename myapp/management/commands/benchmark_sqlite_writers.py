@@ -0,0 +1,140 @@
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+from django.test import override_settings
+
+from myapp import counters
+from myapp.benchmarks import scratch_database
+from myapp.models import Comment, Post, Vote
+
+# The tree before the tuning: rollback journal, full fsync, a connection per
+# request and no retries. Python's sqlite3 module waits up to 5 s for locks.
+BASELINE = {
+    'SQLITE_PRAGMAS': {'journal_mode': 'DELETE', 'synchronous': 'FULL'},
+    'SQLITE_BUSY_RETRIES': 0,
+    'CONN_MAX_AGE': 0,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Run writer threads (votes and comments) against reader threads (the feed query) on a '
+        'scratch SQLite file, once with the old connection settings and once with SQLITE_PRAGMAS, '
+        'CONN_MAX_AGE and busy retries, and report throughput, failed writes and read latency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=16)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run.')
+        parser.add_argument('--posts', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write('This benchmark only applies to SQLite.')
+            return
+        self.stdout.write('{:<10} {:>9} {:>8} {:>9} {:>12} {:>12}'.format(
+            'setup', 'writes/s', 'failed', 'reads/s', 'read p50 ms', 'read p95 ms'))
+        tuned = {
+            'SQLITE_PRAGMAS': settings.SQLITE_PRAGMAS,
+            'SQLITE_BUSY_RETRIES': settings.SQLITE_BUSY_RETRIES,
+            'CONN_MAX_AGE': connection.settings_dict['CONN_MAX_AGE'],
+        }
+        for name, setup in (('baseline', BASELINE), ('tuned', tuned)):
+            self.report(name, self.run(setup, options))
+
+    def run(self, setup, options):
+        old_max_age = connection.settings_dict['CONN_MAX_AGE']
+        # every thread's connection is built from this same settings dict
+        connection.settings_dict['CONN_MAX_AGE'] = setup['CONN_MAX_AGE']
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(SQLITE_PRAGMAS=setup['SQLITE_PRAGMAS'],
+                                   SQLITE_BUSY_RETRIES=setup['SQLITE_BUSY_RETRIES']), \
+                    scratch_database(os.path.join(directory, 'benchmark.sqlite3')):
+                connection.close()  # reconnect with this run's pragmas
+                post_ids = self.populate(options['posts'], options['writers'])
+                connection.close()
+                return self.load(post_ids, options)
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = old_max_age
+            os.rmdir(directory)
+
+    @staticmethod
+    def populate(posts, writers):
+        author = User.objects.create_user(username='author')
+        User.objects.bulk_create(User(username='writer{}'.format(number)) for number in range(writers))
+        Post.objects.bulk_create(Post(user=author, title='Post', text='Text ' * 50) for _ in range(posts))
+        return list(Post.objects.values_list('pk', flat=True))
+
+    def load(self, post_ids, options):
+        deadline = time.monotonic() + options['seconds']
+        writes, failures, read_timings = [], [], []
+
+        def request(func):
+            # what the request_started/request_finished signals do around a view
+            close_old_connections()
+            try:
+                return func()
+            finally:
+                close_old_connections()
+
+        def writer(number):
+            user = User.objects.get(username='writer{}'.format(number))
+            done = failed = 0
+            while time.monotonic() < deadline:
+                post_id = random.choice(post_ids)
+                try:
+                    if random.random() < 0.5:
+                        request(lambda: counters.vote(user, post_id, random.choice((Vote.LIKE, Vote.DISLIKE))))
+                    else:
+                        request(lambda: Comment.objects.create(user=user, post_id=post_id, text='Comment'))
+                    done += 1
+                except DatabaseError:
+                    failed += 1
+            writes.append(done)
+            failures.append(failed)
+
+        def reader():
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    request(lambda: list(Post.objects.select_related('user').order_by('-created_date', '-id')[:20]))
+                except DatabaseError:
+                    continue
+                read_timings.append((time.perf_counter() - started) * 1000)
+
+        threads = [threading.Thread(target=self.in_thread, args=(writer, number))
+                   for number in range(options['writers'])]
+        threads += [threading.Thread(target=self.in_thread, args=(reader,)) for _ in range(options['readers'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        counters.buffer.flush()
+        connection.close()
+        return sum(writes) / elapsed, sum(failures), len(read_timings) / elapsed, sorted(read_timings)
+
+    @staticmethod
+    def in_thread(func, *args):
+        try:
+            func(*args)
+        finally:
+            connection.close()
+
+    def report(self, name, result):
+        writes, failures, reads, timings = result
+        self.stdout.write('{:<10} {:>9.0f} {:>8} {:>9.0f} {:>12.1f} {:>12.1f}'.format(
+            name, writes, failures, reads,
+            statistics.median(timings) if timings else 0,
+            timings[max(0, int(len(timings) * 0.95) - 1)] if timings else 0))
@@ -0,0 +1,96 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import override_settings
+from django.utils import timezone
+
+from myapp import feed
+from myapp.benchmarks import make_vocabulary
+from myapp.models import Post
+
+# the card template as it was before myapp.feed, rendered from a Post
+LEGACY_TEMPLATES = {
+    'legacy/card.html': '''{% load responsive %}
+<div class="container">
+    <h3>{{ post.title }}</h3>
+    {% with cover=post.cover %}
+        {% if cover %}
+            {% responsive_image cover sizes="(min-width: 1200px) 340px, 30vw" class="img-thumbnail thumbnail rounded float-left" style="width: 30%; padding: 5px" %}
+        {% endif %}
+    {% endwith %}
+    {{ post.text|truncatewords:25 }} <a href="{% url 'myapp:show_post' post.pk %}">Read more...</a>
+    <p>{{ post.created_date }} &middot; {{ post.comment_count }} comment{{ post.comment_count|pluralize }}</p>
+</div>
+''',
+    'legacy/feed.html': '''{% for post in posts %}
+    <div class="col-md-12 inline">
+        {% include 'legacy/card.html' %}
+    </div>
+{% endfor %}''',
+}
+LOADERS = [
+    ('django.template.loaders.locmem.Loader', LEGACY_TEMPLATES),
+    'django.template.loaders.app_directories.Loader',
+]
+
+
+def templates(cached):
+    loaders = [('django.template.loaders.cached.Loader', LOADERS)] if cached else LOADERS
+    return [{'BACKEND': 'django.template.backends.django.DjangoTemplates', 'OPTIONS': {'loaders': loaders}}]
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the rendering of feeds of 100, 1,000 and 10,000 post cards: the old {% include %} per post '
+        'and render_to_string per card from Post instances, against myapp.feed over row dicts, each with and '
+        'without the cached template loader. Posts are built in memory; no database is used.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = make_vocabulary(rng, 5000)[0]
+        methods = [
+            ('include', lambda posts: render_to_string('legacy/feed.html', {'posts': posts})),
+            ('per-card', lambda posts: [render_to_string('legacy/card.html', {'post': post}) for post in posts]),
+            ('feed', lambda posts: feed.render_cards(feed.card_rows(posts))),
+        ]
+        self.stdout.write('{:>7}  {:<10} {:<9} {:>10} {:>10}'.format('cards', 'method', 'loader', 'p50 ms',
+                                                                     'us/card'))
+        for size in options['sizes']:
+            posts = self.make_posts(rng, words, size)
+            for cached in (False, True):
+                with override_settings(TEMPLATES=templates(cached)):
+                    for method, render in methods:
+                        render(posts[:10])  # warm up, and fill the cached loader
+                        timings = []
+                        for _ in range(options['repeat']):
+                            started = time.perf_counter()
+                            render(posts)
+                            timings.append((time.perf_counter() - started) * 1000)
+                        p50 = statistics.median(timings)
+                        self.stdout.write('{:>7}  {:<10} {:<9} {:>10.1f} {:>10.1f}'.format(
+                            size, method, 'cached' if cached else 'files', p50, p50 * 1000 / size))
+
+    @staticmethod
+    def make_posts(rng, words, size):
+        now = timezone.now()
+        posts = []
+        for pk in range(1, size + 1):
+            post = Post(pk=pk, user_id=1, title=' '.join(rng.choices(words, k=rng.randint(2, 6))),
+                        text=' '.join(rng.choices(words, k=rng.randint(20, 80))), created_date=now,
+                        comment_count=rng.randint(0, 20))
+            # half of the feed has a cover image
+            if pk % 2:
+                post.cover_image = 'blobs/{0:02x}/{0:064x}.jpg'.format(pk)
+                post.cover_card = 'posts_images/card/{:064x}.jpg'.format(pk)
+                post.cover_width, post.cover_height, post.cover_formats = 1600, 1200, 'avif,webp'
+            posts.append(post)
+        return posts
@@ -0,0 +1,91 @@
+import os
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from myapp import caching
+from myapp.images import derivative_name
+from myapp.models import Image, ImageDerivative, Post, Profile
+from myapp.storage import blob_name, blob_storage, file_digest
+
+
+def move(path, new_path):
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    os.replace(path, new_path)
+
+
+class Command(BaseCommand):
+    help = (
+        'Move images and profile photos saved before the content-addressed storage into it. Files with the '
+        'same bytes are stored once and reference-counted, the other copies are deleted.'
+    )
+
+    def handle(self, *args, **options):
+        default_photo = Profile._meta.get_field('photo').default
+        names = set(Image.objects.exclude(Q(image='') | Q(image__isnull=True) | Q(image__startswith='blobs/'))
+                    .values_list('image', flat=True))
+        names.update(Profile.objects.exclude(Q(photo='') | Q(photo__isnull=True) | Q(photo__startswith='blobs/'))
+                     .exclude(photo=default_photo).values_list('photo', flat=True))
+
+        moved = removed = freed = missing = 0
+        for name in sorted(names):
+            path = blob_storage.path(name)
+            if not os.path.exists(path):
+                missing += 1
+                continue
+            size = os.path.getsize(path)
+            with open(path, 'rb') as file:
+                new_name = blob_name(file_digest(File(file)), name)
+            exists = blob_storage.exists(new_name)
+            post_ids, user_ids = self.adopt(name, new_name, size, exists)
+            # the cached pages link the old file
+            caching.bump(caching.POSTS, *{caching.post_namespace(post_id) for post_id in post_ids})
+            for user_id in set(user_ids):
+                caching.invalidate_user(user_id)
+            if exists:
+                removed, freed = removed + 1, freed + size
+            else:
+                moved += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            'Moved {} files into blob storage, deleted {} duplicates ({:.1f} MiB), {} files were missing'.format(
+                moved, removed, freed / 1024 / 1024, missing)))
+
+    @transaction.atomic
+    def adopt(self, name, new_name, size, exists):
+        images = Image.objects.filter(image=name)
+        profiles = Profile.objects.filter(photo=name)
+        post_ids = list(images.values_list('post_id', flat=True))
+        user_ids = list(profiles.values_list('user_id', flat=True))
+        blob_storage.acquire(new_name, size, len(post_ids) + len(user_ids))
+
+        images.update(image=new_name)
+        profiles.update(photo=new_name)
+        Post.objects.filter(cover_image=name).update(cover_image=new_name)
+        derivatives = ImageDerivative.objects.filter(source=name)
+        moves = []
+        if ImageDerivative.objects.filter(source=new_name).exists():
+            for derivative in derivatives:
+                derivative.file.delete(save=False)
+            derivatives.delete()
+        else:
+            # responsive_image finds derivatives by the name of their source, so they move along with it
+            for derivative in derivatives:
+                old_file = derivative.file.name
+                derivative.source = new_name
+                derivative.file.name = derivative_name(new_name, derivative.width, derivative.format)
+                derivative.save(update_fields=['source', 'file'])
+                moves.append((old_file, derivative.file.name))
+
+        # last, so a failure above leaves the files where the rows still point
+        for old_file, new_file in moves:
+            if default_storage.exists(old_file):
+                move(default_storage.path(old_file), default_storage.path(new_file))
+        if exists:
+            os.remove(blob_storage.path(name))
+        else:
+            move(blob_storage.path(name), blob_storage.path(new_name))
+        return post_ids, user_ids
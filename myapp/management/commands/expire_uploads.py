@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from myapp.uploads import expire
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads that received nothing for UPLOAD_EXPIRY seconds, with their partial files.'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Expired {} uploads'.format(expire()))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from myapp.benchmarks import generate_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Add a synthetic dataset to the database: users with profiles, posts with images, '
+        'and comments and votes concentrated on a few popular posts. --scale multiplies every count.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--images', type=int, default=300)
+        parser.add_argument('--votes', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        counts = {name: max(1, int(options[name] * options['scale']))
+                  for name in ('users', 'posts', 'comments', 'images', 'votes')}
+        post_ids = generate_dataset(seed=options['seed'], **counts)
+        self.stdout.write('Added {users} users, {posts} posts, {comments} comments, {images} images '
+                          'and up to {votes} votes.'.format(**counts))
+        self.stdout.write('Most popular posts: {}'.format(', '.join(map(str, post_ids[:5]))))
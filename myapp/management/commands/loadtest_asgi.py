@@ -0,0 +1,158 @@
+import asyncio
+import io
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from myapp import aggregates
+from myapp.aio import ConcurrentASGIHandler
+from myapp.benchmarks import scratch_database
+from myapp.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the ASGI application in-process with many concurrent clients, the way an ASGI server '
+        'such as uvicorn does, and compare the stock Django 3.0 handler with ConcurrentASGIHandler '
+        'on the read endpoints. The WSGI handler is driven from as many threads, as a threaded WSGI '
+        'server such as gunicorn does. Runs on a scratch test database with caching disabled.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and handler.')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--posts', type=int, default=200)
+        parser.add_argument('--db-latency', type=float, default=2.0,
+                            help='Milliseconds added to every query, as a database server across the '
+                                 'network would; 0 measures in-process SQLite only.')
+
+    def handle(self, *args, **options):
+        dummy_cache = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with scratch_database(), override_settings(CACHES=dummy_cache):
+            post = self.populate(options['posts'])
+            authorization = [(b'authorization', 'Bearer {}'.format(AccessToken.for_user(post.user)).encode())]
+            endpoints = [
+                ('/', []),
+                ('/show_post/{}'.format(post.pk), []),
+                ('/api/posts/', authorization),
+                ('/api/posts/comments/get/{}/'.format(post.pk), authorization),
+            ]
+            latency = options['db_latency'] / 1000
+
+            def add_latency(execute, sql, params, many, context):
+                time.sleep(latency)
+                return execute(sql, params, many, context)
+
+            def install(sender, connection, **kwargs):
+                if add_latency not in connection.execute_wrappers:
+                    connection.execute_wrappers.append(add_latency)
+
+            if latency:
+                connection_created.connect(install)
+            try:
+                self.run(endpoints, options['requests'], options['concurrency'])
+            finally:
+                connection_created.disconnect(install)
+
+    def populate(self, count):
+        users = [User.objects.create_user(username='load{}'.format(number)) for number in range(10)]
+        Post.objects.bulk_create(
+            Post(user=users[number % len(users)], title='Post {}'.format(number), text='Text ' * 50)
+            for number in range(count)
+        )
+        post = Post.objects.select_related('user').last()
+        Comment.objects.bulk_create(Comment(user=user, post=post, text='Comment') for user in users)
+        aggregates.rebuild()
+        return post
+
+    def run(self, endpoints, requests, concurrency):
+        self.stdout.write('{:<34} {:<8} {:>8} {:>9} {:>9}'.format('endpoint', 'handler', 'req/s', 'p50 ms', 'p95 ms'))
+        for path, headers in endpoints:
+            for name, application in (('wsgi', WSGIHandler()), ('sync', ASGIHandler()),
+                                      ('async', ConcurrentASGIHandler())):
+                if name == 'wsgi':
+                    elapsed, timings, statuses = self.load_wsgi(application, path, headers, requests, concurrency)
+                else:
+                    elapsed, timings, statuses = asyncio.run(
+                        self.load(application, path, headers, requests, concurrency))
+                if statuses != {200}:
+                    self.stderr.write('{} answered {}'.format(path, sorted(statuses)))
+                timings.sort()
+                self.stdout.write('{:<34} {:<8} {:>8.0f} {:>9.1f} {:>9.1f}'.format(
+                    path, name, requests / elapsed, statistics.median(timings),
+                    timings[max(0, int(len(timings) * 0.95) - 1)]))
+
+    async def load(self, application, path, headers, requests, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        timings, statuses = [], set()
+
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                statuses.add(await self.request(application, path, headers))
+                timings.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - started, timings, statuses
+
+    def load_wsgi(self, application, path, headers, requests, concurrency):
+        timings, statuses = [], set()
+
+        def one(_):
+            started = time.perf_counter()
+            statuses.add(self.request_wsgi(application, path, headers))
+            timings.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(one, range(requests)))
+        return time.perf_counter() - started, timings, statuses
+
+    @staticmethod
+    def request_wsgi(application, path, headers):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1', 'HTTP_HOST': 'localhost',
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+            'wsgi.errors': io.StringIO(), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        environ.update(('HTTP_' + name.decode().upper().replace('-', '_'), value.decode()) for name, value in headers)
+        started = []
+        response = application(environ, lambda status, response_headers: started.append(int(status[:3])))
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        return started[0]
+
+    @staticmethod
+    async def request(application, path, headers):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'root_path': '', 'query_string': b'',
+            'headers': [(b'host', b'localhost')] + headers,
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+        }
+        started = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                started.append(message['status'])
+
+        await application(scope, receive, send)
+        return started[0]
@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from myapp.images import backfill, run_job, runnable_jobs
+from myapp.models import ImageJob
+
+
+class Command(BaseCommand):
+    help = 'Render queued image thumbnails and responsive derivatives in a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.IMAGE_JOBS_WORKERS)
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty.')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls.')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Requeue running jobs not updated for this many seconds.')
+        parser.add_argument('--backfill', action='store_true',
+                            help='First queue jobs for images that were never processed.')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if options['backfill']:
+            self.stdout.write('Queued {} image jobs'.format(backfill()))
+        with ProcessPoolExecutor(max_workers=workers) as processes, ThreadPoolExecutor(workers) as threads:
+            while True:
+                self.requeue_stale(options['stale_after'])
+                job_ids = list(runnable_jobs()[:workers * 4])
+                if job_ids:
+                    done = sum(threads.map(lambda job_id: self.run(job_id, processes), job_ids))
+                    self.stdout.write('Processed {} image jobs, {} failed'.format(done, len(job_ids) - done))
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+    @staticmethod
+    def run(job_id, executor):
+        try:
+            return run_job(job_id, executor)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def requeue_stale(seconds):
+        ImageJob.objects.filter(
+            status=ImageJob.RUNNING, updated_date__lt=timezone.now() - timedelta(seconds=seconds)
+        ).update(status=ImageJob.PENDING)
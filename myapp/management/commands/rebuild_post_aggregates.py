@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from myapp import aggregates, caching
+from myapp.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute the comment and image counts and the cover image stored on posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('post_ids', nargs='*', type=int, help='Only these posts (default: all).')
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.all()
+        if options['post_ids']:
+            queryset = queryset.filter(pk__in=options['post_ids'])
+        updated = aggregates.rebuild(queryset)
+        # the cached cards and pages show the old values
+        caching.bump(caching.POSTS, *(caching.post_namespace(pk) for pk in queryset.values_list('pk', flat=True)))
+        self.stdout.write(self.style.SUCCESS('Rebuilt {} posts'.format(updated)))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from myapp.models import Post
+from myapp.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Re-index every post in the configured search backend.'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        backend.setup()
+        backend.rebuild(Post.objects.only('pk', 'title', 'text').iterator(chunk_size=2000))
+        self.stdout.write(self.style.SUCCESS('Indexed {} posts'.format(Post.objects.count())))
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.replay import InvalidLog, Replay, read_log
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a request log (JSONL, the format is described in myapp.replay) against the application '
+        'in this process through the WSGI or ASGI handler, or against a running server, and report '
+        'throughput, error rates and latency per endpoint. The users in the log must exist in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('log')
+        parser.add_argument('--target', default='wsgi', help="'wsgi', 'asgi' or the URL of a running server.")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='Time compression: 10 replays ten times faster than recorded, 0 as fast as possible.')
+        parser.add_argument('--host', default='localhost', help='Host header of in-process requests.')
+        parser.add_argument('--limit', type=int, help='Replay only the first LIMIT requests.')
+        parser.add_argument('--output', help='Write the report to this JSON file.')
+
+    def handle(self, *args, **options):
+        if options['target'] not in ('wsgi', 'asgi') and not options['target'].startswith('http://'):
+            raise CommandError("--target must be 'wsgi', 'asgi' or an http:// URL.")
+        try:
+            records = read_log(options['log'])
+        except InvalidLog as exc:
+            raise CommandError(exc)
+        if options['limit']:
+            records = records[:options['limit']]
+        if not records:
+            raise CommandError('{} has no requests.'.format(options['log']))
+
+        replay = Replay(records, options['target'], options['concurrency'], options['speed'], options['host'])
+        report = replay.report(replay.run())
+
+        self.stdout.write('{requests} requests in {seconds:.2f} s: {throughput:.1f} req/s, {errors} errors '
+                          '({rate:.2%}), max lag {max_lag_ms:.0f} ms'.format(
+                              requests=report['overall']['requests'], errors=report['overall']['errors'],
+                              rate=report['error_rate'], **report))
+        if report['unknown_users']:
+            self.stderr.write('Sent anonymously, unknown users: {}'.format(', '.join(report['unknown_users'])))
+        self.stdout.write('{:<28} {:>8} {:>7} {:>7} {:>9} {:>9} {:>9}'.format(
+            'endpoint', 'requests', 'errors', '4xx', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for name, result in report['endpoints'].items():
+            self.stdout.write('{:<28} {requests:>8} {errors:>7} {client_errors:>7} {p50_ms:>9.2f} {p95_ms:>9.2f} '
+                              '{p99_ms:>9.2f}'.format(name, **result))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+                file.write('\n')
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from myapp.replication import copy_database
+
+
+class Command(BaseCommand):
+    help = (
+        'Stand-in for database replication when developing with SQLite: copy the primary '
+        'over every database in DATABASE_REPLICAS, once or every --interval seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('replicas', nargs='*', help='Aliases to copy to; DATABASE_REPLICAS by default.')
+        parser.add_argument('--interval', type=float, help='Keep copying, this many seconds apart.')
+
+    def handle(self, *args, **options):
+        replicas = options['replicas'] or settings.DATABASE_REPLICAS
+        if not replicas:
+            raise CommandError('No replicas given and DATABASE_REPLICAS is empty.')
+        for alias in [DEFAULT_DB_ALIAS] + replicas:
+            if alias not in connections.databases:
+                raise CommandError('Unknown database alias {}.'.format(alias))
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError('{} is not an SQLite database.'.format(alias))
+        while True:
+            for alias in replicas:
+                copy_database(DEFAULT_DB_ALIAS, alias)
+            self.stdout.write('Copied {} to {}'.format(DEFAULT_DB_ALIAS, ', '.join(replicas)))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,178 @@
+import itertools
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from myapp.benchmarks import generate_dataset, percentile, scratch_database
+from myapp.models import Post
+
+DATASET = {'users': 50, 'posts': 500, 'comments': 5000, 'images': 300, 'votes': 2000}
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic dataset on a scratch test database and drive the main endpoints through '
+        'the test client: home, show_post, search, /api/posts/, like and add_comment. Reports latency '
+        'percentiles, queries per request and peak memory; --output stores them as JSON and --compare '
+        'prints the change against an earlier result file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplies the dataset size.')
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--memory-requests', type=int, default=20,
+                            help='Requests per endpoint replayed under tracemalloc for the peak memory.')
+        parser.add_argument('--cold', action='store_true', help='Disable caching (DummyCache).')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--compare', help='A JSON file written by an earlier run.')
+
+    def handle(self, *args, **options):
+        dataset = {name: max(1, int(count * options['scale'])) for name, count in DATASET.items()}
+        media_root = tempfile.mkdtemp()
+        overrides = {
+            'ALLOWED_HOSTS': ['testserver'],
+            'MEDIA_ROOT': media_root,
+            'METRICS_SAMPLE_RATE': 0,
+            'NPLUSONE_MODE': None,
+            'IMAGE_JOBS_MODE': 'worker',
+        }
+        if options['cold']:
+            overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        try:
+            with scratch_database(), override_settings(**overrides):
+                started = time.perf_counter()
+                post_ids = generate_dataset(seed=options['seed'], **dataset)
+                self.stdout.write('Generated {} in {:.1f} s'.format(
+                    ', '.join('{} {}'.format(count, name) for name, count in dataset.items()),
+                    time.perf_counter() - started))
+                results = self.run(post_ids, options)
+        finally:
+            shutil.rmtree(media_root)
+
+        report = {
+            'meta': {
+                'commit': self.commit(),
+                'created': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'dataset': dataset,
+                'requests': options['requests'],
+                'cold': options['cold'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }
+        self.print_results(results)
+        if options['compare']:
+            with open(options['compare']) as file:
+                self.print_comparison(json.load(file), report)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+                file.write('\n')
+
+    def scenarios(self, post_ids, seed):
+        rng = random.Random(seed)
+        user = User.objects.filter(profile__isnull=False).order_by('pk').first()
+        anonymous, session, api = Client(), Client(), Client(HTTP_AUTHORIZATION='Bearer {}'.format(
+            AccessToken.for_user(user)))
+        session.force_login(user)
+        # the requests of popular posts dominate, as in the dataset
+        popular = itertools.cycle(rng.choices(post_ids, weights=[1 / rank for rank in range(1, len(post_ids) + 1)],
+                                              k=1000))
+        liked = itertools.cycle(rng.sample(post_ids, len(post_ids)))
+        words = [word for title in Post.objects.values_list('title', flat=True)[:200] for word in title.split()]
+        return [
+            ('home', lambda: anonymous.get('/')),
+            ('show_post', lambda: anonymous.get('/show_post/{}'.format(next(popular)))),
+            ('search', lambda: anonymous.get('/search', {'search': rng.choice(words)})),
+            ('api_posts', lambda: api.get('/api/posts/')),
+            ('like', lambda: session.get('/like/{}'.format(next(liked)))),
+            ('add_comment', lambda: api.post('/api/posts/comments/add/{}/'.format(next(popular)),
+                                             {'text': 'Benchmark comment'})),
+        ]
+
+    def run(self, post_ids, options):
+        results = {}
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        for name, request in self.scenarios(post_ids, options['seed']):
+            for _ in range(options['warmup']):
+                request()
+            timings, errors = [], 0
+            del queries[:]
+            with connection.execute_wrapper(count):
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    response = request()
+                    timings.append((time.perf_counter() - started) * 1000)
+                    errors += response.status_code >= 400
+            query_count = len(queries)
+
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+            for _ in range(options['memory_requests']):
+                request()
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            tracemalloc.stop()
+
+            timings.sort()
+            results[name] = {
+                'p50_ms': round(percentile(timings, 0.50), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+                'mean_ms': round(statistics.mean(timings), 3),
+                'queries_per_request': round(query_count / len(timings), 2),
+                'peak_memory_kib': round(peak / 1024, 1),
+                'errors': errors,
+            }
+        return results
+
+    @staticmethod
+    def commit():
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def print_results(self, results):
+        self.stdout.write('{:<12} {:>9} {:>9} {:>9} {:>9} {:>11} {:>7}'.format(
+            'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'peak KiB', 'errors'))
+        for name, result in results.items():
+            self.stdout.write('{:<12} {p50_ms:>9.2f} {p95_ms:>9.2f} {p99_ms:>9.2f} {queries_per_request:>9.2f} '
+                              '{peak_memory_kib:>11.1f} {errors:>7}'.format(name, **result))
+
+    def print_comparison(self, before, after):
+        self.stdout.write('\nChange against {} ({}):'.format(before['meta'].get('commit'), before['meta']['created']))
+        self.stdout.write('{:<12} {:>9} {:>9} {:>9} {:>9}'.format('endpoint', 'p50', 'p95', 'p99', 'queries'))
+        for name, result in after['results'].items():
+            old = before['results'].get(name)
+            if old is None:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'):
+                changes.append('{:+.0%}'.format(result[key] / old[key] - 1) if old[key] else 'n/a')
+            self.stdout.write('{:<12} {:>9} {:>9} {:>9} {:>9}'.format(name, *changes))
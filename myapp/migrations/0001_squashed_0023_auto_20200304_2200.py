@@ -0,0 +1,88 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:35
+#
+# The schema of the models as of migration 0023, which is what db.sqlite3 holds.
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    # the migrations the project's database was built with, before they were squashed
+    replaces = [
+        ('myapp', '0001_initial'),
+        ('myapp', '0002_auto_20200301_0920'),
+        ('myapp', '0003_auto_20200301_1125'),
+        ('myapp', '0004_auto_20200301_1129'),
+        ('myapp', '0005_auto_20200301_1205'),
+        ('myapp', '0006_auto_20200301_1241'),
+        ('myapp', '0007_auto_20200301_1545'),
+        ('myapp', '0008_auto_20200301_1616'),
+        ('myapp', '0009_auto_20200301_2129'),
+        ('myapp', '0010_auto_20200301_2143'),
+        ('myapp', '0011_auto_20200302_1552'),
+        ('myapp', '0012_auto_20200303_0023'),
+        ('myapp', '0013_auto_20200303_1203'),
+        ('myapp', '0014_auto_20200303_1245'),
+        ('myapp', '0015_auto_20200303_1306'),
+        ('myapp', '0016_auto_20200303_1326'),
+        ('myapp', '0017_auto_20200303_1812'),
+        ('myapp', '0018_auto_20200304_0102'),
+        ('myapp', '0019_auto_20200304_1118'),
+        ('myapp', '0020_auto_20200304_1203'),
+        ('myapp', '0021_auto_20200304_1204'),
+        ('myapp', '0022_auto_20200304_2155'),
+        ('myapp', '0023_auto_20200304_2200'),
+    ]
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gender', models.CharField(blank=True, max_length=10, null=True)),
+                ('city', models.CharField(blank=True, max_length=100, null=True)),
+                ('emotions', models.TextField(blank=True, max_length=1000, null=True)),
+                ('photo', models.ImageField(blank=True, default='user_empty_photo.jpg', null=True, upload_to='profile_photos/')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Post',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(blank=True, default='', max_length=200, null=True)),
+                ('text', models.TextField(max_length=30000)),
+                ('created_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('likes', models.IntegerField(default=0)),
+                ('dislikes', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='posts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Image',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(blank=True, null=True, upload_to='posts_images/')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='myapp.Post')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Comment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(max_length=3000)),
+                ('created_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('post', models.ForeignKey(default=None, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='myapp.Post')),
+                ('user', models.ForeignKey(default=None, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0001_squashed_0023_auto_20200304_2200'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created_date', 'id'], name='post_created_id_idx'),
+        ),
+    ]
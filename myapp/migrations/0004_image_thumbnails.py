@@ -0,0 +1,43 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='card',
+            field=models.ImageField(blank=True, null=True, upload_to='posts_images/card/'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='detail',
+            field=models.ImageField(blank=True, null=True, upload_to='posts_images/detail/'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, upload_to='profile_photos/avatar/'),
+        ),
+        migrations.CreateModel(
+            name='ImageJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='myapp.Image')),
+                ('profile', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='myapp.Profile')),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_image_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='formats',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('width', models.PositiveIntegerField()),
+                ('format', models.CharField(max_length=10)),
+                ('file', models.ImageField(max_length=255, upload_to='derivatives/')),
+                ('size', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('source', 'width', 'format')},
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:35
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_aggregates(apps, schema_editor):
+    """What ``manage.py rebuild_post_aggregates`` does, with the models of this migration."""
+    Post, Comment, Image = (apps.get_model('myapp', name) for name in ('Post', 'Comment', 'Image'))
+
+    def count(model):
+        counts = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(count=Count('pk'))
+        return Coalesce(Subquery(counts.values('count')), Value(0))
+
+    first_image = Image.objects.filter(post=OuterRef('pk')).order_by('pk')
+    Post.objects.update(
+        comment_count=count(Comment),
+        image_count=count(Image),
+        cover_image=Subquery(first_image.values('image')[:1]),
+        cover_card=Subquery(first_image.values('card')[:1]),
+        cover_width=Subquery(first_image.values('width')[:1]),
+        cover_height=Subquery(first_image.values('height')[:1]),
+        cover_formats=Coalesce(Subquery(first_image.values('formats')[:1]), Value('')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='cover_card',
+            field=models.ImageField(blank=True, null=True, upload_to='posts_images/card/'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='cover_formats',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='cover_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='cover_image',
+            field=models.ImageField(blank=True, null=True, upload_to='posts_images/'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='cover_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:35
+
+from django.db import migrations, models
+import myapp.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=myapp.storage.BlobStorage(), upload_to='posts_images/'),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='photo',
+            field=models.ImageField(blank=True, default='user_empty_photo.jpg', null=True, storage=myapp.storage.BlobStorage(), upload_to='profile_photos/'),
+        ),
+    ]
@@ -1,22 +1,39 @@
-import os
+import uuid
 
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 
+from . import search
+from .storage import blob_storage
+
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     gender = models.CharField(max_length=10, blank=True, null=True)
     city = models.CharField(max_length=100, blank=True, null=True)
     emotions = models.TextField(max_length=1000, blank=True, null=True)
-    photo = models.ImageField(upload_to='profile_photos/', blank=True, null=True, default='user_empty_photo.jpg')
+    photo = models.ImageField(upload_to='profile_photos/', storage=blob_storage, blank=True, null=True,
+                              default='user_empty_photo.jpg')
+    avatar = models.ImageField(upload_to='profile_photos/avatar/', blank=True, null=True)
+
+    @property
+    def avatar_url(self):
+        # the original is shown until the background job has made the avatar
+        return self.avatar.url if self.avatar else self.photo.url
+
+    def release_photo(self):
+        """Drop this profile's reference to its photo, unless that is the shared default."""
+        if self.photo and self.photo.name != self._meta.get_field('photo').default:
+            self.photo.storage.release(self.photo.name)
 
     def set_image_to_default(self):
-        os.remove(self.photo.path)
-        self.photo = 'user_empty_photo.jpg'
+        self.release_photo()
+        if self.avatar:
+            self.avatar.delete(save=False)
+        self.photo = self._meta.get_field('photo').default
         super(Profile, self).save()
 
     def __str__(self):
@@ -24,12 +41,36 @@ class Profile(models.Model):
 
 
 class Post(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, name='user', related_name='posts')
+    # indexed by post_user_created_idx below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, name='user', related_name='posts', db_index=False)
     title = models.CharField(max_length=200, default='', blank=True, null=True)
     text = models.TextField(max_length=30000)
     created_date = models.DateTimeField(default=timezone.now)
     likes = models.IntegerField(default=0)
     dislikes = models.IntegerField(default=0)
+    # denormalized from the comments and images, kept up to date by myapp.aggregates
+    comment_count = models.PositiveIntegerField(default=0)
+    image_count = models.PositiveIntegerField(default=0)
+    cover_image = models.ImageField(upload_to='posts_images/', blank=True, null=True)
+    cover_card = models.ImageField(upload_to='posts_images/card/', blank=True, null=True)
+    cover_width = models.PositiveIntegerField(blank=True, null=True)
+    cover_height = models.PositiveIntegerField(blank=True, null=True)
+    cover_formats = models.CharField(max_length=50, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_date', 'id'], name='post_created_id_idx'),
+            # a user's posts in feed order, either direction
+            models.Index(fields=['user', 'created_date', 'id'], name='post_user_created_idx'),
+        ]
+
+    @property
+    def cover(self):
+        """The first image, rebuilt from the cover fields; enough for {% responsive_image %}."""
+        if not self.cover_image:
+            return None
+        return Image(post=self, image=self.cover_image.name, card=self.cover_card.name, width=self.cover_width,
+                     height=self.cover_height, formats=self.cover_formats)
 
     def __str__(self):
         return self.title
@@ -37,19 +78,95 @@ class Post(models.Model):
 
 class Image(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, name='post', related_name='images')
-    image = models.ImageField(upload_to='posts_images/', blank=True, null=True)
+    image = models.ImageField(upload_to='posts_images/', storage=blob_storage, blank=True, null=True)
+    card = models.ImageField(upload_to='posts_images/card/', blank=True, null=True)
+    detail = models.ImageField(upload_to='posts_images/detail/', blank=True, null=True)
+    # filled in with the derivatives; drive the srcset without a query
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    formats = models.CharField(max_length=50, blank=True, default='')
+
 
-    def delete(self, *args, **kwargs):
-        os.remove(self.image.path)
-        super().delete(*args, **kwargs)
+class ImageDerivative(models.Model):
+    """A resized, re-encoded copy of an uploaded image, keyed by (source, width, format)."""
+    source = models.CharField(max_length=255)
+    width = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    file = models.ImageField(upload_to='derivatives/', max_length=255)
+    size = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('source', 'width', 'format')
 
 
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, name='user', related_name='comments', default=None)
-    post = models.ForeignKey(Post, on_delete=models.CASCADE, name='post', related_name='comments', default=None)
+    # indexed by comment_post_created_idx below
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, name='post', related_name='comments', default=None,
+                             db_index=False)
     text = models.TextField(max_length=3000)
     created_date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # a post's comments in date order
+            models.Index(fields=['post', 'created_date', 'id'], name='comment_post_created_idx'),
+            # the NDJSON export
+            models.Index(fields=['created_date', 'id'], name='comment_created_id_idx'),
+        ]
+
+
+class ImageJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = ((PENDING, 'pending'), (RUNNING, 'running'), (DONE, 'done'), (FAILED, 'failed'))
+
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='jobs', blank=True, null=True)
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='jobs', blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_date = models.DateTimeField(default=timezone.now)
+    updated_date = models.DateTimeField(default=timezone.now)
+
+
+class Blob(models.Model):
+    """A file of ``myapp.storage.BlobStorage`` and how many images and photos refer to it."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    references = models.PositiveIntegerField(default=0)
+
+
+class Upload(models.Model):
+    """A chunked upload in progress; ``received`` bytes of ``size`` are in ``part_name`` so far."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    created_date = models.DateTimeField(default=timezone.now)
+    updated_date = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @property
+    def part_name(self):
+        return 'uploads/{}.part'.format(self.id.hex)
+
+
+class Vote(models.Model):
+    LIKE = 1
+    DISLIKE = -1
+    VALUES = ((LIKE, 'like'), (DISLIKE, 'dislike'))
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, name='user', related_name='votes')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, name='post', related_name='votes')
+    value = models.SmallIntegerField(choices=VALUES)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('user', 'post')
+
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -58,5 +175,39 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, update_fields=None, **kwargs):
+    # logging in only touches last_login, nothing the profile depends on
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
     instance.profile.save()
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.get_backend().index(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.get_backend().remove(instance.pk)
+
+
+# receivers rather than delete() overrides, so the files also go when a post or user is deleted by cascade
+
+@receiver(post_delete, sender=Image)
+def delete_image_files(sender, instance, **kwargs):
+    for thumbnail in (instance.card, instance.detail):
+        if thumbnail:
+            thumbnail.delete(save=False)
+    # other images and photos may share the stored file and its derivatives
+    if instance.image and instance.image.storage.release(instance.image.name):
+        for derivative in ImageDerivative.objects.filter(source=instance.image.name):
+            derivative.file.delete(save=False)
+            derivative.delete()
+
+
+@receiver(post_delete, sender=Profile)
+def delete_profile_files(sender, instance, **kwargs):
+    instance.release_photo()
+    if instance.avatar:
+        instance.avatar.delete(save=False)
@@ -0,0 +1,126 @@
+"""
+N+1 query detection for development and tests.
+
+Inside ``detect()``, and in every request while ``NPLUSONE_MODE`` is set
+(``NPlusOneMiddleware``), each query is recorded under its shape: the SQL
+with the parameters left out and ``IN`` lists collapsed. A shape that runs
+``NPLUSONE_THRESHOLD`` times or more is an N+1 pattern and is reported with
+the template line, serializer field and line of project code the queries
+came from, found by walking the stack.
+"""
+import contextvars
+import logging
+import os
+import re
+import sys
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+IN_LIST = re.compile(r'%s(?:, %s)+')
+# project modules that only pass queries through
+WRAPPERS = {__file__, instrumentation.__file__}
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+class Collector:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sources = defaultdict(Counter)
+
+    def add(self, shape, source):
+        with self.lock:
+            self.sources[shape][source] += 1
+
+    def problems(self, threshold=None):
+        """``[(shape, Counter of sources)]`` of the shapes that ran at least ``threshold`` times."""
+        threshold = threshold or settings.NPLUSONE_THRESHOLD
+        with self.lock:
+            return [(shape, sources) for shape, sources in self.sources.items()
+                    if sum(sources.values()) >= threshold]
+
+
+_collector = contextvars.ContextVar('nplusone_collector', default=None)
+
+
+def find_source():
+    """``(template line, serializer field, project line)`` of the query being run, each or None."""
+    template = field = code = None
+    frame = sys._getframe(1)
+    while frame is not None and not (template and field and code):
+        name, filename = frame.f_code.co_name, frame.f_code.co_filename
+        if name == 'render_annotated' and template is None:
+            node = frame.f_locals.get('self')
+            token, origin = getattr(node, 'token', None), getattr(node, 'origin', None)
+            if token is not None and origin is not None:
+                template = '{}:{}'.format(origin.template_name or origin.name, token.lineno)
+        elif name == 'to_representation' and field is None and 'field' in frame.f_locals:
+            # the loop over the fields in rest_framework.serializers.Serializer
+            field = '{}.{}'.format(type(frame.f_locals['self']).__name__, frame.f_locals['field'].field_name)
+        elif (code is None and filename.startswith(settings.BASE_DIR) and filename not in WRAPPERS
+              and 'site-packages' not in filename):
+            code = '{}:{}'.format(os.path.relpath(filename, settings.BASE_DIR), frame.f_lineno)
+        frame = frame.f_back
+    return template, field, code
+
+
+def record_query(execute, sql, params, many, context):
+    collector = _collector.get()
+    if collector is not None and not many:
+        collector.add(IN_LIST.sub('%s, ...', sql), find_source())
+    return execute(sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def detect():
+    collector = Collector()
+    token = _collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _collector.reset(token)
+
+
+def describe(problems):
+    lines = []
+    for shape, sources in problems:
+        lines.append('{} queries: {}'.format(sum(sources.values()), shape))
+        for (template, field, code), count in sources.most_common():
+            where = ', '.join(part for part in (template, field, code) if part) or 'unknown'
+            lines.append('    {} from {}'.format(count, where))
+    return '\n'.join(lines)
+
+
+class NPlusOneMiddleware:
+    """Log N+1 patterns of each request (``NPLUSONE_MODE = 'log'``) or fail the request (``'raise'``)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.NPLUSONE_MODE:
+            return self.get_response(request)
+        with detect() as collector:
+            response = self.get_response(request)
+        problems = collector.problems()
+        if problems:
+            message = 'N+1 queries in {} {}:\n{}'.format(request.method, request.path, describe(problems))
+            if settings.NPLUSONE_MODE == 'raise':
+                raise NPlusOneError(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,87 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_date, pk, reverse=False):
+    raw = json.dumps([created_date.isoformat(), pk, int(reverse)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode((cursor + '=' * (-len(cursor) % 4)).encode())
+        created, pk, reverse = json.loads(raw.decode())
+        created_date = parse_datetime(created)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if created_date is None or not isinstance(pk, int):
+        raise InvalidCursor(cursor)
+    return created_date, pk, bool(reverse)
+
+
+def get_page_size(request, default=None):
+    default = default or settings.FEED_PAGE_SIZE
+    try:
+        page_size = int(request.GET.get('page_size', default))
+    except ValueError:
+        page_size = default
+    return max(1, min(page_size, settings.FEED_MAX_PAGE_SIZE))
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def paginate_keyset(queryset, cursor=None, page_size=None):
+    """
+    Slice ``queryset`` by its ``(created_date, id)`` position instead of an
+    OFFSET, so every page is a bounded range scan over the
+    ``post_created_id_idx``-style composite index.
+    """
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    reverse = False
+    if cursor:
+        created_date, pk, reverse = decode_cursor(cursor)
+        # The leading created_date range keeps the lookup sargable, the OR
+        # only breaks ties between rows sharing a timestamp.
+        if reverse:
+            queryset = queryset.filter(Q(created_date__lte=created_date),
+                                       Q(created_date__lt=created_date) | Q(pk__lt=pk))
+        else:
+            queryset = queryset.filter(Q(created_date__gte=created_date),
+                                       Q(created_date__gt=created_date) | Q(pk__gt=pk))
+    ordering = ('-created_date', '-pk') if reverse else ('created_date', 'pk')
+    rows = list(queryset.order_by(*ordering)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    if reverse:
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, bool(cursor)
+
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(rows[-1].created_date, rows[-1].pk)
+    if rows and has_previous:
+        previous_cursor = encode_cursor(rows[0].created_date, rows[0].pk, reverse=True)
+    return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,381 @@
+"""
+Request logs and their replay.
+
+A request log is a JSONL file with one request per line::
+
+    {"ts": 1718000000.123, "method": "GET", "path": "/api/posts/?page_size=20",
+     "user": "alice", "status": 200, "duration_ms": 12.5}
+    {"ts": 1718000000.9, "method": "POST", "path": "/api/posts/comments/add/7/",
+     "user": "alice", "content_type": "application/json", "body": {"text": "Nice"}}
+
+``ts`` (seconds), ``method`` and ``path`` (with the query string) are
+required. ``user`` is a username; the replay authenticates it with a JWT and
+a session cookie. ``body`` is a string, or an object sent as JSON or as form
+fields depending on ``content_type``. ``status`` and ``duration_ms`` are what
+was recorded and only used for comparison. ``RequestLogMiddleware`` writes
+this format to ``REQUEST_LOG_PATH``.
+
+The ``requests.jsonl`` at the root of the repository is a backlog of change
+requests, not a request log; ``read_log`` refuses it.
+"""
+import asyncio
+import io
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import unquote, urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.http import HttpRequest
+from django.middleware.csrf import get_token
+from django.urls import Resolver404, resolve
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .aio import ConcurrentASGIHandler
+from .benchmarks import percentile
+
+# form and JSON fields never written to the log: passwords and JWTs
+SECRET_FIELDS = ('password', 'password1', 'password2', 'refresh', 'access', 'token')
+MAX_LOGGED_BODY = 10000
+# bodies that are not logged, such as form uploads and upload chunks
+BINARY_CONTENT_TYPES = ('multipart/form-data', 'application/octet-stream')
+
+
+class InvalidLog(ValueError):
+    pass
+
+
+def read_log(path):
+    """The records of the request log at ``path``, in time order."""
+    records = []
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise InvalidLog('{}:{}: not JSON'.format(path, number))
+            if 'request_id' in record and 'path' not in record:
+                raise InvalidLog('{} is a backlog of change requests, not a request log.'.format(path))
+            if not all(key in record for key in ('ts', 'method', 'path')):
+                raise InvalidLog('{}:{}: ts, method and path are required'.format(path, number))
+            records.append(record)
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+def endpoint(path):
+    try:
+        return resolve(urlsplit(path).path).view_name
+    except Resolver404:
+        return '<unresolved>'
+
+
+class Credentials:
+    """Access tokens and session cookies for the users of a log, made once per user."""
+
+    def __init__(self):
+        self._headers = {}
+        self.unknown = set()
+
+    def headers(self, username):
+        if username not in self._headers:
+            user = User.objects.filter(username=username).first()
+            if user is None:
+                self.unknown.add(username)
+                self._headers[username] = []
+            else:
+                self._headers[username] = self.make_headers(user)
+        return self._headers[username]
+
+    @staticmethod
+    def make_headers(user):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        request = HttpRequest()
+        csrf_token = get_token(request)
+        cookie = '{}={}; {}={}'.format(settings.SESSION_COOKIE_NAME, session.session_key,
+                                       settings.CSRF_COOKIE_NAME, request.META['CSRF_COOKIE'])
+        return [('authorization', 'Bearer {}'.format(AccessToken.for_user(user))),
+                ('cookie', cookie), ('x-csrftoken', csrf_token)]
+
+
+def build_request(record, credentials):
+    """``(method, path, headers, body)`` of a log record."""
+    headers = list(credentials.headers(record['user'])) if record.get('user') else []
+    body = record.get('body')
+    content_type = record.get('content_type')
+    if isinstance(body, (dict, list)):
+        if content_type == 'application/x-www-form-urlencoded':
+            body = urlencode(body, doseq=True)
+        else:
+            content_type = content_type or 'application/json'
+            body = json.dumps(body)
+    body = (body or '').encode()
+    if content_type:
+        headers.append(('content-type', content_type))
+    return record['method'].upper(), record['path'], headers, body
+
+
+class WSGITarget:
+    """Calls the WSGI handler in this process, from the replay threads."""
+
+    def __init__(self, host):
+        self.host = host
+        self.application = WSGIHandler()
+
+    def __call__(self, method, path, headers, body):
+        url = urlsplit(path)
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': unquote(url.path), 'QUERY_STRING': url.query,
+            'SCRIPT_NAME': '', 'SERVER_NAME': self.host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1', 'HTTP_HOST': self.host, 'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+        for name, value in headers:
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            else:
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+        status = []
+        response = self.application(environ, lambda line, response_headers, exc_info=None: status.append(line))
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        return int(status[0].split()[0])
+
+
+class HTTPTarget:
+    """Sends the requests to a running server, one keep-alive connection per replay thread."""
+
+    def __init__(self, url):
+        self.url = urlsplit(url)
+        self.local = threading.local()
+
+    def __call__(self, method, path, headers, body):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = HTTPConnection(self.url.hostname, self.url.port or 80, timeout=60)
+        try:
+            self.local.connection.request(method, self.url.path.rstrip('/') + path, body=body, headers=dict(headers))
+            response = self.local.connection.getresponse()
+            response.read()
+            return response.status
+        except Exception:
+            self.local.connection.close()
+            self.local.connection = None
+            raise
+
+
+async def asgi_request(application, host, method, path, headers, body):
+    url = urlsplit(path)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': unquote(url.path), 'root_path': '', 'query_string': url.query.encode(),
+        'headers': [(b'host', host.encode()), (b'content-length', str(len(body)).encode())] + [
+            (name.encode(), value.encode()) for name, value in headers],
+        'server': (host, 80), 'client': ('127.0.0.1', 50000),
+    }
+    status = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+class Replay:
+    """
+    Send the records of a log to ``target`` ('wsgi', 'asgi' or an http://
+    URL), keeping their relative timing divided by ``speed`` (0: as fast as
+    possible), with at most ``concurrency`` requests in flight.
+    """
+
+    def __init__(self, records, target='wsgi', concurrency=8, speed=1.0, host='localhost'):
+        self.records = records
+        self.target = target
+        self.concurrency = concurrency
+        self.speed = speed
+        self.host = host
+        self.credentials = Credentials()
+        self.results = []  # (endpoint, status or None, milliseconds, lag seconds, recorded status)
+        self.lock = threading.Lock()
+
+    def due(self, record):
+        """Seconds from the start of the replay at which ``record`` is sent."""
+        if not self.speed:
+            return 0
+        return (record['ts'] - self.records[0]['ts']) / self.speed
+
+    def run(self):
+        # authenticate every user up front, on this thread
+        requests = [build_request(record, self.credentials) for record in self.records]
+        started = time.perf_counter()
+        if self.target == 'asgi':
+            asyncio.run(self.run_asgi(requests))
+        else:
+            target = WSGITarget(self.host) if self.target == 'wsgi' else HTTPTarget(self.target)
+            self.run_threads(target, requests)
+        return time.perf_counter() - started
+
+    def record_result(self, record, status, started, scheduled):
+        with self.lock:
+            self.results.append((endpoint(record['path']), status, (time.perf_counter() - started) * 1000,
+                                 started - scheduled, record.get('status')))
+
+    def run_threads(self, target, requests):
+        start = time.perf_counter()
+        slots = threading.BoundedSemaphore(self.concurrency)
+
+        def send(record, request, scheduled):
+            started = time.perf_counter()
+            try:
+                status = target(*request)
+            except Exception:
+                status = None
+            finally:
+                slots.release()
+            self.record_result(record, status, started, scheduled)
+
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            for record, request in zip(self.records, requests):
+                scheduled = start + self.due(record)
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                slots.acquire()
+                executor.submit(send, record, request, scheduled)
+            # one task per worker thread, to close the connections they opened
+            barrier = threading.Barrier(self.concurrency)
+
+            def close():
+                barrier.wait()
+                connections.close_all()
+
+            for _ in range(self.concurrency):
+                executor.submit(close)
+
+    async def run_asgi(self, requests):
+        application = ConcurrentASGIHandler()
+        start = time.perf_counter()
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def send(record, request, scheduled):
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    status = await asgi_request(application, self.host, *request)
+                except Exception:
+                    status = None
+                self.record_result(record, status, started, scheduled)
+
+        tasks = []
+        for record, request in zip(self.records, requests):
+            scheduled = start + self.due(record)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(send(record, request, scheduled)))
+        await asyncio.gather(*tasks)
+
+    def report(self, elapsed):
+        """Throughput, error rates and latency per endpoint, as a dict."""
+        endpoints = {}
+        for name, status, milliseconds, lag, recorded in self.results:
+            endpoints.setdefault(name, []).append((status, milliseconds, recorded))
+        total = len(self.results)
+
+        def summary(rows):
+            timings = sorted(milliseconds for _, milliseconds, _ in rows)
+            return {
+                'requests': len(rows),
+                'errors': sum(status is None or status >= 500 for status, _, _ in rows),
+                'client_errors': sum(status is not None and 400 <= status < 500 for status, _, _ in rows),
+                'status_changed': sum(recorded is not None and status != recorded for status, _, recorded in rows),
+                'p50_ms': round(percentile(timings, 0.50), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+            }
+
+        overall = summary([(status, ms, recorded) for _, status, ms, _, recorded in self.results]) if total else {}
+        return {
+            'target': self.target,
+            'concurrency': self.concurrency,
+            'speed': self.speed,
+            'seconds': round(elapsed, 3),
+            'throughput': round(total / elapsed, 2) if elapsed else 0,
+            'error_rate': round(overall['errors'] / total, 4) if total else 0,
+            'max_lag_ms': round(max((lag for *_, lag, _ in self.results), default=0) * 1000, 1),
+            'unknown_users': sorted(self.credentials.unknown),
+            'overall': overall,
+            'endpoints': {name: summary(rows) for name, rows in sorted(endpoints.items())},
+        }
+
+
+class RequestLogMiddleware:
+    """Append every request to ``REQUEST_LOG_PATH`` in the request log format, when set."""
+
+    lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.REQUEST_LOG_PATH:
+            return self.get_response(request)
+        ts, started = time.time(), time.perf_counter()
+        body = self.loggable_body(request)
+        response = self.get_response(request)
+        record = {'ts': round(ts, 6), 'method': request.method, 'path': request.get_full_path(),
+                  'status': response.status_code, 'duration_ms': round((time.perf_counter() - started) * 1000, 3)}
+        # API users are set on the request by the view, so read it afterwards
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            record['user'] = user.get_username()
+        if body is not None:
+            record.update(body)
+        line = json.dumps(record) + '\n'
+        with self.lock, open(settings.REQUEST_LOG_PATH, 'a') as file:
+            file.write(line)
+        return response
+
+    @staticmethod
+    def loggable_body(request):
+        if request.method in ('GET', 'HEAD', 'OPTIONS') or request.content_type in BINARY_CONTENT_TYPES:
+            return None
+        if int(request.META.get('CONTENT_LENGTH') or 0) > MAX_LOGGED_BODY:
+            return None
+        if request.content_type == 'application/x-www-form-urlencoded':
+            fields = {key: values if len(values) > 1 else values[0] for key, values in request.POST.lists()
+                      if key not in SECRET_FIELDS and key != 'csrfmiddlewaretoken'}
+            return {'content_type': request.content_type, 'body': fields}
+        body = request.body.decode('utf-8', 'replace')
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(body)
+            except ValueError:
+                pass
+            else:
+                if isinstance(data, dict):
+                    data = {key: value for key, value in data.items() if key not in SECRET_FIELDS}
+                return {'content_type': request.content_type, 'body': data}
+        return {'content_type': request.content_type, 'body': body}
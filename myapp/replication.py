@@ -0,0 +1,113 @@
+"""
+Read replicas.
+
+``ReplicaRouter`` sends the reads of a request to one of
+``settings.DATABASE_REPLICAS`` and every write to the primary (``default``).
+Replicas lag behind, so reads go to the primary instead:
+
+* for the rest of a request once it has written, and inside transactions;
+* for ``REPLICATION_LAG`` seconds after a user wrote, for that user's
+  requests (read-your-writes);
+* when a cached entry is recomputed within ``REPLICATION_LAG`` seconds of a
+  write to its namespaces, so a stale read is never cached under the new
+  version (``myapp.caching``).
+
+Work outside of requests (management commands, image workers) always uses
+the primary.
+
+To try it locally with two SQLite files, set
+``DATABASE_REPLICAS = ['replica']`` and keep ``manage.py replicate --interval 2``
+running; it stands in for replication by copying the primary over the replica.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class RequestState:
+    def __init__(self):
+        self.primary = False
+        self.wrote = False
+
+
+# Shared, not copied, by the threads an async view hands its queries to.
+_state = contextvars.ContextVar('replication_state', default=None)
+
+
+@contextmanager
+def request_state():
+    state = RequestState()
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+def read_from_primary():
+    """Send the remaining reads of the current request to the primary."""
+    state = _state.get()
+    if state is not None:
+        state.primary = True
+
+
+def user_key(user_id):
+    return 'primary:user:{}'.format(user_id)
+
+
+def read_own_writes(user_id):
+    """Read from the primary if ``user_id`` wrote within ``REPLICATION_LAG`` seconds."""
+    if settings.DATABASE_REPLICAS and cache.get(user_key(user_id)):
+        read_from_primary()
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not settings.DATABASE_REPLICAS:
+            return None
+        if state.primary or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.primary = state.wrote = True
+        # also for instances that were read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every replica holds the same rows as the primary
+        return True
+
+
+class ReplicaMiddleware:
+    """Scope the router's state to the request and remember users who wrote."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_state() as state:
+            # API users are only known once the view authenticated them,
+            # api.authentication checks them then
+            if settings.DATABASE_REPLICAS and request.user.is_authenticated:
+                read_own_writes(request.user.pk)
+            response = self.get_response(request)
+            if state.wrote and settings.DATABASE_REPLICAS and request.user.is_authenticated:
+                cache.set(user_key(request.user.pk), True, settings.REPLICATION_LAG)
+            return response
+
+
+def copy_database(source, target):
+    """Overwrite the SQLite database ``target`` with a consistent snapshot of ``source``."""
+    source, target = connections[source], connections[target]
+    source.ensure_connection()
+    target.ensure_connection()
+    source.connection.backup(target.connection)
@@ -0,0 +1,232 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# bm25 / tf-idf weight of a title match relative to a body match
+TITLE_WEIGHT = 5.0
+
+
+def tokenize(value):
+    return TOKEN_RE.findall((value or '').lower())
+
+
+class BaseSearchBackend:
+    def setup(self):
+        pass
+
+    def index(self, post):
+        raise NotImplementedError
+
+    def index_many(self, posts):
+        """Index posts saved without signals, e.g. by ``bulk_create``."""
+        for post in posts:
+            self.index(post)
+
+    def remove(self, post_id):
+        raise NotImplementedError
+
+    def rebuild(self, posts):
+        raise NotImplementedError
+
+    def search(self, query, offset=0, limit=20):
+        """Return the ids of the posts matching ``query``, best match first."""
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    Posts indexed in an FTS5 virtual table whose rowid is the post id.
+    Every query term is matched as a prefix and results are ranked by bm25.
+    """
+    table = 'myapp_post_fts'
+    create_sql = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+        "USING fts5(title, text, tokenize='unicode61')"
+    )
+
+    @staticmethod
+    def match_expression(query):
+        return ' '.join('"{}"*'.format(term) for term in tokenize(query))
+
+    def setup(self):
+        from .models import Post
+        with connection.cursor() as cursor:
+            cursor.execute(self.create_sql.format(table=self.table))
+            # rows deleted without signals, e.g. by ``flush``
+            cursor.execute('DELETE FROM {} WHERE rowid NOT IN (SELECT id FROM {})'.format(
+                self.table, Post._meta.db_table))
+
+    def index(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(self.table), [post.pk])
+            cursor.execute('INSERT INTO {}(rowid, title, text) VALUES (%s, %s, %s)'.format(self.table),
+                           [post.pk, post.title or '', post.text])
+
+    def index_many(self, posts):
+        rows = [(post.pk, post.title or '', post.text) for post in posts]
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(self.table), [row[:1] for row in rows])
+            cursor.executemany('INSERT INTO {}(rowid, title, text) VALUES (%s, %s, %s)'.format(self.table), rows)
+
+    def remove(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(self.table), [post_id])
+
+    def rebuild(self, posts):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {}'.format(self.table))
+            cursor.executemany(
+                'INSERT INTO {}(rowid, title, text) VALUES (%s, %s, %s)'.format(self.table),
+                ((post.pk, post.title or '', post.text) for post in posts)
+            )
+
+    def search(self, query, offset=0, limit=20):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+                'ORDER BY bm25({table}, %s, 1.0) LIMIT %s OFFSET %s'.format(table=self.table),
+                [expression, TITLE_WEIGHT, limit, offset]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class InvertedIndex:
+    """
+    In-memory inverted index: term -> {doc_id: weighted term frequency}.
+    Terms are matched as prefixes, documents are ranked by tf-idf.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self._terms = None
+        self._lock = threading.RLock()
+
+    def add(self, doc_id, title, text):
+        frequencies = defaultdict(float)
+        for term in tokenize(title):
+            frequencies[term] += TITLE_WEIGHT
+        for term in tokenize(text):
+            frequencies[term] += 1.0
+        with self._lock:
+            self.remove(doc_id)
+            for term, frequency in frequencies.items():
+                if term not in self.postings:
+                    self._terms = None
+                self.postings[term][doc_id] = frequency
+            self.documents[doc_id] = tuple(frequencies)
+
+    def remove(self, doc_id):
+        with self._lock:
+            for term in self.documents.pop(doc_id, ()):
+                postings = self.postings[term]
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+                    self._terms = None
+
+    def clear(self):
+        with self._lock:
+            self.postings.clear()
+            self.documents.clear()
+            self._terms = None
+
+    def _expand(self, prefix):
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        start = bisect_left(self._terms, prefix)
+        for term in self._terms[start:]:
+            if not term.startswith(prefix):
+                break
+            yield term
+
+    def search(self, query, offset=0, limit=20):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            total = len(self.documents) or 1
+            scores = None
+            for prefix in terms:
+                term_scores = defaultdict(float)
+                for term in self._expand(prefix):
+                    postings = self.postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    for doc_id, frequency in postings.items():
+                        term_scores[doc_id] += frequency * idf
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {doc_id: score + term_scores[doc_id]
+                              for doc_id, score in scores.items() if doc_id in term_scores}
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [doc_id for doc_id, _ in ranked[offset:offset + limit]]
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    """
+    Database-agnostic backend keeping an ``InvertedIndex`` in process memory.
+    The index is built from the posts table on first use and then kept up to
+    date by the save/delete signals of this process.
+    """
+
+    def __init__(self):
+        self.inverted_index = InvertedIndex()
+        self._loaded = False
+
+    def setup(self):
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            from .models import Post
+            self.rebuild(Post.objects.only('pk', 'title', 'text').iterator())
+
+    def index(self, post):
+        if self._loaded:
+            self.inverted_index.add(post.pk, post.title, post.text)
+
+    def remove(self, post_id):
+        self.inverted_index.remove(post_id)
+
+    def rebuild(self, posts):
+        self.inverted_index.clear()
+        for post in posts:
+            self.inverted_index.add(post.pk, post.title, post.text)
+        self._loaded = True
+
+    def search(self, query, offset=0, limit=20):
+        self._ensure_loaded()
+        return self.inverted_index.search(query, offset, limit)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.SEARCH_BACKEND)()
+    return _backend
+
+
+def search_posts(query, offset=0, limit=20):
+    """Return the matching ``Post`` objects in rank order."""
+    from .models import Post
+    ids = get_backend().search(query, offset, limit)
+    posts = Post.objects.in_bulk(ids)
+    # ids of rows deleted behind the index's back are simply skipped
+    return [posts[pk] for pk in ids if pk in posts]
@@ -0,0 +1,98 @@
+"""
+Content-addressed storage for uploaded images and profile photos.
+
+Every file is stored once, as ``blobs/<ab>/<sha256><ext>``, however often
+it is uploaded and whatever it was called. ``Blob`` rows count the images
+and photos referring to each file. Saving a field takes a reference.
+``release`` drops one and removes the file with the last. Files saved
+before this storage existed have no ``Blob`` row and are never removed by
+it; ``manage.py dedupe_media`` moves them in.
+"""
+import hashlib
+import os
+import uuid
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F
+
+from .db import retry_on_busy
+from .files import precompress
+
+
+def file_digest(content):
+    checksum = hashlib.sha256()
+    for chunk in content.chunks():
+        checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def blob_name(digest, filename):
+    return 'blobs/{}/{}{}'.format(digest[:2], digest, os.path.splitext(filename)[1].lower())
+
+
+class BlobStorage(FileSystemStorage):
+
+    def _save(self, name, content):
+        name = blob_name(file_digest(content), name)
+        # counted first, so a concurrent release of the last reference can't remove it from under us
+        self.acquire(name, content.size)
+        return self.store(name, content)
+
+    def store(self, name, content):
+        """Write ``content`` as the blob ``name`` unless it is there already; takes no reference."""
+        if not self.exists(name):
+            # written aside and renamed, so a racing upload of the same bytes can't leave a half file
+            temporary = super()._save('{}.{}.tmp'.format(name, uuid.uuid4().hex), content)
+            os.replace(self.path(temporary), self.path(name))
+        return name
+
+    @staticmethod
+    def acquire(name, size, count=1):
+        from .models import Blob
+
+        @retry_on_busy
+        def update():
+            Blob.objects.get_or_create(name=name, defaults={'size': size})
+            Blob.objects.filter(name=name).update(references=F('references') + count)
+        update()
+
+    def release(self, name):
+        """Drop a reference to ``name``; True if that was the last one and the file is gone."""
+        from .models import Blob
+
+        @retry_on_busy
+        def update():
+            if not Blob.objects.filter(name=name, references__gt=0).update(references=F('references') - 1):
+                return False
+            if not Blob.objects.filter(name=name, references=0).delete()[0]:
+                return False
+            # still inside the transaction, so acquire() either sees the row or writes the file again
+            self.delete(name)
+            return True
+        return update()
+
+
+blob_storage = BlobStorage()
+
+
+class HashedStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ``collectstatic`` stores static files under their content hash
+    (``style.3b1c9f0a2e4d.css``), so they can be cached as immutable, and
+    writes precompressed copies for ``myapp.files.serve``. Without a manifest
+    (``collectstatic`` never ran, as in tests) names are used as they are.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            for name in set(paths) | set(self.hashed_files.values()):
+                precompress(self.path(name))
@@ -0,0 +1,42 @@
+from django import template
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from myapp.images import derivative_name, derivative_widths
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(image, sizes='100vw', fallback='card', **attrs):
+    """
+    Render an ``Image`` as a ``<picture>`` with one ``srcset`` per derivative
+    format (AVIF, WebP) and the ``fallback`` JPEG thumbnail as ``src``.
+    Everything is derived from the row itself, so no query is made. A
+    placeholder is shown until the background job has run.
+
+        {% responsive_image image sizes="30vw" class="img-thumbnail" %}
+    """
+    attributes = format_html_join('', ' {}="{}"', attrs.items())
+    thumbnail = getattr(image, fallback)
+    if not thumbnail:
+        return format_html('<img src="{}"{}>', static('myapp/placeholder.svg'), attributes)
+
+    sources = []
+    if image.width and image.formats:
+        widths = derivative_widths(image.width, settings.IMAGE_DERIVATIVE_WIDTHS)
+        for fmt in image.formats.split(','):
+            srcset = ', '.join(
+                '{} {}w'.format(default_storage.url(derivative_name(image.image.name, width, fmt)), width)
+                for width in widths
+            )
+            sources.append((fmt, srcset, sizes))
+        attributes = format_html('{} width="{}" height="{}"', attributes, image.width, image.height)
+    return format_html(
+        '<picture>{}<img src="{}" loading="lazy"{}></picture>',
+        format_html_join('', '<source type="image/{}" srcset="{}" sizes="{}">', sources),
+        thumbnail.url,
+        attributes,
+    )
@@ -1,9 +1,44 @@
+import asyncio
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock, skipUnless
+
+from PIL import Image as Img
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.template import Context, Template
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework.test import APITestCase
 
 from api.serializers import PostSerializer, CommentSerializer
-from myapp.models import Post, Comment
+from api.testing import NPlusOneAssertionsMixin, authenticate, run_commit_hooks
+from myapp import caching, counters, feed, files, images, nplusone, replay, replication, uploads
+from myapp.aio import ConcurrentASGIHandler
+from myapp.benchmarks import generate_dataset
+from myapp.db import retry_on_busy
+from myapp.search import InvertedIndex, search_posts
+from myapp.models import Blob, Post, Comment, Vote, Image, ImageDerivative, ImageJob, Profile, Upload
 
 
 class AuthorModelTest(APITestCase):
@@ -24,6 +59,9 @@ class AuthorModelTest(APITestCase):
         comment = Comment.objects.create(user=user2, post=post, text='Some test Comment from user2')
         comment.save()
 
+    def setUp(self):
+        cache.clear()
+
     def test_login_valid_user(self):
         response = self.client.post("/api/token/get/", {"username": "test1", "password": "test12345"}, format='json')
         self.assertIn("access", response.data)
@@ -66,7 +104,7 @@ class AuthorModelTest(APITestCase):
         self.assertEquals(response.status_code, 200)
         posts = PostSerializer(Post.objects.all(), many=True)
 
-        self.assertEqual(posts.data, response.data)
+        self.assertEqual(posts.data, response.data['results'])
 
     def test_get_posts_unregistered_user(self):
         response = self.client.post('/api/token/get/', {'username': 'notuser', 'password': 'test12345'})
@@ -84,7 +122,7 @@ class AuthorModelTest(APITestCase):
         self.assertEquals(response.status_code, 200)
 
         posts = PostSerializer(Post.objects.filter(user__username='test1').all(), many=True)
-        self.assertEqual(posts.data, response.data)
+        self.assertEqual(posts.data, response.data['results'])
 
     def test_get_posts_own_unregistered(self):
         response = self.client.post('/api/token/get/', {'username': 'notuser', 'password': 'test12345'})
@@ -143,8 +181,8 @@ class AuthorModelTest(APITestCase):
         response = self.client.post('/api/token/get/', {'username': 'test1', 'password': 'test12345'})
         token = response.data['access']
         self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
-        response = self.client.post('/api/posts/like/1/',
-                                    format='json')
+        with run_commit_hooks():
+            response = self.client.post('/api/posts/like/1/', format='json')
         self.assertEquals(response.status_code, 201)
         post_after_like = Post.objects.get(id=1)
 
@@ -165,8 +203,8 @@ class AuthorModelTest(APITestCase):
         response = self.client.post('/api/token/get/', {'username': 'test1', 'password': 'test12345'})
         token = response.data['access']
         self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
-        response = self.client.post('/api/posts/dislike/1/',
-                                    format='json')
+        with run_commit_hooks():
+            response = self.client.post('/api/posts/dislike/1/', format='json')
         self.assertEquals(response.status_code, 201)
         post_after_dislike = Post.objects.get(id=1)
 
@@ -200,5 +238,956 @@ class AuthorModelTest(APITestCase):
         response = self.client.get('/api/posts/comments/get/1/', format='json')
         self.assertEquals(response.status_code, 200)
 
-        posts = CommentSerializer(Comment.objects.filter(post__id='1').all(), many=True)
-        self.assertEqual(posts.data, response.data)
+        posts = CommentSerializer(Comment.objects.filter(post__id='1').order_by('created_date', 'pk'), many=True)
+        self.assertEqual(posts.data, response.data['results'])
+
+
+class HomeFeedTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='feed', password='test12345')
+        for number in range(3):
+            Post.objects.create(user=user, title='Feed post {}'.format(number), text='Text')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_home_is_paginated(self):
+        response = self.client.get('/', {'page_size': 2})
+        self.assertEqual([post.title for post in response.context['posts']], ['Feed post 0', 'Feed post 1'])
+        response = self.client.get('/', {'page_size': 2, 'cursor': response.context['page'].next_cursor})
+        self.assertContains(response, 'Feed post 2')
+        self.assertNotContains(response, 'Feed post 0')
+
+    def test_home_invalid_cursor(self):
+        response = self.client.get('/', {'cursor': '!!'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(COMMENT_PAGE_SIZE=2)
+class CommentPagesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='commenter', password='test12345')
+        cls.post = Post.objects.create(user=cls.user, title='Thread', text='Text')
+        for number in range(5):
+            Comment.objects.create(user=cls.user, post=cls.post, text='Comment {}'.format(number))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_show_post_links_the_next_page(self):
+        response = self.client.get('/show_post/{}'.format(self.post.pk))
+        self.assertContains(response, 'Comment 1')
+        self.assertNotContains(response, 'Comment 2')
+        self.assertContains(response, 'class="more-comments')
+
+        cursor = response.context['page'].next_cursor
+        fragment = self.client.get('/show_post/{}/comments'.format(self.post.pk), {'cursor': cursor})
+        self.assertContains(fragment, 'Comment 2')
+        self.assertNotContains(fragment, 'Comment 1')
+        self.assertEqual(self.client.get('/show_post/{}'.format(self.post.pk), {'comments': cursor}).status_code, 200)
+        self.assertEqual(self.client.get('/show_post/{}/comments'.format(self.post.pk), {'cursor': '!!'}).status_code,
+                         404)
+
+    def test_api_pages_are_cached_until_a_comment_is_added(self):
+        client = APIClient()
+        authenticate(client, 'commenter', 'test12345')
+        url = '/api/posts/comments/get/{}/'.format(self.post.pk)
+        texts, params = [], {}
+        while True:
+            data = client.get(url, params).data
+            texts += [comment['text'] for comment in data['results']]
+            if data['next'] is None:
+                break
+            params = {'cursor': data['next']}
+        self.assertEqual(texts, ['Comment {}'.format(number) for number in range(5)])
+
+        with self.assertNumQueries(0):
+            client.get(url, params)
+        client.post('/api/posts/comments/add/{}/'.format(self.post.pk), {'text': 'Comment 5'})
+        with self.assertNumQueries(1):
+            last = client.get(url, params).data
+        self.assertEqual([comment['text'] for comment in last['results']], ['Comment 4', 'Comment 5'])
+        self.assertEqual(client.get('/api/posts/comments/get/0/').status_code, 400)
+
+
+class VoteCountersTest(TransactionTestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='test12345')
+        self.post = Post.objects.create(user=self.author, title='Hot', text='x' * 1000)
+
+    def run_in_threads(self, target, args_list):
+        errors = []
+
+        def worker(*args):
+            try:
+                while True:
+                    try:
+                        target(*args)
+                        break
+                    except OperationalError:
+                        # SQLite's shared-cache test database reports table locks
+                        # instead of waiting; the vote was rolled back, retry it.
+                        time.sleep(random.random() / 50)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=args) for args in args_list]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_votes_are_deduplicated_and_switchable(self):
+        voter = User.objects.create_user(username='voter', password='test12345')
+        self.assertTrue(counters.vote(voter, self.post.pk, Vote.LIKE))
+        self.assertFalse(counters.vote(voter, self.post.pk, Vote.LIKE))
+        self.assertTrue(counters.vote(voter, self.post.pk, Vote.DISLIKE))
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.likes, post.dislikes), (0, 1))
+
+    def test_concurrent_votes_are_not_lost(self):
+        voters = [User.objects.create_user(username='voter{}'.format(n)) for n in range(30)]
+        # every voter votes twice, only one of the two may count
+        self.run_in_threads(counters.vote, [(voter, self.post.pk, Vote.LIKE) for voter in voters * 2])
+        counters.buffer.flush()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).likes, 30)
+        self.assertEqual(Vote.objects.filter(post=self.post).count(), 30)
+
+    def test_hot_post_increments_are_batched(self):
+        buffer = counters.CounterBuffer(hot_threshold=5, flush_interval=60, flush_size=10000)
+        self.run_in_threads(buffer.add, [(self.post.pk, {'likes': 1})] * 200)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).likes, 5)
+        self.assertEqual(buffer.pending(self.post.pk), {'likes': 195})
+        buffer.flush()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).likes, 200)
+        self.assertEqual(buffer.pending(self.post.pk), {})
+
+    def test_busy_flush_loses_no_votes(self):
+        other = Post.objects.create(user=self.author, title='Other', text='Text')
+        voters = [User.objects.create_user(username='voter{}'.format(n)) for n in range(3)]
+        buffer = counters.CounterBuffer(hot_threshold=0, flush_interval=60, flush_size=3)
+        apply_deltas, failures = counters.apply_deltas, [OperationalError('database is locked')]
+
+        def busy_once(post_id, deltas):
+            if failures:
+                raise failures.pop()
+            apply_deltas(post_id, deltas)
+
+        with mock.patch.object(counters, 'buffer', buffer), mock.patch.object(counters, 'apply_deltas', busy_once):
+            counters.vote(voters[0], other.pk, Vote.LIKE)
+            counters.vote(voters[1], other.pk, Vote.LIKE)
+            # fills the buffer; its flush hits the busy database once and is retried
+            counters.vote(voters[2], self.post.pk, Vote.LIKE)
+        self.assertEqual(failures, [])
+        self.assertEqual(Post.objects.get(pk=other.pk).likes, 2)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).likes, 1)
+
+    @override_settings(SQLITE_BUSY_RETRIES=0)
+    def test_failed_flush_keeps_deltas(self):
+        buffer = counters.CounterBuffer(hot_threshold=0, flush_interval=60, flush_size=10000)
+        buffer.add(self.post.pk, {'likes': 1})
+        with mock.patch.object(counters, 'apply_deltas', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        self.assertEqual(buffer.pending(self.post.pk), {'likes': 1})
+        buffer.flush()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).likes, 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite connection settings')
+class SQLiteTuningTest(TransactionTestCase):
+
+    def test_connections_are_configured(self):
+        connection.close()
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    @override_settings(SQLITE_BUSY_RETRIES=2, SQLITE_BUSY_BACKOFF=0)
+    def test_busy_transactions_are_retried(self):
+        calls = []
+
+        @retry_on_busy
+        def write(error):
+            calls.append(connection.in_atomic_block)
+            Post.objects.create(user=User.objects.create_user(username='w{}'.format(len(calls))), title='T', text='x')
+            if error and len(calls) < 3:
+                raise OperationalError(error)
+
+        write('database is locked')
+        self.assertEqual(calls, [True] * 3)
+        # the attempts that failed were rolled back
+        self.assertEqual(Post.objects.count(), 1)
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            write('no such table: x')
+        self.assertEqual(len(calls), 1)
+
+        calls.clear()
+        with override_settings(SQLITE_BUSY_RETRIES=1), self.assertRaises(OperationalError):
+            write('database is locked')
+        self.assertEqual(len(calls), 2)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'replicated by copying SQLite databases')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='writer', password='test12345')
+        self.post = Post.objects.create(user=self.user, title='Replicated', text='Text')
+        replication.copy_database('default', 'replica')
+
+    def test_requests_read_from_replicas_until_they_write(self):
+        Post.objects.create(user=self.user, title='Not replicated', text='Text')
+        self.assertEqual(Post.objects.count(), 2)  # outside requests: the primary
+        with replication.request_state():
+            self.assertEqual(Post.objects.count(), 1)
+            with transaction.atomic():
+                self.assertEqual(Post.objects.count(), 2)
+            Comment.objects.create(user=self.user, post=Post.objects.get(pk=self.post.pk), text='Comment')
+            self.assertEqual(Post.objects.count(), 2)
+        replication.copy_database('default', 'replica')
+        with replication.request_state():
+            self.assertEqual(Post.objects.count(), 2)
+
+    def test_users_read_their_own_writes(self):
+        client = APIClient()
+        authenticate(client, 'writer', 'test12345')
+        comments_url = '/api/posts/comments/get/{}/'.format(self.post.pk)
+        self.assertEqual(client.get(comments_url).data['results'], [])
+        response = client.post('/api/posts/comments/add/{}/'.format(self.post.pk), {'text': 'Mine'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([c['text'] for c in client.get(comments_url).data['results']], ['Mine'])
+
+        # once the pin and the written marks expire, reads go back to the replica
+        cache.clear()
+        authenticate(client, 'writer', 'test12345')
+        self.assertEqual(client.get(comments_url).data['results'], [])
+        replication.copy_database('default', 'replica')
+        cache.clear()
+        authenticate(client, 'writer', 'test12345')
+        self.assertEqual([c['text'] for c in client.get(comments_url).data['results']], ['Mine'])
+
+
+class NPlusOneTest(NPlusOneAssertionsMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username='reader{}'.format(n), password='test12345') for n in range(4)]
+        cls.posts = [Post.objects.create(user=user, title='Looped', text='Text') for user in cls.users]
+        for user in cls.users:
+            Comment.objects.create(user=user, post=cls.posts[0], text='Comment')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_template_loops_are_reported(self):
+        template = Template('{% for comment in comments %}\n{{ comment.user.username }}{% endfor %}')
+        with nplusone.detect() as collector:
+            template.render(Context({'comments': Comment.objects.all()}))
+        [(shape, sources)] = collector.problems()
+        self.assertIn('FROM "auth_user"', shape)
+        self.assertEqual(sum(sources.values()), 4)
+        self.assertEqual([source[0] for source in sources], ['<unknown source>:2'])
+
+    def test_serializer_fields_are_reported(self):
+        with nplusone.detect() as collector:
+            PostSerializer(Post.objects.all(), many=True).data
+        [(shape, sources)] = collector.problems()
+        self.assertIn('FROM "myapp_comment"', shape)
+        self.assertEqual([source[1] for source in sources], ['PostSerializer.comments'])
+
+    @override_settings(NPLUSONE_MODE='raise')
+    def test_requests_fail_in_raise_mode(self):
+        def looped(request):
+            return HttpResponse(Template('{% for c in comments %}{{ c.user }}{% endfor %}').render(
+                Context({'comments': Comment.objects.all()})))
+
+        middleware = nplusone.NPlusOneMiddleware(looped)
+        with self.assertRaisesMessage(nplusone.NPlusOneError, '4 queries: SELECT'):
+            middleware(RequestFactory().get('/'))
+
+    def test_hot_views_have_no_n_plus_one(self):
+        self.assertNoNPlusOne(lambda: self.client.get('/'))
+        self.assertNoNPlusOne(lambda: self.client.get('/show_post/{}'.format(self.posts[0].pk)))
+        self.assertNoNPlusOne(lambda: self.client.get('/search', {'search': 'Looped'}))
+        self.client.login(username='reader0', password='test12345')
+        self.assertNoNPlusOne(lambda: self.client.get('/'))
+        self.assertNoNPlusOne(lambda: self.client.get('/account/'))
+        authenticate(self.client, 'reader0', 'test12345')
+        self.assertNoNPlusOne(lambda: self.client.get('/api/posts/'))
+        self.assertNoNPlusOne(lambda: self.client.get('/api/posts/own/'))
+        self.assertNoNPlusOne(lambda: self.client.get('/api/posts/comments/get/{}/'.format(self.posts[0].pk)))
+
+
+class ReplayTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='replayed', password='test12345')
+        self.post = Post.objects.create(user=self.user, title='Replayed', text='Text')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.log = os.path.join(directory, 'requests.jsonl')
+
+    def record_traffic(self):
+        client = APIClient()
+        with self.settings(REQUEST_LOG_PATH=self.log):
+            client.get('/')
+            client.get('/show_post/{}'.format(self.post.pk))
+            authenticate(client, 'replayed', 'test12345')
+            client.post('/api/posts/comments/add/{}/'.format(self.post.pk), {'text': 'Again'}, format='json')
+            client.get('/api/posts/comments/get/{}/'.format(self.post.pk))
+        return replay.read_log(self.log)
+
+    def test_recorded_requests_are_replayed(self):
+        records = self.record_traffic()
+        comment = records[-2]
+        self.assertEqual((comment['method'], comment['user'], comment['body']), ('POST', 'replayed', {'text': 'Again'}))
+        self.assertNotIn('password', json.dumps(records))  # the token request's body is dropped
+
+        for target in ('wsgi', 'asgi'):
+            run = replay.Replay(records, target, concurrency=2, speed=0, host='testserver')
+            report = run.report(run.run())
+            self.assertEqual(report['overall']['requests'], len(records))
+            self.assertEqual(report['overall']['errors'], 0)
+            # without the password the token request fails now
+            self.assertEqual(report['overall']['status_changed'], 1)
+            self.assertEqual(report['endpoints']['token_get']['client_errors'], 1)
+            self.assertEqual(report['endpoints']['myapp:show_post']['requests'], 1)
+        self.assertEqual(Comment.objects.filter(text='Again').count(), 3)
+
+    def test_tokens_are_not_logged(self):
+        client = APIClient()
+        refresh = client.post('/api/token/get/', {'username': 'replayed', 'password': 'test12345'}).data['refresh']
+        with self.settings(REQUEST_LOG_PATH=self.log):
+            client.post('/api/token/refresh/', {'refresh': refresh}, format='json')
+            client.post('/api/token/refresh/', {'refresh': refresh})
+        records = replay.read_log(self.log)
+        self.assertEqual([record['status'] for record in records], [200, 200])
+        self.assertNotIn(refresh, json.dumps(records))
+
+    def test_backlog_is_not_a_request_log(self):
+        with open(self.log, 'w') as file:
+            file.write(json.dumps({'request_id': 'user-001', 'title': 'Paging', 'body': '...'}) + '\n')
+        with self.assertRaisesMessage(replay.InvalidLog, 'backlog of change requests'):
+            replay.read_log(self.log)
+
+
+class ConcurrentASGIHandlerTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='asgi', password='test12345')
+        self.post = Post.objects.create(user=self.user, title='Served', text='Text')
+        Comment.objects.create(user=self.user, post=self.post, text='Concurrent comment')
+
+    def request(self, application, path, headers=()):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'root_path': '', 'query_string': b'',
+            'headers': [(b'host', b'testserver')] + list(headers),
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        async def run():
+            await application(scope, receive, send)
+            return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+        return run()
+
+    def test_requests_are_served_concurrently(self):
+        application = ConcurrentASGIHandler()
+        token = str(AccessToken.for_user(self.user))
+        authorization = [(b'authorization', 'Bearer {}'.format(token).encode())]
+
+        async def serve():
+            return await asyncio.gather(
+                self.request(application, '/'),
+                self.request(application, '/show_post/{}'.format(self.post.pk)),
+                self.request(application, '/api/posts/', authorization),
+                self.request(application, '/api/export/comments/', authorization),
+            )
+        home, show_post, api_posts, export = asyncio.run(serve())
+        self.assertEqual((home[0], show_post[0], api_posts[0], export[0]), (200, 200, 200, 200))
+        self.assertIn(b'Served', home[1])
+        self.assertIn(b'Concurrent comment', show_post[1])
+        self.assertEqual(json.loads(api_posts[1])['results'][0]['title'], 'Served')
+        self.assertEqual(json.loads(export[1].splitlines()[0])['text'], 'Concurrent comment')
+
+    def test_wsgi_requests_start_no_event_loop(self):
+        token = str(AccessToken.for_user(self.user))
+        with mock.patch('myapp.aio.async_to_sync', side_effect=AssertionError('event loop started')):
+            home = self.client.get('/')
+            show_post = self.client.get('/show_post/{}'.format(self.post.pk))
+            api_posts = self.client.get('/api/posts/', HTTP_AUTHORIZATION='Bearer {}'.format(token))
+        self.assertEqual((home.status_code, show_post.status_code, api_posts.status_code), (200, 200, 200))
+        self.assertContains(show_post, 'Concurrent comment')
+
+
+class SearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='writer', password='test12345')
+        cls.body = Post.objects.create(user=user, title='Weekend', text='Baking a vanilla cake with friends')
+        cls.title = Post.objects.create(user=user, title='Vanilla cake recipe', text='Flour, sugar and eggs')
+        Post.objects.create(user=user, title='Coffee', text='Watercolor coffee cup')
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(search_posts('vanilla cake'), [self.title, self.body])
+
+    def test_terms_match_as_prefixes(self):
+        self.assertEqual(search_posts('bak'), [self.body])
+
+    def test_index_follows_save_and_delete(self):
+        body = Post.objects.get(pk=self.body.pk)
+        body.text = 'Nothing sweet any more'
+        body.save()
+        self.assertEqual(search_posts('vanilla'), [self.title])
+        Post.objects.get(pk=self.title.pk).delete()
+        self.assertEqual(search_posts('vanilla'), [])
+
+    def test_search_view_is_paginated(self):
+        response = self.client.get('/search', {'search': 'cake', 'page_size': 1})
+        self.assertEqual(response.context['posts'], [self.title])
+        self.assertTrue(response.context['has_next'])
+        response = self.client.get('/search', {'search': 'cake', 'page_size': 1, 'page': 2})
+        self.assertEqual(response.context['posts'], [self.body])
+        self.assertFalse(response.context['has_next'])
+
+    def test_inverted_index(self):
+        index = InvertedIndex()
+        index.add(1, 'Weekend', 'Baking a vanilla cake')
+        index.add(2, 'Vanilla cake recipe', 'Flour')
+        index.add(3, 'Coffee', 'Cup')
+        self.assertEqual(index.search('vanil cake'), [2, 1])
+        self.assertEqual(index.search('vanilla', offset=1), [1])
+        index.remove(2)
+        self.assertEqual(index.search('cake'), [1])
+        self.assertEqual(index.search('tea'), [])
+
+
+def make_upload(name='photo.jpg', size=(2000, 1000)):
+    data = io.BytesIO()
+    exif = Img.Exif()
+    exif[0x010f] = 'Test camera'
+    Img.new('RGB', size, (200, 120, 40)).save(data, 'JPEG', exif=exif)
+    return SimpleUploadedFile(name, data.getvalue(), content_type='image/jpeg')
+
+
+class ImageJobsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.user = User.objects.create_user(username='uploader', password='test12345')
+        self.client.login(username='uploader', password='test12345')
+
+    def upload_post(self):
+        self.client.post('/account/add_post', {'title': 'Photos', 'text': 'Text', 'images': make_upload()})
+        return Image.objects.get(post__title='Photos')
+
+    @override_settings(IMAGE_JOBS_MODE='eager')
+    def test_thumbnails_are_resized(self):
+        image = self.upload_post()
+        self.assertEqual(image.jobs.get().status, ImageJob.DONE)
+        with Img.open(image.card.path) as card, Img.open(image.detail.path) as detail:
+            self.assertEqual(card.size, (600, 300))
+            self.assertEqual(detail.size, (1200, 600))
+        with Img.open(image.image.path) as original:
+            self.assertEqual(original.size, (2000, 1000))
+
+    @override_settings(IMAGE_JOBS_MODE='worker')
+    def test_feed_shows_placeholder_until_job_is_done(self):
+        image = self.upload_post()
+        job = image.jobs.get()
+        self.assertEqual(job.status, ImageJob.PENDING)
+        self.assertContains(self.client.get('/'), 'placeholder.svg')
+
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            self.assertTrue(images.run_job(job.pk, executor))
+        image.refresh_from_db()
+        response = self.client.get('/')
+        self.assertNotContains(response, 'placeholder.svg')
+        self.assertContains(response, image.card.url)
+
+    @override_settings(IMAGE_JOBS_MODE='eager')
+    def test_profile_avatar(self):
+        self.client.post('/account/edit', {'username': 'uploader', 'photo': make_upload(size=(900, 900))})
+        profile = self.user.profile
+        profile.refresh_from_db()
+        with Img.open(profile.avatar.path) as avatar:
+            self.assertEqual(avatar.size, (300, 300))
+        self.assertEqual(profile.avatar_url, profile.avatar.url)
+
+    @override_settings(IMAGE_JOBS_MODE='eager', IMAGE_DERIVATIVE_FORMATS=('webp',))
+    def test_responsive_derivatives(self):
+        image = self.upload_post()
+        self.assertEqual((image.width, image.height, image.formats), (2000, 1000, 'webp'))
+        derivatives = ImageDerivative.objects.filter(source=image.image.name).order_by('width')
+        self.assertEqual([d.width for d in derivatives], [320, 640, 960, 1280])
+        with Img.open(derivatives[0].file.path) as derivative:
+            self.assertEqual((derivative.format, derivative.size), ('WEBP', (320, 160)))
+            self.assertNotIn(0x010f, derivative.getexif())
+
+        html = Template('{% load responsive %}{% responsive_image image sizes="30vw" %}').render(
+            Context({'image': image}))
+        self.assertIn('<source type="image/webp" srcset="{} 320w, '.format(derivatives[0].file.url), html)
+        self.assertIn('sizes="30vw"', html)
+        self.assertIn('src="{}"'.format(image.card.url), html)
+
+
+@override_settings(IMAGE_JOBS_MODE='worker', UPLOAD_CHUNK_SIZE=4096, UPLOAD_BUFFER_SIZE=1000)
+class ChunkedUploadTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.user = User.objects.create_user(username='mobile', password='test12345')
+        self.post = Post.objects.create(user=self.user, title='Trip', text='Text')
+        authenticate(self.client, 'mobile', 'test12345')
+        self.data = make_upload(size=(300, 200)).read() + b'\0' * 10000
+
+    def start(self):
+        response = self.client.post('/api/uploads/', {'filename': 'trip.jpg', 'size': len(self.data)})
+        self.assertEqual(response.status_code, 201)
+        return '/api/uploads/{}/'.format(response.data['id'])
+
+    def send(self, url, offset, chunk, checksum=None):
+        checksum = checksum or hashlib.sha256(chunk).digest()
+        return self.client.generic('PATCH', url, chunk, content_type='application/octet-stream',
+                                   HTTP_UPLOAD_OFFSET=str(offset),
+                                   HTTP_UPLOAD_CHECKSUM='sha256 ' + base64.b64encode(checksum).decode())
+
+    def send_all(self, url):
+        offset = self.client.get(url).data['offset']
+        while offset < len(self.data):
+            response = self.send(url, offset, self.data[offset:offset + 4096])
+            self.assertEqual(response.status_code, 200)
+            offset = response.data['offset']
+
+    def test_upload_resumes_after_a_bad_chunk(self):
+        url = self.start()
+        self.assertEqual(self.send(url, 0, self.data[:4096]).data['offset'], 4096)
+        response = self.send(url, 4096, self.data[4096:8192], checksum=hashlib.sha256(b'other').digest())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.send(url, 0, self.data[:4096]).status_code, 409)
+        self.assertEqual(self.client.get(url).data['offset'], 4096)
+        self.assertEqual(self.client.post(url + 'complete/', {'post': self.post.pk}).status_code, 400)
+
+        self.send_all(url)
+        response = self.client.post(url + 'complete/', {'post': self.post.pk})
+        self.assertEqual(response.status_code, 201)
+        image = Image.objects.get(pk=response.data['image'])
+        with open(image.image.path, 'rb') as file:
+            self.assertEqual(file.read(), self.data)
+        self.assertEqual(image.jobs.get().status, ImageJob.PENDING)
+        self.assertFalse(Upload.objects.exists())
+
+    def test_profile_photo(self):
+        url = self.start()
+        self.send_all(url)
+        self.assertEqual(self.client.post(url + 'complete/', {'photo': True}).status_code, 201)
+        profile = Profile.objects.get(user=self.user)
+        self.assertTrue(profile.photo.name.startswith('blobs/'))
+        self.assertEqual(profile.jobs.get().status, ImageJob.PENDING)
+
+    def test_abandoned_uploads_expire(self):
+        url = self.start()
+        self.send(url, 0, self.data[:4096])
+        upload = Upload.objects.get()
+        part = os.path.join(settings.MEDIA_ROOT, upload.part_name)
+        self.assertEqual(os.path.getsize(part), 4096)
+        with override_settings(UPLOAD_EXPIRY=-1):
+            self.assertEqual(uploads.expire(), 1)
+        self.assertFalse(os.path.exists(part))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(IMAGE_JOBS_MODE='worker')
+class BlobStorageTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.user = User.objects.create_user(username='sharer', password='test12345')
+        self.client.login(username='sharer', password='test12345')
+
+    def test_identical_uploads_are_stored_once(self):
+        for title in ('First', 'Second'):
+            self.client.post('/account/add_post', {'title': title, 'text': 'Text', 'images': make_upload()})
+        first, second = Image.objects.order_by('pk')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('blobs/'))
+        self.assertEqual(Blob.objects.get(name=first.image.name).references, 2)
+
+        first.delete()
+        self.assertTrue(os.path.exists(second.image.path))
+        second.delete()
+        self.assertFalse(os.path.exists(second.image.path))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_photo_is_released(self):
+        self.client.post('/account/edit', {'username': 'sharer', 'photo': make_upload(size=(400, 400))})
+        profile = Profile.objects.get(user=self.user)
+        path = profile.photo.path
+        self.client.post('/account/edit', {'username': 'sharer', 'photo': make_upload(size=(400, 400))})
+        self.assertEqual(Blob.objects.get().references, 1)
+
+        self.client.get('/account/delete_photo/{}'.format(profile.pk))
+        self.assertFalse(os.path.exists(path))
+        profile.refresh_from_db()
+        self.assertEqual(profile.photo.name, 'user_empty_photo.jpg')
+        # the shared default photo is never released
+        profile.set_image_to_default()
+        self.assertFalse(Blob.objects.exists())
+
+    @override_settings(IMAGE_JOBS_MODE='eager', IMAGE_DERIVATIVE_FORMATS=('webp',))
+    def test_deleting_post_or_user_releases_files(self):
+        self.client.post('/account/add_post', {'title': 'Doomed', 'text': 'Text', 'images': make_upload()})
+        self.client.post('/account/edit', {'username': 'sharer', 'photo': make_upload(size=(400, 400))})
+        image, profile = Image.objects.get(), Profile.objects.get(user=self.user)
+        names = [image.image.name, image.card.name, image.detail.name, profile.photo.name, profile.avatar.name]
+        names += ImageDerivative.objects.values_list('file', flat=True)
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+
+        self.client.get('/account/delete_post/{}'.format(image.post_id))
+        self.assertEqual(list(Blob.objects.values_list('name', flat=True)), [profile.photo.name])
+        self.assertFalse(ImageDerivative.objects.exists())
+        self.user.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual([name for name in names if default_storage.exists(name)], [])
+
+    def test_dedupe_media_moves_old_files(self):
+        post = Post.objects.create(user=self.user, title='Old', text='Text')
+        data = make_upload().read()
+        names = [default_storage.save('posts_images/old.jpg', ContentFile(data)) for _ in range(2)]
+        images = [Image.objects.create(post=post, image=name) for name in names]
+        call_command('dedupe_media', stdout=io.StringIO())
+
+        for image in images:
+            image.refresh_from_db()
+        self.assertEqual(images[0].image.name, images[1].image.name)
+        self.assertEqual(Blob.objects.get().references, 2)
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+        with open(images[0].image.path, 'rb') as file:
+            self.assertEqual(file.read(), data)
+
+    @override_settings(IMAGE_JOBS_MODE='eager', IMAGE_DERIVATIVE_FORMATS=('webp',))
+    def test_dedupe_media_moves_derivatives(self):
+        post = Post.objects.create(user=self.user, title='Old', text='Text')
+        name = default_storage.save('posts_images/old.jpg', ContentFile(make_upload().read()))
+        image = Image.objects.create(post=post, image=name)
+        images.enqueue(image)
+        self.assertTrue(ImageDerivative.objects.filter(source=name).exists())
+        call_command('dedupe_media', stdout=io.StringIO())
+
+        image.refresh_from_db()
+        html = Template('{% load responsive %}{% responsive_image image %}').render(Context({'image': image}))
+        urls = [candidate.split()[0] for srcset in re.findall(r'srcset="([^"]+)"', html)
+                for candidate in srcset.split(', ')]
+        self.assertEqual(len(urls), 4)
+        for url in urls:
+            self.assertTrue(default_storage.exists(url[len(settings.MEDIA_URL):]), url)
+        self.assertEqual(default_storage.listdir('derivatives/posts_images/old')[1], [])
+
+
+class FileServingTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.data = b''.join(b'.post-%d { margin: 0 }\n' % number for number in range(200))
+        os.makedirs(os.path.join(media_root, 'blobs', 'ab'))
+        for name in ('style.css', 'blobs/ab/abcdef.css'):
+            with open(os.path.join(media_root, name), 'wb') as file:
+                file.write(self.data)
+        files.precompress(os.path.join(media_root, 'style.css'))
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_conditional_requests(self):
+        response = self.client.get('/media/style.css')
+        self.assertEqual((response.status_code, self.body(response)), (200, self.data))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(self.client.get('/media/style.css', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        response = self.client.get('/media/style.css', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual((response.status_code, response['Cache-Control']), (304, 'public, max-age=86400'))
+        self.assertIn('immutable', self.client.get('/media/blobs/ab/abcdef.css')['Cache-Control'])
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+    def test_ranges(self):
+        response = self.client.get('/media/style.css', HTTP_RANGE='bytes=10-19')
+        self.assertEqual((response.status_code, self.body(response)), (206, self.data[10:20]))
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/{}'.format(len(self.data)))
+        self.assertEqual(self.body(self.client.get('/media/style.css', HTTP_RANGE='bytes=-5')), self.data[-5:])
+        response = self.client.get('/media/style.css', HTTP_RANGE='bytes=100000-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */{}'.format(len(self.data))))
+        # a stale If-Range gets the whole file
+        response = self.client.get('/media/style.css', HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_precompressed_variant(self):
+        response = self.client.get('/media/style.css', HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+        self.assertEqual((response['Content-Encoding'], response['Content-Type']), ('gzip', 'text/css'))
+        self.assertEqual(gzip.decompress(self.body(response)), self.data)
+        self.assertNotIn('Content-Encoding', self.client.get('/media/style.css', HTTP_ACCEPT_ENCODING='identity'))
+
+    @override_settings(SENDFILE_HEADER='X-Accel-Redirect')
+    def test_sendfile(self):
+        response = self.client.get('/media/style.css')
+        self.assertEqual((response['X-Accel-Redirect'], response.content), ('/internal/media/style.css', b''))
+
+
+class FeedCardsTest(TestCase):
+
+    def test_cards_are_rendered_from_rows(self):
+        user = User.objects.create_user(username='feed', password='test12345')
+        posts = [Post.objects.create(user=user, title='<b>Bold</b>', text='word ' * 40, comment_count=1),
+                 Post.objects.create(user=user, title='Plain', text='Short', comment_count=2)]
+        rows = feed.card_rows(posts)
+        self.assertEqual(rows[1]['url'], '/show_post/{}'.format(posts[1].pk))
+        first, second = feed.render_cards(rows)
+        self.assertIn('&lt;b&gt;Bold&lt;/b&gt;', first)
+        self.assertIn('word …', first)
+        self.assertIn('1 comment</p>', first)
+        self.assertIn('2 comments</p>', second)
+        self.assertIn('<a href="/show_post/{}">'.format(posts[1].pk), second)
+
+
+class CompressionTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='compressed', password='test12345')
+        for n in range(10):
+            Post.objects.create(user=user, title='Compressed {}'.format(n), text='Some text ' * 20)
+
+    def test_pages_are_compressed_for_clients_that_accept_it(self):
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn(b'Compressed 9', gzip.decompress(response.content))
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertContains(response, 'Compressed 9')
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get('/api/posts/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streamed_responses_are_compressed_as_they_stream(self):
+        authenticate(self.client, 'compressed', 'test12345')
+        response = self.client.get('/api/export/posts/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 10)
+
+
+class GenerateDatasetTest(TestCase):
+
+    def test_synthetic_dataset(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with self.settings(MEDIA_ROOT=media_root):
+            post_ids = generate_dataset(users=5, posts=30, comments=300, images=10, votes=40, seed=3)
+        self.assertEqual(Profile.objects.filter(user__username__startswith='synthetic').count(), 5)
+        self.assertEqual((Post.objects.count(), Comment.objects.count(), Image.objects.count()), (30, 300, 10))
+        counts = dict(Post.objects.values_list('pk', 'comment_count'))
+        # the most popular post gets more than its fair share of the comments
+        self.assertGreater(counts[post_ids[0]], 300 / 30 * 3)
+        likes = sum(Post.objects.values_list('likes', flat=True))
+        self.assertEqual(likes, Vote.objects.filter(value=Vote.LIKE).count())
+        self.assertTrue(self.client.login(username=User.objects.first().username, password='password'))
+
+
+class PostAggregatesTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='counted', password='test12345')
+        self.post = Post.objects.create(user=self.user, title='Counted', text='Text')
+
+    def test_comment_count(self):
+        comments = [Comment.objects.create(user=self.user, post=self.post, text='Hi') for _ in range(3)]
+        comments[0].delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+
+    @override_settings(IMAGE_JOBS_MODE='eager', IMAGE_DERIVATIVE_FORMATS=('webp',))
+    def test_cover_follows_first_image(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with self.settings(MEDIA_ROOT=media_root):
+            first, second = [Image.objects.create(post=self.post, image=make_upload()) for _ in range(2)]
+            images.run_job(images.enqueue(first).pk)
+            self.post.refresh_from_db()
+            first.refresh_from_db()
+            self.assertEqual(self.post.image_count, 2)
+            self.assertEqual((self.post.cover_image, self.post.cover_card), (first.image, first.card))
+            self.assertEqual((self.post.cover_width, self.post.cover_formats), (2000, 'webp'))
+
+            first.delete()
+            self.post.refresh_from_db()
+            self.assertEqual(self.post.image_count, 1)
+            self.assertEqual(self.post.cover_image, second.image)
+            self.assertFalse(self.post.cover_card)
+
+    def test_feed_reads_only_the_posts(self):
+        Comment.objects.create(user=self.user, post=self.post, text='Hi')
+        posts = list(Post.objects.all())
+        with self.assertNumQueries(0):
+            cards = caching.render_post_cards(posts)
+        self.assertIn('1 comment', cards[0])
+
+    def test_rebuild_command(self):
+        Comment.objects.create(user=self.user, post=self.post, text='Hi')
+        Post.objects.filter(pk=self.post.pk).update(comment_count=7, image_count=3, cover_image='gone.jpg')
+        call_command('rebuild_post_aggregates', stdout=io.StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comment_count, self.post.image_count), (1, 0))
+        self.assertFalse(self.post.cover_image)
+
+
+class CachingTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cached', password='test12345')
+        cls.posts = [Post.objects.create(user=cls.user, title='Cached {}'.format(n), text='Text') for n in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        caching.reset_stats()
+
+    def test_anonymous_home_is_served_from_cache(self):
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertContains(response, 'Cached 2')
+        self.assertEqual(caching.stats()['page'], {'hit': 1, 'miss': 1})
+
+        Post.objects.create(user=self.user, title='Brand new', text='Text')
+        self.assertContains(self.client.get('/'), 'Brand new')
+
+    def test_only_changed_cards_are_rendered_again(self):
+        self.client.login(username='cached', password='test12345')
+        self.client.get('/')
+        post = Post.objects.get(pk=self.posts[1].pk)
+        post.title = 'Renamed'
+        post.save()
+        response = self.client.get('/')
+        self.assertContains(response, 'Renamed')
+        self.assertEqual(caching.stats()['card'], {'hit': 2, 'miss': 4})
+
+    def test_comment_and_vote_invalidate_post_page(self):
+        url = '/show_post/{}'.format(self.posts[0].pk)
+        self.client.get(url)
+        Comment.objects.create(user=self.user, post=self.posts[0], text='Fresh comment')
+        self.assertContains(self.client.get(url), 'Fresh comment')
+        with run_commit_hooks():
+            counters.vote(self.user, self.posts[0].pk, Vote.LIKE)
+        self.assertContains(self.client.get(url), '> 1</a>')
+        self.assertEqual(caching.stats()['page'], {'hit': 0, 'miss': 3})
+
+    def test_api_payload_is_cached(self):
+        response = self.client.post('/api/token/get/', {'username': 'cached', 'password': 'test12345'})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        first = self.client.get('/api/posts/')
+        with self.assertNumQueries(0):  # the user is cached with the token, the payload with the posts
+            second = self.client.get('/api/posts/')
+        self.assertEqual(first.data, second.data)
+        with run_commit_hooks():
+            self.client.post('/api/posts/like/{}/'.format(self.posts[0].pk))
+        self.assertEqual(self.client.get('/api/posts/').data['results'][0]['likes'], 1)
+
+    def test_fresh_api_copy_is_not_modified(self):
+        response = self.client.post('/api/token/get/', {'username': 'cached', 'password': 'test12345'})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        etag = self.client.get('/api/posts/')['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response['ETag']), (304, etag))
+        self.assertEqual(caching.stats()['api'], {'hit': 0, 'miss': 1})  # the payload wasn't even looked up
+
+        Post.objects.create(user=self.user, title='Brand new', text='Text')
+        response = self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_fresh_anonymous_page_is_not_modified(self):
+        etag = self.client.get('/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(caching.stats()['page'], {'hit': 0, 'miss': 1})
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'myapp-test-cache'),
+}})
+class FileBasedCachingTest(CachingTest):
+    pass
+
+
+class ProfileInvalidationTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_profile_pages_are_invalidated_once_per_transaction(self):
+        user = User.objects.create_user(username='renamed', password='test12345')
+        post = Post.objects.create(user=user, title='Mine', text='Text')
+        namespace = caching.post_namespace(post.pk)
+        version = caching.get_versions([namespace])[namespace]
+        with self.assertNumQueries(1 + 3 + 2), transaction.atomic():  # BEGIN, 3 saves, comments and posts once
+            for _ in range(3):
+                user.profile.save()
+            self.assertEqual(caching.get_versions([namespace])[namespace], version)
+        self.assertEqual(caching.get_versions([namespace])[namespace], version + 1)
+
+        user.profile.save()
+        self.assertEqual(caching.get_versions([namespace])[namespace], version + 2)
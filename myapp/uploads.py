@@ -0,0 +1,168 @@
+"""
+Chunked, resumable uploads.
+
+A client starts an upload with the file's name and size, then sends it in
+chunks of up to ``UPLOAD_CHUNK_SIZE`` bytes. Every chunk names its offset
+and a checksum. It is streamed into ``MEDIA_ROOT/uploads/<id>.part`` through a
+``UPLOAD_BUFFER_SIZE`` buffer and verified on the way. A chunk that fails
+the checksum is cut off again, so the client only resends that chunk. After
+a dropped connection, the upload's ``received`` offset says where to
+continue. The finished file is moved, not copied, into the storage of its
+``Image`` or ``Profile.photo`` and queued for thumbnails like a form upload.
+
+The chunks of one upload are expected one at a time, in order.
+"""
+import base64
+import binascii
+import hashlib
+import os
+from datetime import timedelta
+
+from PIL import Image as Img
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import images
+from .models import Image, Profile, Upload
+
+CHECKSUM_ALGORITHMS = ('sha256', 'sha1', 'md5')
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """The chunk does not continue the upload; ``offset`` is where it should start."""
+
+    def __init__(self, offset):
+        super().__init__('Expected offset {}'.format(offset))
+        self.offset = offset
+
+
+class ChecksumMismatch(UploadError):
+    pass
+
+
+def parse_checksum(value):
+    """``'sha256 <base64 digest>'`` (the Upload-Checksum header) -> ``(algorithm, digest bytes)``."""
+    try:
+        algorithm, encoded = value.split()
+        digest = base64.b64decode(encoded, validate=True)
+    except (ValueError, binascii.Error):
+        raise UploadError('Upload-Checksum must be "<algorithm> <base64 digest>"')
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise UploadError('Checksum algorithm must be one of {}'.format(', '.join(CHECKSUM_ALGORITHMS)))
+    return algorithm, digest
+
+
+def start(user, filename, size):
+    if not 0 < size <= settings.UPLOAD_MAX_SIZE:
+        raise UploadError('Size must be between 1 and {} bytes'.format(settings.UPLOAD_MAX_SIZE))
+    upload = Upload.objects.create(user=user, filename=os.path.basename(filename)[:255] or 'upload', size=size)
+    path = default_storage.path(upload.part_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return upload
+
+
+def write_chunk(upload, offset, stream, length, algorithm, digest):
+    """
+    Stream ``length`` bytes of ``stream`` into the upload at ``offset``
+    and return the new offset. Nothing is kept unless all of them arrived
+    and match ``digest``.
+    """
+    if offset != upload.received:
+        raise OffsetMismatch(upload.received)
+    if not 0 < length <= settings.UPLOAD_CHUNK_SIZE or offset + length > upload.size:
+        raise UploadError('Chunks hold 1 to {} bytes and end within the file'.format(settings.UPLOAD_CHUNK_SIZE))
+
+    checksum = hashlib.new(algorithm)
+    with open(default_storage.path(upload.part_name), 'r+b') as file:
+        file.seek(offset)
+        remaining = length
+        while remaining:
+            block = stream.read(min(remaining, settings.UPLOAD_BUFFER_SIZE))
+            if not block:
+                break
+            checksum.update(block)
+            file.write(block)
+            remaining -= len(block)
+        if remaining or checksum.digest() != digest:
+            file.truncate(offset)
+            raise ChecksumMismatch('Chunk at offset {} is incomplete or does not match its checksum'.format(offset))
+
+    received = offset + length
+    if not Upload.objects.filter(pk=upload.pk, received=offset).update(received=received,
+                                                                       updated_date=timezone.now()):
+        raise OffsetMismatch(Upload.objects.get(pk=upload.pk).received)
+    upload.received = received
+    return received
+
+
+class PartFile(File):
+    """A received upload, which the storage moves into place instead of copying."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def finish(upload, post=None, profile=None):
+    """Attach a fully received upload to a new ``Image`` of ``post`` or as ``profile``'s photo."""
+    if upload.received != upload.size:
+        raise UploadError('Upload incomplete: {} of {} bytes received'.format(upload.received, upload.size))
+    part_path = default_storage.path(upload.part_name)
+    try:
+        with Img.open(part_path) as image:
+            image.verify()
+    except Exception:
+        raise UploadError('Not an image')
+
+    if post is not None:
+        instance, field_name = Image(post=post), 'image'
+    else:
+        instance, field_name = profile, 'photo'
+        previous = Profile(photo=profile.photo.name)
+    field_file = getattr(instance, field_name)
+    with PartFile(open(part_path, 'rb'), upload.filename) as content:
+        field_file.save(upload.filename, content, save=False)
+    # left behind when the same bytes were stored before
+    remove_part(upload)
+    try:
+        with transaction.atomic():
+            instance.save()
+            upload.delete()
+    except Exception:
+        field_file.storage.release(field_file.name)
+        abort(upload)
+        raise
+    if post is None:
+        # also when the new photo has the same bytes: saving it took a second reference
+        previous.release_photo()
+    images.enqueue(instance)
+    return instance
+
+
+def remove_part(upload):
+    try:
+        os.remove(default_storage.path(upload.part_name))
+    except FileNotFoundError:
+        pass
+
+
+def abort(upload):
+    remove_part(upload)
+    upload.delete()
+
+
+def expire():
+    """Abort the uploads that received nothing for ``UPLOAD_EXPIRY`` seconds; returns how many."""
+    stale = Upload.objects.filter(updated_date__lt=timezone.now() - timedelta(seconds=settings.UPLOAD_EXPIRY))
+    count = 0
+    for upload in stale.iterator():
+        abort(upload)
+        count += 1
+    return count
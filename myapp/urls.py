@@ -12,6 +12,7 @@ urlpatterns = [
     path('account/edit', views.edit_account, name='edit_account'),
     path('account/add_post', views.add_post, name='add_post'),
     path('show_post/<int:id>', views.show_post, name='show_post'),
+    path('show_post/<int:id>/comments', views.post_comments, name='post_comments'),
     path('account/edit_post/<int:id>', views.edit_post, name='edit_post'),
     path('account/delete_photo/<int:id>', views.delete_photo, name='delete_photo'),
     path('account/delete_image/<int:post_id>/<int:img_id>', views.delete_image, name='delete_image'),
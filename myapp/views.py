@@ -1,13 +1,22 @@
-from PIL import Image as Img
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.models import User
+from django.http import Http404, HttpResponse
 from django.shortcuts import render, redirect, reverse
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 
+from . import caching, counters, images
+from .aio import async_view, database_sync_to_async, gather
+from .caching import cache_page_for_anonymous
+from .db import retry_on_busy
 from .forms import CreateUser, EditUser, EditProfile, AddComment, AddPost, EditPost
-from .models import Profile, Post, Image, Comment
+from .models import Profile, Post, Image, Comment, Vote
+from .pagination import InvalidCursor, get_page_size, paginate_keyset
+from .search import search_posts
 
 
 def login_user(request):
@@ -30,25 +39,23 @@ def login_user(request):
     return render(request, 'myapp/login.html', {'form': form})
 
 
-def photo_resize(inst):
-    image = Img.open(inst.photo)
-    size = (300, 300)
-    image.resize(size, Img.ANTIALIAS)
-    image.save(inst.photo.path)
-    inst.save()
+def paginate_posts(request, queryset):
+    try:
+        return paginate_keyset(queryset, request.GET.get('cursor'), get_page_size(request))
+    except InvalidCursor:
+        raise Http404('Invalid cursor')
 
 
-def image_resize(inst):
-    image = Img.open(inst.image)
-    size = (300, 300)
-    image.resize(size, Img.ANTIALIAS)
-    image.save(inst.image.path)
-    inst.save()
+def render_home(request, page):
+    return render(request, 'myapp/home.html', {'posts': page, 'page': page,
+                                               'cards': caching.render_post_cards(page)})
 
 
-def home(request):
-    posts = Post.objects.all().order_by('created_date')
-    return render(request, 'myapp/home.html', {'posts': posts})
+@cache_page_for_anonymous(lambda request: [caching.POSTS])
+@async_view
+async def home(request):
+    page = await database_sync_to_async(paginate_posts)(request, Post.objects.all())
+    return await database_sync_to_async(render_home)(request, page)
 
 
 def logout_user(request):
@@ -80,21 +87,30 @@ def register(request):
 @login_required(login_url='/login')
 def account(request):
     user = request.user
-    posts = Post.objects.filter(user=user).all()
-    return render(request, 'myapp/account.html', context={'user': user, 'posts': posts})
+    page = paginate_posts(request, Post.objects.filter(user=user))
+    return render(request, 'myapp/account.html', context={'user': user, 'posts': page, 'page': page,
+                                                          'cards': caching.render_post_cards(page)})
 
 
 @login_required(login_url='/login')
 def edit_account(request):
     form_user = EditUser(instance=request.user, data=request.POST or None)
+    previous = Profile(photo=request.user.profile.photo.name)
     form_profile = EditProfile(instance=request.user.profile, files=request.FILES, data=request.POST or None)
     if form_user.is_valid() and form_profile.is_valid():
         if 'user_empty_photo' in form_profile.cleaned_data.get('photo'):
             form_profile.cleaned_data.pop('photo')
-        form_user.save()
-        profile = form_profile.save()
-        if 'user_empty_photo' not in profile.photo.path:
-            photo_resize(profile)
+        # one transaction, so the profile's pages are invalidated once
+        @retry_on_busy
+        def save():
+            form_user.save()
+            profile = form_profile.save()
+            photo_changed = 'photo' in form_profile.changed_data and 'user_empty_photo' not in profile.photo.path
+            if photo_changed:
+                images.enqueue(profile)
+            return photo_changed
+        if save():
+            previous.release_photo()
         messages.success(request, 'Information changed successfully')
         return redirect('myapp:account')
     return render(request=request,
@@ -114,7 +130,7 @@ def add_post(request):
                 image=file
             )
             instance.save()
-            image_resize(instance)
+            images.enqueue(instance)
         return redirect('myapp:account')
     return render(request=request,
                   template_name='myapp/add_post.html',
@@ -133,30 +149,66 @@ def edit_post(request, id):
                 image=file
             )
             instance.save()
-            image_resize(instance)
-            instance.save()
+            images.enqueue(instance)
         return redirect('myapp:show_post', id=id)
     return render(request=request,
                   template_name='myapp/edit_post.html',
                   context={'form': form, 'post': post})
 
 
-def show_post(request, id):
-    user = request.user
-    post = Post.objects.filter(pk=id).get()
-    images = post.images.all()
-    comments = Comment.objects.filter(post=post).all()
+def add_comment(request, post):
     form = AddComment(data=request.POST or None)
     if form.is_valid() and request.user.is_authenticated:
-        comment = Comment(
-            user=request.user,
-            text=form.cleaned_data["text"],
-            post=post
-        )
-        comment.save()
-        return redirect(reverse('myapp:show_post', args=(post.pk,)))
-    return render(request, 'myapp/show_post.html', context={'user': user, 'post': post, 'images': images,
-                                                            'comments': comments, 'form': form})
+        Comment(user=request.user, text=form.cleaned_data["text"], post=post).save()
+        return form, redirect(reverse('myapp:show_post', args=(post.pk,)))
+    return form, None
+
+
+def comment_page(request, post_id, cursor):
+    """
+    The rendered page of ``post_id``'s comments after ``cursor``, oldest
+    first, read in one query and cached until a comment of the post changes.
+    """
+    page_size = get_page_size(request, settings.COMMENT_PAGE_SIZE)
+
+    def render_page():
+        comments = Comment.objects.filter(post_id=post_id).select_related('user__profile')
+        page = paginate_keyset(comments, cursor, page_size)
+        return render_to_string('myapp/comment_page.html', {
+            'comments': page, 'page': page, 'post_id': post_id,
+            # carried over to the next page's links unless it is the default
+            'page_size': page_size if page_size != settings.COMMENT_PAGE_SIZE else None,
+        })
+
+    try:
+        html = caching.cached('comments', [caching.post_namespace(post_id)], ('html', post_id, cursor, page_size),
+                              render_page)
+    except InvalidCursor:
+        raise Http404('Invalid cursor')
+    return mark_safe(html)
+
+
+def post_comments(request, id):
+    """The next page of comments as an HTML fragment, for the "More comments" link of show_post."""
+    return HttpResponse(comment_page(request, id, request.GET.get('cursor')))
+
+
+@cache_page_for_anonymous(lambda request, id: [caching.post_namespace(id)])
+@async_view
+async def show_post(request, id):
+    # the post, its images and its first page of comments are independent reads
+    post, images, comments = await gather(
+        database_sync_to_async(Post.objects.select_related('user').get)(pk=id),
+        database_sync_to_async(list)(Image.objects.filter(post_id=id)),
+        database_sync_to_async(comment_page)(request, id, request.GET.get('comments')),
+    )
+    form, response = await database_sync_to_async(add_comment)(request, post)
+    if response is not None:
+        return response
+    return await database_sync_to_async(render)(
+        request, 'myapp/show_post.html',
+        context={'user': request.user, 'post': post, 'images': images, 'comments': comments, 'form': form}
+    )
 
 
 @login_required(login_url='/login')
@@ -182,30 +234,38 @@ def delete_post(request, id):
 
 @login_required(login_url='/login')
 def like_post(request, post_id):
-    post = Post.objects.get(pk=post_id)
+    post = Post.objects.only('pk').get(pk=post_id)
     if not request.user.is_authenticated:
         messages.error(request, 'Cannot score this post. Log in first!')
         return redirect(reverse('myapp:show_post', args=(post.pk,)))
 
-    post.likes += 1
-    post.save()
+    counters.vote(request.user, post.pk, Vote.LIKE)
     return redirect(reverse('myapp:show_post', args=(post.pk,)))
 
 
 @login_required(login_url='/login')
 def dislike_post(request, post_id):
-    post = Post.objects.get(pk=post_id)
+    post = Post.objects.only('pk').get(pk=post_id)
     if not request.user.is_authenticated:
         messages.error(request, 'Cannot score this post. Log in first!')
         return redirect(reverse('myapp:show_post', args=(post.pk,)))
 
-    post.dislikes += 1
-    post.save()
+    counters.vote(request.user, post.pk, Vote.DISLIKE)
     return redirect(reverse('myapp:show_post', args=(post.pk,)))
 
 
 def search(request):
-    posts = Post.objects.all()
-    query = request.GET['search'].lower()
-    results = [post for post in posts if query in post.text.lower() or query in post.title.lower()]
-    return render(request, 'myapp/post_template.html', context={'posts': results})
+    query = request.GET.get('search', '')
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    page_size = get_page_size(request)
+    results = search_posts(query, offset=(page - 1) * page_size, limit=page_size + 1)
+    return render(request, 'myapp/post_template.html', context={
+        'posts': results[:page_size],
+        'cards': caching.render_post_cards(results[:page_size]),
+        'query': query,
+        'page_number': page,
+        'has_next': len(results) > page_size,
+    })